@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from datetime import timedelta
+from importlib.util import find_spec
 import os
 from pathlib import Path
 from decouple import config
@@ -54,6 +55,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'wh.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,8 +73,14 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_AUTHENTICATION_CLASSES':[
         # 'rest_framework.authentication.TokenAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication'
-    ]
+        'users.authentication.StatelessJWTAuthentication'
+    ],
+    'DEFAULT_RENDERER_CLASSES':[
+        'wh.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'wh.pagination.KeysetPagination',
+    'PAGE_SIZE': config('PAGE_SIZE', default=100, cast=int),
 }
 
 SIMPLE_JWT = {
@@ -159,6 +167,32 @@ DATABASES = {
 # }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Set REDIS_URL (e.g. redis://localhost:6379/1, needs the redis package) to share
+# the cache between worker processes, otherwise every process keeps its own copy.
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'warehouse',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+# Whether every worker process sees the same cache. State that has to reach the
+# other workers (BOM changes, role changes, blacklisted tokens) relies on it.
+CACHE_SHARED = config('CACHE_SHARED', default=bool(REDIS_URL), cast=bool)
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -177,6 +211,27 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# New hashes use USERS_PASSWORD_HASHER, argon2 by default when installed;
+# hashes of the others still verify and are upgraded at the next login.
+USERS_PASSWORD_HASHER = config('USERS_PASSWORD_HASHER', default='argon2' if find_spec('argon2') else 'pbkdf2')
+USERS_PBKDF2_ITERATIONS = config('USERS_PBKDF2_ITERATIONS', default=870000, cast=int)
+USERS_ARGON2_TIME_COST = config('USERS_ARGON2_TIME_COST', default=2, cast=int)
+USERS_ARGON2_MEMORY_COST = config('USERS_ARGON2_MEMORY_COST', default=102400, cast=int)
+USERS_ARGON2_PARALLELISM = config('USERS_ARGON2_PARALLELISM', default=8, cast=int)
+
+PASSWORD_HASHERS = [
+    'users.hashers.PBKDF2PasswordHasher',
+    'users.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+if USERS_PASSWORD_HASHER == 'argon2':
+    PASSWORD_HASHERS.insert(0, PASSWORD_HASHERS.pop(1))
+
+# Logins and refreshes write last_login at most once per interval and user
+USERS_LAST_LOGIN_INTERVAL = config('USERS_LAST_LOGIN_INTERVAL', default=300, cast=int)
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -206,4 +261,19 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'users.User'
 
-CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
+CORS_ALLOW_ALL_ORIGINS = True
+
+#Warehouse app settings
+WH_BULK_CHUNK_SIZE = config('WH_BULK_CHUNK_SIZE', default=1000, cast=int)
+WH_BOM_CACHE_SIZE = config('WH_BOM_CACHE_SIZE', default=100000, cast=int)
+# Backstop for BOM changes made by other workers, which a per-process cache cannot announce
+WH_BOM_CACHE_TTL = config('WH_BOM_CACHE_TTL', default=3600 if CACHE_SHARED else 30, cast=int)
+WH_LIST_CACHE_TIMEOUT = config('WH_LIST_CACHE_TIMEOUT', default=300, cast=int)
+WH_MAX_PAGE_SIZE = config('WH_MAX_PAGE_SIZE', default=1000, cast=int)
+WH_EXPORT_CHUNK_SIZE = config('WH_EXPORT_CHUNK_SIZE', default=2000, cast=int)
+WH_RESERVATION_RETRIES = config('WH_RESERVATION_RETRIES', default=3, cast=int)
+WH_VECTORIZE_MIN_LINES = config('WH_VECTORIZE_MIN_LINES', default=2500, cast=int)
+WH_BOM_SNAPSHOT = config('WH_BOM_SNAPSHOT', default=False, cast=bool)
+WH_BOM_SNAPSHOT_PATH = config('WH_BOM_SNAPSHOT_PATH', default='')
+WH_SLOW_REQUEST_SECONDS = config('WH_SLOW_REQUEST_SECONDS', default=1.0, cast=float)
+WH_METRICS_TOKEN = config('WH_METRICS_TOKEN', default='')
@@ -0,0 +1,167 @@
+import hashlib
+import threading
+import time
+from math import ceil, log
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+GENERATION_KEY = 'users:blacklist:generation'
+# Processes further behind than this reload the blacklist instead of replaying it
+MAX_REPLAYED_JTIS = 1000
+REPLAY_TIMEOUT = 24*60*60
+
+
+def jti_key(generation):
+    return f'users:blacklist:{generation}'
+
+
+class BloomFilter:
+    """
+    Set membership in a bit array: no false negatives, and about
+    ``error_rate`` false positives until more than ``capacity`` items are in.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = ceil(-capacity*log(error_rate)/log(2)**2)
+        self.hashes = max(1, round(self.size/capacity*log(2)))
+        self.bits = bytearray((self.size+7)//8)
+        self.count = 0
+
+    def positions(self, item):
+        # Double hashing: every probe derives from one 128-bit digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first+i*step) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+def record_blacklisted(jti):
+    """Publish a newly blacklisted JTI to the other processes under the next generation."""
+    try:
+        generation = cache.incr(GENERATION_KEY)
+    except ValueError:
+        # No counter yet, or evicted: start above anything handed out before
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.incr(GENERATION_KEY)
+    cache.set(jti_key(generation), jti, REPLAY_TIMEOUT)
+
+
+class BlacklistFilter:
+    """
+    Per-process Bloom filter of the JTIs of unexpired blacklisted tokens, so
+    checking a token that is not blacklisted, nearly all of them, does not
+    touch the database. A hit still has to be confirmed there.
+
+    The filter is loaded once with a single query and kept current from the
+    JTIs other processes publish in the shared cache under a generation
+    counter, like the BOM snapshot. If a process falls too far behind or an
+    entry was evicted, it loads the filter again. Without a shared cache
+    (``CACHE_SHARED``) those JTIs never reach the other processes, so a miss
+    is not trusted and the database answers every check.
+    """
+
+    def __init__(self):
+        self._filter = None
+        self._generation = None
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.database_checks = 0
+
+    def current_generation(self):
+        generation = cache.get(GENERATION_KEY)
+        if generation is None:
+            cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+            generation = cache.get(GENERATION_KEY)
+        return generation
+
+    def load(self, generation):
+        jtis = list(
+            BlacklistedToken.objects.filter(token__expires_at__gt=aware_utcnow())
+            .values_list('token__jti', flat=True)
+        )
+        # Room to grow before false positives build up
+        bloom = BloomFilter(max(2*len(jtis), 1024))
+        for jti in jtis:
+            bloom.add(jti)
+        self._filter = bloom
+        self._generation = generation
+        self.loads += 1
+
+    def refresh(self):
+        generation = self.current_generation()
+        with self._lock:
+            if self._filter is not None and generation == self._generation:
+                return self._filter
+            behind = generation-self._generation if self._filter is not None else None
+            if behind is not None and 0 < behind <= MAX_REPLAYED_JTIS:
+                keys = [jti_key(replayed) for replayed in range(self._generation+1, generation+1)]
+                jtis = cache.get_many(keys)
+                if len(jtis) == len(keys) and self._filter.count+len(jtis) <= self._filter.capacity:
+                    for jti in jtis.values():
+                        self._filter.add(jti)
+                    self._generation = generation
+                    return self._filter
+            self.load(generation)
+            return self._filter
+
+    def might_contain(self, jti):
+        return jti in self.refresh()
+
+    def is_blacklisted(self, jti):
+        if settings.CACHE_SHARED and not self.might_contain(jti):
+            return False
+        self.database_checks += 1
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+    def add(self, jti):
+        """Blacklist ``jti`` in this process now, and in every process once committed."""
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(jti)
+        transaction.on_commit(lambda: record_blacklisted(jti))
+
+    def clear(self):
+        with self._lock:
+            self._filter = None
+            self._generation = None
+
+
+blacklist_filter = BlacklistFilter()
+
+
+def prune_expired_tokens(batch_size=1000):
+    """
+    Delete the outstanding tokens past their expiry, with their blacklist
+    entries, ``batch_size`` at a time: batches walk the primary key, so neither
+    a statement nor a transaction grows with the tables. Returns ``(outstanding
+    deleted, blacklisted deleted)``.
+    """
+    now = aware_utcnow()
+    outstanding = blacklisted = 0
+    last_id = 0
+    while True:
+        ids = list(
+            OutstandingToken.objects.filter(pk__gt=last_id, expires_at__lte=now)
+            .order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return outstanding, blacklisted
+        last_id = ids[-1]
+        with transaction.atomic():
+            _, deleted = OutstandingToken.objects.filter(pk__in=ids).only('pk').delete()
+        outstanding += deleted.get(OutstandingToken._meta.label, 0)
+        blacklisted += deleted.get(BlacklistedToken._meta.label, 0)
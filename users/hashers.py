@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2 hasher with ``USERS_PBKDF2_ITERATIONS`` iterations. Hashes
+    stored with another count are rehashed with it at the next login.
+    """
+
+    @property
+    def iterations(self):
+        return settings.USERS_PBKDF2_ITERATIONS
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """Django's Argon2 hasher with the ``USERS_ARGON2_*`` costs."""
+
+    @property
+    def time_cost(self):
+        return settings.USERS_ARGON2_TIME_COST
+
+    @property
+    def memory_cost(self):
+        return settings.USERS_ARGON2_MEMORY_COST
+
+    @property
+    def parallelism(self):
+        return settings.USERS_ARGON2_PARALLELISM
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from users.blacklist import prune_expired_tokens
+
+
+class Command(BaseCommand):
+    help = 'Delete expired outstanding and blacklisted tokens in batches. Meant to run periodically, e.g. from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tokens deleted per statement.')
+
+    def handle(self, *args, batch_size, **options):
+        outstanding, blacklisted = prune_expired_tokens(batch_size)
+        self.stdout.write(f'Deleted {outstanding} outstanding and {blacklisted} blacklisted expired tokens')
@@ -2,7 +2,8 @@ import uuid
 
 from django.db import models
 from django.contrib.auth.models import AbstractUser
-from rest_framework_simplejwt.tokens import RefreshToken
+
+from .tokens import RoleRefreshToken
 
 MANAGER, ADMIN, ORDINARY_USER = "manager", "admin", "ordinary_user"
 
@@ -20,7 +21,7 @@ class User(AbstractUser):
         return f"{self.first_name} {self.last_name}"
     
     def token(self):
-        refresh = RefreshToken.for_user(self)
+        refresh = RoleRefreshToken.for_user(self)
         return {
             "access": str(refresh.access_token),
             "refresh_token": str(refresh)
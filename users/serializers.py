@@ -1,14 +1,14 @@
 from typing import Any, Dict
-from django.contrib.auth.models import update_last_login
 from django.contrib.auth.password_validation import validate_password
-from django.contrib.auth import authenticate
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from rest_framework.generics import get_object_or_404
 
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer,  TokenRefreshSerializer
-from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from rest_framework_simplejwt.settings import api_settings
+from .authentication import touch_last_login
 from .models import User
+from .tokens import ROLE_CLAIM, RoleRefreshToken
 
 class UserSerializer(serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True, required=False)
@@ -116,6 +116,7 @@ class ChangePasswordSerializer(serializers.Serializer):
         
 
 class LoginSerializer(TokenObtainPairSerializer):
+    token_class = RoleRefreshToken
     username = serializers.CharField(required=True)
     password = serializers.CharField(required=True, write_only=True)
 
@@ -123,14 +124,18 @@ class LoginSerializer(TokenObtainPairSerializer):
         username = attrs.get('username')
         password = attrs.get('password')
         user = User.objects.filter(username=username).first()
-        if user is None or not user.check_password(password):
+        if user is None:
+            # Hash anyway, or the response time tells which usernames exist
+            User().set_password(password)
+            raise serializers.ValidationError("Invalid username or password.")
+        if not user.check_password(password):
             raise serializers.ValidationError("Invalid username or password.")
         
         if not user.is_active:
             raise serializers.ValidationError("User account is disabled.")
 
-        user = authenticate(username=username, password=password)
-        refresh = RefreshToken.for_user(user)
+        touch_last_login(user.pk)
+        refresh = self.get_token(user)
         response_data = {
             'access': str(refresh.access_token),
             'refresh': str(refresh),
@@ -140,12 +145,29 @@ class LoginSerializer(TokenObtainPairSerializer):
         return response_data
 
 class RefreshTokenSerializer(TokenRefreshSerializer):
+    token_class = RoleRefreshToken
+
     def validate(self, attrs: Dict[str, Any]) -> Dict[str, str]:
-        data = super().validate(attrs)
-        acces_token_instance = AccessToken(data["access"])
-        user_id = acces_token_instance['user_id']
-        user = get_object_or_404(User, id=user_id)
-        update_last_login(None, user)
+        # TokenRefreshSerializer.validate with a single, narrow user lookup
+        refresh = self.token_class(attrs['refresh'])
+        user = User.objects.filter(id=refresh.payload.get(api_settings.USER_ID_CLAIM))\
+            .only('id', 'role', 'is_active').first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        touch_last_login(user.pk)
+
+        access = refresh.access_token
+        # The role claim of the refresh token dates from login
+        access[ROLE_CLAIM] = user.role
+        data = {'access': str(access)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data['refresh'] = str(refresh)
         return data
     
 
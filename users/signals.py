@@ -0,0 +1,24 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .authentication import record_auth_change
+from .models import User
+
+
+AUTH_FIELDS = {'role', 'is_active'}
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Saves of other fields, like last_login on every login, change nothing for tokens
+    if created or (update_fields is not None and not AUTH_FIELDS & set(update_fields)):
+        return
+    user_id, role, is_active = str(instance.pk), instance.role, instance.is_active
+    transaction.on_commit(lambda: record_auth_change(user_id, role, is_active))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    user_id, role = str(instance.pk), instance.role
+    transaction.on_commit(lambda: record_auth_change(user_id, role, False))
@@ -1,7 +1,24 @@
+import uuid
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
-from .models import User  
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from .authentication import auth_change_key, last_login_key
+from .blacklist import BloomFilter, BlacklistFilter, GENERATION_KEY, blacklist_filter, jti_key
+from .hashers import PBKDF2PasswordHasher
+from .models import User, MANAGER, ORDINARY_USER
+from .tokens import ROLE_CLAIM
 
 class UserAPITests(APITestCase):
 
@@ -51,3 +68,201 @@ class UserAPITests(APITestCase):
         }
         response = self.client.post(url, data)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST) 
+
+
+@override_settings(CACHE_SHARED=True)
+class StatelessAuthenticationTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='manager', role=MANAGER)
+        self.user.set_password('testpassword123')
+        self.user.save()
+
+    def authorize(self, access):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def create_material(self):
+        return self.client.post('/wh/material/create/', {'material_name': 'Steel'}, format='json')
+
+    def test_login_tokens_carry_the_role(self):
+        response = self.client.post(reverse('login'), {'username': 'manager', 'password': 'testpassword123'})
+        self.assertEqual(AccessToken(response.data['access'])[ROLE_CLAIM], MANAGER)
+        self.assertEqual(AccessToken(self.user.token()['access'])[ROLE_CLAIM], MANAGER)
+
+    def test_requests_do_not_load_the_user(self):
+        self.authorize(self.user.token()['access'])
+        with self.assertNumQueries(0):
+            response = self.client.get('/wh/bom-cache/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.create_material().status_code, status.HTTP_200_OK)
+
+    def test_role_changes_apply_to_issued_tokens(self):
+        self.authorize(self.user.token()['access'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.role = ORDINARY_USER
+            self.user.save()
+        self.assertEqual(self.create_material().status_code, status.HTTP_403_FORBIDDEN)
+        # Refreshed access tokens carry the current role
+        refreshed = self.client.post(reverse('login-refresh'), {'refresh': self.user.token()['refresh_token']})
+        self.assertEqual(AccessToken(refreshed.data['access'])[ROLE_CLAIM], ORDINARY_USER)
+
+    def test_deactivated_and_deleted_users_are_rejected(self):
+        self.authorize(self.user.token()['access'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/wh/bom-cache/stats/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+        other = User.objects.create(username='other', role=MANAGER)
+        self.authorize(other.token()['access'])
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual(self.client.get('/wh/bom-cache/stats/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_last_login_updates_record_no_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            update_last_login(None, self.user)
+        self.assertIsNone(cache.get(auth_change_key(str(self.user.pk))))
+
+    @override_settings(CACHE_SHARED=False)
+    def test_without_shared_cache_users_come_from_the_database(self):
+        self.authorize(self.user.token()['access'])
+        with self.assertNumQueries(1):
+            self.client.get('/wh/bom-cache/stats/')
+        # As another worker would: its cache is not this one
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.role = ORDINARY_USER
+            self.user.save()
+        cache.clear()
+        self.assertEqual(self.create_material().status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_tokens_without_role_claim_use_the_database(self):
+        self.authorize(RefreshToken.for_user(self.user).access_token)
+        with self.assertNumQueries(1):
+            response = self.client.get('/wh/bom-cache/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.create_material().status_code, status.HTTP_200_OK)
+
+
+class TokenBlacklistTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        blacklist_filter.clear()
+        self.user = User.objects.create(username='manager', role=MANAGER)
+        self.tokens = self.user.token()
+
+    def refresh(self, refresh_token):
+        return self.client.post(reverse('login-refresh'), {'refresh': refresh_token})
+
+    def logout(self, tokens):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('logout'), {'refresh': tokens['refresh_token']})
+
+    @override_settings(CACHE_SHARED=True)
+    def test_valid_tokens_skip_the_blacklist_table(self):
+        self.refresh(self.tokens['refresh_token'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.refresh(self.tokens['refresh_token'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries.captured_queries if 'blacklistedtoken' in query['sql']])
+
+    def test_without_shared_cache_the_database_decides(self):
+        self.assertEqual(self.refresh(self.tokens['refresh_token']).status_code, status.HTTP_200_OK)
+        # Blacklisted by another process, whose cache this one does not see
+        token = RefreshToken(self.tokens['refresh_token'], verify=False)
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=token['jti']))
+        self.assertEqual(self.refresh(self.tokens['refresh_token']).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    @override_settings(CACHE_SHARED=True)
+    def test_logout_reaches_other_processes(self):
+        other_process = BlacklistFilter()
+        other_process.refresh()
+        self.assertEqual(self.logout(self.tokens).status_code, 205)
+        self.assertEqual(self.refresh(self.tokens['refresh_token']).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        jti = RefreshToken(self.tokens['refresh_token'], verify=False)['jti']
+        self.assertTrue(other_process.might_contain(jti))
+        self.assertEqual(other_process.loads, 1)
+
+    @override_settings(CACHE_SHARED=True)
+    def test_evicted_entries_reload_the_filter(self):
+        other_process = BlacklistFilter()
+        other_process.refresh()
+        self.logout(self.tokens)
+        cache.delete(jti_key(cache.get(GENERATION_KEY)))
+        jti = RefreshToken(self.tokens['refresh_token'], verify=False)['jti']
+        self.assertTrue(other_process.is_blacklisted(jti))
+        self.assertEqual(other_process.loads, 2)
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(5000)
+        members = [uuid.uuid4().hex for _ in range(5000)]
+        for member in members:
+            bloom.add(member)
+        self.assertTrue(all(member in bloom for member in members))
+        false_positives = sum(uuid.uuid4().hex in bloom for _ in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_prune_tokens(self):
+        self.logout(self.tokens)
+        expired = [RefreshToken.for_user(self.user) for _ in range(5)]
+        for token in expired[:2]:
+            token.blacklist()
+        OutstandingToken.objects.filter(jti__in=[token['jti'] for token in expired]).update(expires_at=timezone.now())
+        out = StringIO()
+        call_command('prune_tokens', batch_size=2, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Deleted 5 outstanding and 2 blacklisted expired tokens')
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+
+
+@override_settings(PASSWORD_HASHERS=['users.hashers.PBKDF2PasswordHasher'], USERS_PBKDF2_ITERATIONS=1000)
+class LoginPathTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='manager', role=MANAGER)
+        self.user.set_password('testpassword123')
+        self.user.save()
+
+    def login(self, username='manager', password='testpassword123'):
+        with patch.object(PBKDF2PasswordHasher, 'encode', autospec=True, side_effect=PBKDF2PasswordHasher.encode) as encode:
+            response = self.client.post(reverse('login'), {'username': username, 'password': password})
+        return response, encode.call_count
+
+    def test_login_hashes_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response, hashes = self.login()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(hashes, 1)
+        self.assertEqual(len([query for query in queries.captured_queries if query['sql'].startswith('SELECT') and 'users_user' in query['sql']]), 1)
+
+        for username, password in [('manager', 'wrongpassword'), ('nobody', 'testpassword123')]:
+            response, hashes = self.login(username, password)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(hashes, 1)
+
+    @override_settings(USERS_PBKDF2_ITERATIONS=2000)
+    def test_iterations_change_rehashes_at_login(self):
+        self.assertEqual(self.login()[0].status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$2000$'))
+
+    def test_last_login_writes_are_throttled(self):
+        self.login()
+        first_login = User.objects.get(pk=self.user.pk).last_login
+        self.assertIsNotNone(first_login)
+        refresh = self.user.token()['refresh_token']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('login-refresh'), {'refresh': refresh})
+            self.login()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries.captured_queries if query['sql'].startswith('UPDATE')])
+        self.assertEqual(User.objects.get(pk=self.user.pk).last_login, first_login)
+
+        cache.delete(last_login_key(self.user.pk))
+        self.client.post(reverse('login-refresh'), {'refresh': refresh})
+        self.assertGreater(User.objects.get(pk=self.user.pk).last_login, first_login)
@@ -3,11 +3,12 @@ from rest_framework.generics import CreateAPIView,UpdateAPIView
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from rest_framework_simplejwt.exceptions import TokenError
-from rest_framework_simplejwt.tokens import RefreshToken
 
 from .models import User
+from .tokens import RoleRefreshToken
 from .serializers import LogoutSerializer, RefreshTokenSerializer, UserSerializer, UpdateUserSerializer,\
     ChangePasswordSerializer, LoginSerializer
 
@@ -19,6 +20,8 @@ class CreateUserAPIView(CreateAPIView):
     
 class UpdateUserInfoAPIView(UpdateAPIView):
     serializer_class = UpdateUserSerializer
+    # Works with the user row, not just the token claims
+    authentication_classes = [JWTAuthentication,]
     permission_classes = [IsAuthenticated,]
     http_method_names = ['put', 'patch']
     
@@ -43,6 +46,7 @@ class UpdateUserInfoAPIView(UpdateAPIView):
 
 class ChangePasswordAPIView(UpdateAPIView):
     serializer_class = ChangePasswordSerializer
+    authentication_classes = [JWTAuthentication,]
     permission_classes = [IsAuthenticated,]
     
     def get_object(self):
@@ -61,23 +65,6 @@ class ChangePasswordAPIView(UpdateAPIView):
 
 class LoginAPIView(TokenObtainPairView):
     serializer_class = LoginSerializer
-    def post(self, request, *args, **kwargs):
-        # Call the parent method to generate tokens
-        response = super().post(request, *args, **kwargs)
-        
-        # Check if both 'access' and 'refresh' tokens are in the response
-        if 'access' in response.data:
-            print("Access Token:", response.data['access'])
-        else:
-            print("No Access Token found.")
-        
-        if 'refresh' in response.data:
-            print("Refresh Token:", response.data['refresh'])
-        else:
-            print("No Refresh Token found.")
-        
-        # Return the response as usual
-        return response
 
 class LoginRefreshAPIView(TokenRefreshView):
     serializer_class = RefreshTokenSerializer
@@ -91,7 +78,7 @@ class LogoutAPIView(APIView):
         serializer.is_valid(raise_exception=True)
         try:
             refresh_token = self.request.data['refresh']
-            token = RefreshToken(refresh_token)
+            token = RoleRefreshToken(refresh_token)
             token.blacklist()
             return Response({
                 'success':True,
@@ -102,6 +89,7 @@ class LogoutAPIView(APIView):
         
 
 class DashboardAPIView(APIView):
+    authentication_classes = [JWTAuthentication,]
     permission_classes = [IsAuthenticated,]
     
     def get(self, request):
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Product, Material, ProductMaterial, Warehouse
+from .models import Product, Material, ProductMaterial, ProductComponent, Warehouse, Reservation, ReservationLine,\
+    StockMovement, MaterialBalance, MaterialStockSummary
 
 
 class MaterialAdmin(admin.ModelAdmin):
@@ -12,4 +13,10 @@ class ProductAdmin(admin.ModelAdmin):
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Material, MaterialAdmin)
 admin.site.register(ProductMaterial)
+admin.site.register(ProductComponent)
 admin.site.register(Warehouse)
+admin.site.register(Reservation)
+admin.site.register(ReservationLine)
+admin.site.register(StockMovement)
+admin.site.register(MaterialBalance)
+admin.site.register(MaterialStockSummary)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class WhConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'wh'
+
+    def ready(self):
+        from . import signals
@@ -0,0 +1,186 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, AuthenticationFailed, MethodNotAllowed, NotAuthenticated
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.serializers import as_serializer_error
+from rest_framework.views import get_view_name, get_view_description
+
+from users.authentication import StatelessJWTAuthentication
+from .availability import acheck_availability, acheck_availability_rollup, atrack_material_batches,\
+    atrack_material_batches_rollup
+from .bom import BOMCycleError
+from .caching import aget_generations, list_cache_key
+from .fast_serializers import ProductReadSerializer, MaterialReadSerializer,\
+    ProductMaterialReadSerializer, ProductComponentReadSerializer, WarehouseReadSerializer
+from .models import Product, ProductMaterial, ProductComponent, Material, Warehouse
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .serializers import ProductOrderSerializer, cyclic_bom_error
+from .views import product_material_queryset, product_component_queryset, warehouse_queryset
+
+
+class AsyncAPIView(View):
+    """
+    Base of the async-native (ASGI) endpoints. DRF's ``APIView`` dispatches
+    synchronously, so this does the part of its work these endpoints need:
+    JWT authentication, JSON bodies, errors in DRF's format and the same
+    renderer. Handlers return the response data.
+    """
+    http_method_names = ['get', 'post']
+    # Like IsAuthenticated; AllowAny endpoints still authenticate a token when one is sent
+    authentication_required = True
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token authentication only, so no CSRF like APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        authenticator = StatelessJWTAuthentication()
+        request = Request(request, parsers=[JSONParser()], authenticators=[authenticator])
+        try:
+            if authenticator.get_header(request) is None:
+                self.authenticate(request)
+            else:
+                # Reads the shared cache, or the database without one
+                await sync_to_async(self.authenticate)(request)
+            method = request.method.lower()
+            if method == 'options':
+                return self.render(self.metadata(), headers={'Allow': ', '.join(self.allowed_methods())})
+            if method == 'head':
+                method = 'get'
+            if method not in self.http_method_names or not hasattr(self, method):
+                raise MethodNotAllowed(request.method)
+            return self.render(await getattr(self, method)(request, *args, **kwargs))
+        except APIException as exc:
+            headers = {}
+            if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+                headers['WWW-Authenticate'] = authenticator.authenticate_header(request)
+            data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return self.render(data, exc.status_code, headers)
+
+    def authenticate(self, request):
+        if not request.user.is_authenticated and self.authentication_required:
+            raise NotAuthenticated()
+
+    def allowed_methods(self):
+        # Like APIView: OPTIONS always, HEAD along with GET
+        methods = [method.upper() for method in self.http_method_names if hasattr(self, method)]
+        if 'GET' in methods:
+            methods.append('HEAD')
+        return methods+['OPTIONS']
+
+    def metadata(self):
+        """What DRF's SimpleMetadata answers to OPTIONS."""
+        return {
+            'name': get_view_name(self),
+            'description': get_view_description(self),
+            'renders': [FastJSONRenderer.media_type],
+            'parses': [JSONParser.media_type],
+        }
+
+    def render(self, data, status=200, headers=None):
+        return HttpResponse(
+            FastJSONRenderer().render(data), status=status, headers=headers, content_type='application/json'
+        )
+
+
+class AsyncProductOrderAPIView(AsyncAPIView):
+    http_method_names = ['post']
+    authentication_required = False
+    check = None
+    check_rollup = None
+
+    async def post(self, request, *args, **kwargs):
+        serializer = ProductOrderSerializer(data=request.data)
+        if not serializer.is_valid():
+            return serializer.errors
+        validated_data = serializer.validated_data
+        check = self.check_rollup if validated_data['rollup'] else self.check
+        try:
+            return {
+                'data':await check(validated_data['products'])
+            }
+        except BOMCycleError as exc:
+            return as_serializer_error(cyclic_bom_error(exc))
+
+
+class AsyncCheckAvailibilityAPIView(AsyncProductOrderAPIView):
+    check = staticmethod(acheck_availability)
+    check_rollup = staticmethod(acheck_availability_rollup)
+
+
+class AsyncMaterialBatchTrackingAPIView(AsyncProductOrderAPIView):
+    check = staticmethod(atrack_material_batches)
+    check_rollup = staticmethod(atrack_material_batches_rollup)
+
+
+class AsyncListAPIView(AsyncAPIView):
+    """
+    Async counterpart of the cached ``values()`` list views: the same pages,
+    cursors and list cache invalidation, with rows fetched by async iteration.
+    """
+    http_method_names = ['get']
+    read_serializer_class = None
+    cache_models = ()
+    queryset = None
+    pagination_class = KeysetPagination
+
+    async def get(self, request, *args, **kwargs):
+        key = list_cache_key(self, request, await aget_generations(self.cache_models))
+        data = await cache.aget(key)
+        if data is None:
+            data = await self.list(request)
+            await cache.aset(key, data, settings.WH_LIST_CACHE_TIMEOUT)
+        return data
+
+    async def list(self, request):
+        serializer = self.read_serializer_class
+        queryset = serializer.values(self.queryset.all())
+        paginator = self.pagination_class()
+        page = await paginator.apaginate_queryset(queryset, request, self)
+        if page is None:
+            return serializer.many([row async for row in queryset])
+        return paginator.get_paginated_response(serializer.many(page)).data
+
+
+class AsyncProductListAPIView(AsyncListAPIView):
+    read_serializer_class = ProductReadSerializer
+    cache_models = [Product]
+    queryset = Product.objects.all()
+
+
+class AsyncMaterialListAPIView(AsyncListAPIView):
+    read_serializer_class = MaterialReadSerializer
+    cache_models = [Material]
+    queryset = Material.objects.all()
+
+
+class AsyncProductMaterialListAPIView(AsyncListAPIView):
+    read_serializer_class = ProductMaterialReadSerializer
+    cache_models = [ProductMaterial, Product, Material]
+    queryset = product_material_queryset
+
+
+class AsyncProductComponentListAPIView(AsyncListAPIView):
+    read_serializer_class = ProductComponentReadSerializer
+    cache_models = [ProductComponent, Product]
+    queryset = product_component_queryset
+
+
+class AsyncWarehouseListAPIView(AsyncListAPIView):
+    read_serializer_class = WarehouseReadSerializer
+    cache_models = [Warehouse, Material]
+    queryset = warehouse_queryset
+
+    async def get(self, request, *args, **kwargs):
+        return {
+            'success':True,
+            'message':'Warehous loaded successfully!',
+            'data':await super().get(request, *args, **kwargs)
+        }
@@ -0,0 +1,484 @@
+import asyncio
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .bom import load_components, load_materials, aload_components, aload_materials, explode
+from .bom_cache import bom_cache
+from .bom_snapshot import bom_snapshot
+from .models import Product, ProductMaterial, Warehouse, MaterialBalance
+from . import vectorized
+
+
+UNMATCHED_PRODUCT_MESSAGE = 'Unmatched product code.'
+
+
+def product_rows(products):
+    # The first level of sub-assemblies comes along with the products
+    return products.order_by('components__pk')\
+        .values_list('id', 'product_code', 'product_name', 'components__component_id', 'components__quantity')
+
+
+def split_product_rows(rows):
+    """Return ``({product_id: (product_code, product_name)}, {product_id: first level components})``."""
+    headers = {}
+    components = {}
+    for product_id, product_code, product_name, component_id, quantity in rows:
+        headers[product_id] = (product_code, product_name)
+        children = components.setdefault(product_id, [])
+        if component_id is not None:
+            children.append((component_id, quantity))
+    return headers, components
+
+
+def sub_assembly_ids(components):
+    return {component_id for children in components.values() for component_id, _ in children}
+
+
+def flattened_products(headers, components, materials):
+    boms = explode(headers, components, materials)
+    return {
+        product_id: (product_code, product_name, boms[product_id])
+        for product_id, (product_code, product_name) in headers.items()
+    }
+
+
+def fetch_products(products):
+    """
+    Load ``{product_id: (product_code, product_name, bom)}`` for a ``Product``
+    queryset, where ``bom`` is the flattened tuple of ``(material_id,
+    material_name, quantity)`` per unit, sub-assemblies included. Products
+    without sub-assemblies take two queries in total, each further BOM level
+    one more.
+    """
+    headers, components = split_product_rows(product_rows(products))
+    if not headers:
+        return {}
+    load_components(sub_assembly_ids(components), components)
+    return flattened_products(headers, components, load_materials(components))
+
+
+async def afetch_products(products):
+    """Async ``fetch_products``, same queries."""
+    headers, components = split_product_rows([row async for row in product_rows(products)])
+    if not headers:
+        return {}
+    await aload_components(sub_assembly_ids(components), components)
+    return flattened_products(headers, components, await aload_materials(components))
+
+
+def fetch_catalogue(product_codes):
+    """
+    Load ``{product_code: (product_id, product_name, bom)}`` from the database.
+    Unknown codes are simply missing from the result.
+    """
+    return {
+        product_code: (product_id, product_name, bom)
+        for product_id, (product_code, product_name, bom)
+        in fetch_products(Product.objects.filter(product_code__in=product_codes)).items()
+    }
+
+
+async def afetch_catalogue(product_codes):
+    """Async ``fetch_catalogue``."""
+    return {
+        product_code: (product_id, product_name, bom)
+        for product_id, (product_code, product_name, bom)
+        in (await afetch_products(Product.objects.filter(product_code__in=product_codes))).items()
+    }
+
+
+def load_catalogue(product_codes):
+    """
+    Resolve product codes to ``{product_code: (product_name, bom)}``, from the
+    BOM snapshot when ``WH_BOM_SNAPSHOT`` is on, otherwise serving what it can
+    from the BOM cache and loading the rest in two queries.
+    """
+    if settings.WH_BOM_SNAPSHOT:
+        return bom_snapshot.get().lookup(product_codes)
+    catalogue, missing = bom_cache.get_many(set(product_codes))
+    if missing:
+        version = bom_cache.version
+        loaded = fetch_catalogue(missing)
+        bom_cache.set_many(loaded, version)
+        for product_code, (_, product_name, bom) in loaded.items():
+            catalogue[product_code] = (product_name, bom)
+    return catalogue
+
+
+async def acache_catalogue(product_codes):
+    """Load ``product_codes`` from the database into the BOM cache; returns them like ``load_catalogue``."""
+    version = bom_cache.version
+    loaded = await afetch_catalogue(product_codes)
+    bom_cache.set_many(loaded, version)
+    return {product_code: (product_name, bom) for product_code, (_, product_name, bom) in loaded.items()}
+
+
+async def aload_catalogue(product_codes):
+    """Async ``load_catalogue``."""
+    if settings.WH_BOM_SNAPSHOT:
+        return (await sync_to_async(bom_snapshot.get)()).lookup(product_codes)
+    catalogue, missing = bom_cache.get_many(set(product_codes))
+    if missing:
+        catalogue.update(await acache_catalogue(missing))
+    return catalogue
+
+
+def bom_material_ids(catalogue):
+    """Return the set of material ids used by any BOM in ``catalogue``."""
+    return {
+        material_id
+        for _, bom in catalogue.values()
+        for material_id, _, _ in bom
+    }
+
+
+def load_stock(material_ids):
+    """
+    Return ``{material_id: total remainder}`` from the incrementally maintained
+    ledger balances: one primary key lookup per material, in a single query.
+    """
+    if not material_ids:
+        return {}
+    return dict(
+        MaterialBalance.objects.filter(material_id__in=material_ids)
+        .values_list('material_id', 'quantity')
+    )
+
+
+async def aload_stock(material_ids):
+    """Async ``load_stock``."""
+    if not material_ids:
+        return {}
+    return {
+        material_id: quantity
+        async for material_id, quantity in MaterialBalance.objects.filter(material_id__in=material_ids)
+        .values_list('material_id', 'quantity')
+    }
+
+
+async def aload_direct_stock(product_codes):
+    """
+    Stock of the direct materials of ``product_codes``, found through the
+    codes so it needs no resolved product. Returns ``(material ids looked up,
+    {material_id: total remainder})``.
+    """
+    material_ids = set()
+    stock = {}
+    rows = ProductMaterial.objects.filter(product__product_code__in=product_codes)\
+        .values_list('material_id', 'material__balance__quantity')
+    async for material_id, quantity in rows:
+        material_ids.add(material_id)
+        if quantity is not None:
+            stock[material_id] = quantity
+    return material_ids, stock
+
+
+async def aload_order(product_codes):
+    """
+    Async ``load_catalogue`` plus ``load_stock`` of its materials. Products
+    missing from the BOM cache are resolved concurrently with the stock of
+    the materials already known, those of the cached BOMs and the direct
+    materials of the missing products; only materials reached through
+    sub-assemblies wait for the BOMs, for one more query.
+    """
+    product_codes = set(product_codes)
+    if settings.WH_BOM_SNAPSHOT:
+        catalogue = await aload_catalogue(product_codes)
+        return catalogue, await aload_stock(bom_material_ids(catalogue))
+    catalogue, missing = bom_cache.get_many(product_codes)
+    known_ids = bom_material_ids(catalogue)
+    if not missing:
+        return catalogue, await aload_stock(known_ids)
+
+    loaded, stock, (direct_ids, direct_stock) = await asyncio.gather(
+        acache_catalogue(missing), aload_stock(known_ids), aload_direct_stock(missing)
+    )
+    catalogue.update(loaded)
+    stock.update(direct_stock)
+    stock.update(await aload_stock(bom_material_ids(loaded)-known_ids-direct_ids))
+    return catalogue, stock
+
+
+def load_batches(material_ids):
+    """
+    Return ``{material_id: [(batch_id, price, remainder), ...]}`` for every
+    batch with stock left, in FIFO (batch id) order, using a single query.
+    """
+    batches = defaultdict(list)
+    if not material_ids:
+        return batches
+    rows = Warehouse.objects.filter(material_id__in=material_ids, remainder__gt=0)\
+        .order_by('pk')\
+        .values_list('id', 'material_id', 'price', 'remainder')
+    for batch_id, material_id, price, remainder in rows:
+        batches[material_id].append((batch_id, price, remainder))
+    return batches
+
+
+async def aload_batches(material_ids):
+    """Async ``load_batches``."""
+    batches = defaultdict(list)
+    if not material_ids:
+        return batches
+    rows = Warehouse.objects.filter(material_id__in=material_ids, remainder__gt=0)\
+        .order_by('pk')\
+        .values_list('id', 'material_id', 'price', 'remainder')
+    async for batch_id, material_id, price, remainder in rows:
+        batches[material_id].append((batch_id, price, remainder))
+    return batches
+
+
+class BatchAllocator:
+    """
+    Walks the batches of each material FIFO. Consumption is remembered between
+    calls, so later order lines only see what earlier lines left behind. Every
+    batch is visited at most once over the allocator's lifetime.
+    """
+
+    def __init__(self, batches):
+        self.batches = batches
+        # material_id -> [index of the current batch, quantity left in it]
+        self.cursors = {}
+        self.remaining = {
+            material_id: sum(remainder for _, _, remainder in material_batches)
+            for material_id, material_batches in batches.items()
+        }
+
+    def available(self, material_id):
+        return self.remaining.get(material_id, 0)
+
+    def allocate(self, material_id, quantity):
+        """Take ``quantity`` of a material; return ``(batch takes, missing quantity)``."""
+        material_batches = self.batches.get(material_id, ())
+        cursor = self.cursors.get(material_id)
+        if cursor is None:
+            cursor = self.cursors[material_id] = [0, material_batches[0][2] if material_batches else 0]
+
+        takes = []
+        needed = quantity
+        while needed > 0 and cursor[0] < len(material_batches):
+            batch_id, price, _ = material_batches[cursor[0]]
+            available_quantity = cursor[1]
+            taken_quantity = min(needed, available_quantity)
+            takes.append({
+                'batch_id': batch_id,
+                'price': str(price),
+                'available_quantity': available_quantity,
+                'taken_quantity': taken_quantity
+            })
+            needed -= taken_quantity
+            cursor[1] -= taken_quantity
+            if cursor[1] <= 0:
+                cursor[0] += 1
+                if cursor[0] < len(material_batches):
+                    cursor[1] = material_batches[cursor[0]][2]
+
+        if material_id in self.remaining:
+            self.remaining[material_id] -= quantity - needed
+        return takes, needed
+
+
+def material_status(required_quantity, available_quantity):
+    if available_quantity >= required_quantity:
+        return 'Enough', None
+    return 'Not enough', required_quantity - available_quantity
+
+
+def accumulate_requirements(items, catalogue):
+    """
+    Merge the BOM explosion of every order line into one requirement per
+    material. Returns ``({material_id: [material_name, required_quantity]},
+    unmatched product codes)``.
+    """
+    requirements = {}
+    unmatched_codes = []
+    for item in items:
+        entry = catalogue.get(item['product_code'])
+        if entry is None:
+            unmatched_codes.append(item['product_code'])
+            continue
+        for material_id, material_name, quantity in entry[1]:
+            requirement = requirements.get(material_id)
+            if requirement is None:
+                requirements[material_id] = [material_name, quantity*item['quantity']]
+            else:
+                requirement[1] += quantity*item['quantity']
+    return requirements, unmatched_codes
+
+
+def check_availability(items):
+    """
+    Check every order line against the total stock of its materials.
+    Runs a constant number of queries regardless of the number of lines;
+    large orders are computed with NumPy when it is installed.
+    """
+    catalogue = load_catalogue(item['product_code'] for item in items)
+    return availability_report(items, catalogue, load_stock(bom_material_ids(catalogue)))
+
+
+async def acheck_availability(items):
+    """Async ``check_availability``."""
+    catalogue, stock = await aload_order(item['product_code'] for item in items)
+    return availability_report(items, catalogue, stock)
+
+
+def availability_report(items, catalogue, stock):
+    if vectorized.use_vectorized(len(items)):
+        return vectorized.availability_lines(items, catalogue, stock, UNMATCHED_PRODUCT_MESSAGE)
+
+    required_materials = []
+    for item in items:
+        entry = catalogue.get(item['product_code'])
+        if entry is None:
+            required_materials.append({
+                'input_code': item['product_code'],
+                'message': UNMATCHED_PRODUCT_MESSAGE
+            })
+            continue
+
+        product_name, bom = entry
+        materials = []
+        for material_id, material_name, quantity in bom:
+            required_quantity = quantity*item['quantity']
+            available_quantity = stock.get(material_id, 0)
+            status, shortage = material_status(required_quantity, available_quantity)
+            materials.append({
+                'material_name': material_name,
+                'required_quantity': required_quantity,
+                'available_quantity': available_quantity,
+                'status': status,
+                'shortage': shortage
+            })
+
+        required_materials.append({
+            'product_name': product_name,
+            'materials': materials
+        })
+
+    return required_materials
+
+
+def check_availability_rollup(items):
+    """Like ``check_availability`` but reports each material once for the whole order."""
+    catalogue = load_catalogue(item['product_code'] for item in items)
+    return availability_rollup_report(items, catalogue, load_stock(bom_material_ids(catalogue)))
+
+
+async def acheck_availability_rollup(items):
+    """Async ``check_availability_rollup``."""
+    catalogue, stock = await aload_order(item['product_code'] for item in items)
+    return availability_rollup_report(items, catalogue, stock)
+
+
+def availability_rollup_report(items, catalogue, stock):
+    if vectorized.use_vectorized(len(items)):
+        return {
+            'materials': vectorized.availability_rollup(items, catalogue, stock),
+            'unmatched_product_codes': [item['product_code'] for item in items if item['product_code'] not in catalogue]
+        }
+    requirements, unmatched_codes = accumulate_requirements(items, catalogue)
+
+    materials = []
+    for material_id, (material_name, required_quantity) in requirements.items():
+        available_quantity = stock.get(material_id, 0)
+        status, shortage = material_status(required_quantity, available_quantity)
+        materials.append({
+            'material_id': material_id,
+            'material_name': material_name,
+            'required_quantity': required_quantity,
+            'available_quantity': available_quantity,
+            'status': status,
+            'shortage': shortage
+        })
+
+    return {
+        'materials': materials,
+        'unmatched_product_codes': unmatched_codes
+    }
+
+
+def track_material_batches(items):
+    """
+    Allocate every order line FIFO across the stock batches of its materials,
+    carrying consumption over from one line to the next.
+    """
+    catalogue = load_catalogue(item['product_code'] for item in items)
+    return batch_report(items, catalogue, load_batches(bom_material_ids(catalogue)))
+
+
+async def atrack_material_batches(items):
+    """Async ``track_material_batches``: the batches depend on the BOMs, so they load after them."""
+    catalogue = await aload_catalogue(item['product_code'] for item in items)
+    return batch_report(items, catalogue, await aload_batches(bom_material_ids(catalogue)))
+
+
+def batch_report(items, catalogue, batches):
+    allocator = BatchAllocator(batches)
+
+    required_materials = []
+    for item in items:
+        entry = catalogue.get(item['product_code'])
+        if entry is None:
+            required_materials.append({
+                'input_code': item['product_code'],
+                'message': UNMATCHED_PRODUCT_MESSAGE
+            })
+            continue
+
+        product_name, bom = entry
+        materials = []
+        for material_id, material_name, quantity in bom:
+            required_quantity = quantity*item['quantity']
+            available_quantity = allocator.available(material_id)
+            material_batches, missing_quantity = allocator.allocate(material_id, required_quantity)
+            materials.append({
+                'material_name': material_name,
+                'material_batches': material_batches,
+                'required_quantity': required_quantity,
+                'available_quantity': available_quantity,
+                'missing_quantity': missing_quantity if missing_quantity > 0 else None
+            })
+
+        required_materials.append({
+            'product_name': product_name,
+            'materials': materials
+        })
+
+    return required_materials
+
+
+def track_material_batches_rollup(items):
+    """Like ``track_material_batches`` but allocates each material once for the whole order."""
+    catalogue = load_catalogue(item['product_code'] for item in items)
+    return batch_rollup_report(items, catalogue, load_batches(bom_material_ids(catalogue)))
+
+
+async def atrack_material_batches_rollup(items):
+    """Async ``track_material_batches_rollup``."""
+    catalogue = await aload_catalogue(item['product_code'] for item in items)
+    return batch_rollup_report(items, catalogue, await aload_batches(bom_material_ids(catalogue)))
+
+
+def batch_rollup_report(items, catalogue, batches):
+    requirements, unmatched_codes = accumulate_requirements(items, catalogue)
+    allocator = BatchAllocator(batches)
+
+    materials = []
+    for material_id, (material_name, required_quantity) in requirements.items():
+        available_quantity = allocator.available(material_id)
+        material_batches, missing_quantity = allocator.allocate(material_id, required_quantity)
+        materials.append({
+            'material_id': material_id,
+            'material_name': material_name,
+            'material_batches': material_batches,
+            'required_quantity': required_quantity,
+            'available_quantity': available_quantity,
+            'missing_quantity': missing_quantity if missing_quantity > 0 else None
+        })
+
+    return {
+        'materials': materials,
+        'unmatched_product_codes': unmatched_codes
+    }
@@ -0,0 +1,72 @@
+from .availability import load_catalogue, load_stock, bom_material_ids, accumulate_requirements, material_status
+
+
+INDEPENDENT = 'independent'
+SEQUENTIAL = 'sequential'
+
+MODES = (INDEPENDENT, SEQUENTIAL)
+
+
+def order_requirements(items, catalogue):
+    """
+    ``accumulate_requirements`` over the distinct products of an order: the
+    quantities of repeated lines are merged first, so every BOM is expanded
+    once per order.
+    """
+    quantities = {}
+    for item in items:
+        quantities[item['product_code']] = quantities.get(item['product_code'], 0)+item['quantity']
+    return accumulate_requirements(
+        [{'product_code': product_code, 'quantity': quantity} for product_code, quantity in quantities.items()],
+        catalogue
+    )
+
+
+def check_orders(orders, mode=INDEPENDENT):
+    """
+    Check many orders against one read of the stock: products, BOMs and stock
+    of all orders together load once, in the queries of a single check.
+
+    ``independent`` checks every order against the full stock. ``sequential``
+    goes through the orders by ``priority`` (lowest first, then input order)
+    and takes the stock of each order that can be covered in full, so later
+    orders only see what is left; orders that cannot be covered take nothing.
+    Results are in input order.
+    """
+    catalogue = load_catalogue(item['product_code'] for order in orders for item in order['products'])
+    stock = load_stock(bom_material_ids(catalogue))
+
+    sequence = range(len(orders))
+    if mode == SEQUENTIAL:
+        sequence = sorted(sequence, key=lambda position: orders[position].get('priority', 0))
+
+    results = [None]*len(orders)
+    for position in sequence:
+        order = orders[position]
+        requirements, unmatched_codes = order_requirements(order['products'], catalogue)
+        materials = []
+        for material_id, (material_name, required_quantity) in requirements.items():
+            available_quantity = stock.get(material_id, 0)
+            status, shortage = material_status(required_quantity, available_quantity)
+            materials.append({
+                'material_id': material_id,
+                'material_name': material_name,
+                'required_quantity': required_quantity,
+                'available_quantity': available_quantity,
+                'status': status,
+                'shortage': shortage
+            })
+        available = not unmatched_codes and all(material['shortage'] is None for material in materials)
+        if mode == SEQUENTIAL and available:
+            for material_id, (_, required_quantity) in requirements.items():
+                stock[material_id] = stock.get(material_id, 0)-required_quantity
+        results[position] = {
+            'order_id': order.get('order_id'),
+            'available': available,
+            'materials': materials,
+            'unmatched_product_codes': unmatched_codes
+        }
+    return {
+        'mode': mode,
+        'orders': results
+    }
@@ -0,0 +1,550 @@
+import asyncio
+import csv
+import io
+import itertools
+import json
+import os
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from importlib.util import find_spec
+from time import perf_counter
+
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from users.models import User, MANAGER
+from .availability import fetch_catalogue, availability_report, availability_rollup_report
+from .bom import load_components, load_materials, explode
+from .bom_snapshot import BOMSnapshotStore, mark_changed
+from .bulk import ingest_warehouse_rows
+from .fast_serializers import WarehouseReadSerializer
+from .metrics import metrics
+from .models import Material, Product, ProductMaterial, ProductComponent
+from .renderers import FastJSONRenderer
+from .serializers import WarehouseSerializer
+from .synthetic import generate_catalogue
+from .views import warehouse_queryset
+from . import vectorized
+
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    """Register a benchmark scenario under ``name``."""
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+class Timer:
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = perf_counter() - self.start
+
+
+def throughput(rows, seconds):
+    return round(rows/seconds, 1) if seconds else None
+
+
+def latency_summary(seconds):
+    """Percentiles of request latencies, in milliseconds."""
+    seconds = sorted(seconds)
+
+    def percentile(p):
+        return round(seconds[min(len(seconds)-1, len(seconds)*p//100)]*1000, 3)
+
+    return {'requests': len(seconds), 'p50_ms': percentile(50), 'p95_ms': percentile(95), 'p99_ms': percentile(99)}
+
+
+def split_requests(requests, concurrency):
+    return [requests//concurrency + (i < requests % concurrency) for i in range(concurrency)]
+
+
+def drive_wsgi(send, requests, concurrency):
+    """
+    Make ``requests`` calls of ``send(client)`` from ``concurrency`` threads,
+    each with its own WSGI test client. Returns ``(latencies, seconds)``.
+    """
+    def worker(count):
+        client = Client()
+        latencies = []
+        try:
+            for _ in range(count):
+                with Timer() as timer:
+                    send(client)
+                latencies.append(timer.seconds)
+        finally:
+            connections.close_all()
+        return latencies
+
+    with Timer() as timer, ThreadPoolExecutor(concurrency) as pool:
+        latencies = [latency for worker_latencies in pool.map(worker, split_requests(requests, concurrency)) for latency in worker_latencies]
+    return latencies, timer.seconds
+
+
+def drive_asgi(send, requests, concurrency):
+    """``drive_wsgi`` with ``concurrency`` coroutines on one event loop, each with its own ASGI test client."""
+    async def worker(count):
+        client = AsyncClient()
+        latencies = []
+        for _ in range(count):
+            # Sync code of each request gets its own thread, as under an ASGI server
+            async with ThreadSensitiveContext():
+                with Timer() as timer:
+                    await send(client)
+            latencies.append(timer.seconds)
+        return latencies
+
+    async def run():
+        return await asyncio.gather(*(worker(count) for count in split_requests(requests, concurrency)))
+
+    with Timer() as timer:
+        latencies = [latency for worker_latencies in asyncio.run(run()) for latency in worker_latencies]
+    return latencies, timer.seconds
+
+
+def manager_client():
+    user, _ = User.objects.get_or_create(username='benchmark', defaults={'role': MANAGER})
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def create_materials(count):
+    return Material.objects.bulk_create(
+        Material(material_name=f'Material {i}') for i in range(count)
+    )
+
+
+def warehouse_rows(materials, rows):
+    return [
+        {
+            'material_id': materials[i % len(materials)].pk,
+            'remainder': float(i % 500 + 1),
+            'price': str(Decimal(i % 9000 + 100)/100),
+        }
+        for i in range(rows)
+    ]
+
+
+@scenario('bulk_ingest')
+def bulk_ingest(rows, chunk_size, **options):
+    """Rows/sec of /wh/warehouse/bulk-create/ for each supported content type."""
+    client = manager_client()
+    data = warehouse_rows(create_materials(100), rows)
+    url = f'/wh/warehouse/bulk-create/?chunk_size={chunk_size}'
+
+    csv_body = io.StringIO()
+    writer = csv.DictWriter(csv_body, fieldnames=['material_id', 'remainder', 'price'])
+    writer.writeheader()
+    writer.writerows(data)
+    bodies = {
+        'json': (json.dumps(data), 'application/json'),
+        'ndjson': ('\n'.join(json.dumps(row) for row in data), 'application/x-ndjson'),
+        'csv': (csv_body.getvalue(), 'text/csv'),
+    }
+
+    results = {}
+    for name, (body, content_type) in bodies.items():
+        with Timer() as timer:
+            response = client.post(url, body, content_type=content_type)
+        results[name] = {
+            'status': response.status_code,
+            'rows': rows,
+            'seconds': round(timer.seconds, 4),
+            'rows_per_second': throughput(rows, timer.seconds),
+        }
+    return results
+
+
+@scenario('list_serializers')
+def list_serializers(rows, chunk_size, **options):
+    """Rows/sec of the Warehouse list read path: ModelSerializer vs values() serializer."""
+    ingest_warehouse_rows(warehouse_rows(create_materials(100), rows), chunk_size)
+    queryset = warehouse_queryset.order_by('id')[:rows]
+
+    paths = {
+        'model_serializer': (lambda: WarehouseSerializer(queryset, many=True).data, JSONRenderer()),
+        'read_serializer': (
+            lambda: WarehouseReadSerializer.many(WarehouseReadSerializer.values(queryset)),
+            FastJSONRenderer(),
+        ),
+    }
+    results = {}
+    for name, (serialize, renderer) in paths.items():
+        with Timer() as serialize_timer:
+            data = serialize()
+        with Timer() as render_timer:
+            renderer.render(data)
+        seconds = serialize_timer.seconds+render_timer.seconds
+        results[name] = {
+            'rows': len(data),
+            'serialize_seconds': round(serialize_timer.seconds, 4),
+            'render_seconds': round(render_timer.seconds, 4),
+            'rows_per_second': throughput(len(data), seconds),
+        }
+    return results
+
+
+def create_assemblies(materials, tree, first_code):
+    """
+    Create one product per key of ``tree`` (``{name: [(component name, quantity)]}``),
+    each using three materials, and link the components. Returns products by name.
+    """
+    products = {
+        name: Product(product_name=name, product_code=first_code+i)
+        for i, name in enumerate(tree)
+    }
+    Product.objects.bulk_create(products.values())
+    ProductMaterial.objects.bulk_create(
+        ProductMaterial(product=product, material=materials[(i+offset) % len(materials)], quantity=1)
+        for i, product in enumerate(products.values())
+        for offset in range(3)
+    )
+    ProductComponent.objects.bulk_create(
+        ProductComponent(product=products[name], component=products[component], quantity=quantity)
+        for name, components in tree.items()
+        for component, quantity in components
+    )
+    return products
+
+
+def time_explosion(product):
+    with CaptureQueriesContext(connection) as queries, Timer() as fetch_timer:
+        fetch_catalogue([product.product_code])
+    components = load_components([product.pk], {})
+    materials = load_materials(components)
+    with Timer() as explode_timer:
+        explode([product.pk], components, materials)
+    return {
+        'products': len(components),
+        'edges': sum(len(children) for children in components.values()),
+        'queries': len(queries.captured_queries),
+        'fetch_seconds': round(fetch_timer.seconds, 4),
+        'explode_seconds': round(explode_timer.seconds, 4),
+    }
+
+
+@scenario('bom_explosion')
+def bom_explosion(rows, chunk_size, **options):
+    """Cold multi-level BOM loads: a deep chain, and a wide tree of shared sub-assemblies."""
+    materials = create_materials(100)
+    depth = 100
+    deep = create_assemblies(materials, {
+        f'Deep {level}': [(f'Deep {level+1}', 2)] if level < depth-1 else []
+        for level in range(depth)
+    }, first_code=1_000_000)
+
+    # rows/10 assemblies under one root, each built from 10 of 50 shared parts
+    width = max(rows//10, 1)
+    wide_tree = {'Wide root': [(f'Wide {i}', 1) for i in range(width)]}
+    wide_tree.update({
+        f'Wide {i}': [(f'Part {(i+j) % 50}', j+1) for j in range(10)]
+        for i in range(width)
+    })
+    wide_tree.update({f'Part {i}': [] for i in range(50)})
+    wide = create_assemblies(materials, wide_tree, first_code=2_000_000)
+
+    return {
+        'deep': {'depth': depth, **time_explosion(deep['Deep 0'])},
+        'wide': {'width': width, 'paths': width*10, **time_explosion(wide['Wide root'])},
+    }
+
+
+@scenario('vectorized_availability')
+def vectorized_availability(rows, chunk_size, **options):
+    """Python vs NumPy check-availability compute time by order size, to find the crossover."""
+    if vectorized.np is None:
+        return {'skipped': 'numpy is not installed'}
+    materials = create_materials(300)
+    catalogue = {
+        code: (f'Product {code}', tuple(
+            (materials[(code*7+j) % len(materials)].pk, f'Material {(code*7+j) % len(materials)}', float(j % 5+1))
+            for j in range(20)
+        ))
+        for code in range(500)
+    }
+    stock = {material.pk: float(i*3 % 1000) for i, material in enumerate(materials[:250])}
+
+    results = {}
+    crossover = {}
+    for lines in sorted({10, 50, 100, 250, 500, 1000, 2500, 5000, rows}):
+        items = [{'product_code': i*31 % 520, 'quantity': i % 9+1} for i in range(lines)]
+        used = {item['product_code']: catalogue[item['product_code']] for item in items if item['product_code'] in catalogue}
+        results[lines] = {}
+        # The reports the checks build from the catalogue and stock they load
+        for check, report in [('check_availability', availability_report),
+                              ('check_availability_rollup', availability_rollup_report)]:
+            timings = {}
+            outputs = {}
+            for name, min_lines in [('python', lines+1), ('numpy', 0)]:
+                with override_settings(WH_VECTORIZE_MIN_LINES=min_lines):
+                    seconds = []
+                    for _ in range(3):
+                        with Timer() as timer:
+                            outputs[name] = report(items, used, stock)
+                        seconds.append(timer.seconds)
+                timings[name] = round(min(seconds), 5)
+            results[lines][check] = {**timings, 'identical': outputs['python'] == outputs['numpy']}
+            if check not in crossover and timings['numpy'] < timings['python']:
+                crossover[check] = lines
+    return {'lines': results, 'crossover_lines': crossover}
+
+
+@scenario('bom_snapshot')
+def bom_snapshot_build(rows, chunk_size, **options):
+    """Full build, incremental refresh, mapping and lookups of the BOM snapshot for --rows products."""
+    materials = create_materials(500)
+    products = Product.objects.bulk_create(
+        Product(product_name=f'Product {code}', product_code=code) for code in range(rows)
+    )
+    ProductMaterial.objects.bulk_create(
+        (
+            ProductMaterial(product=product, material=materials[(i*7+j) % len(materials)], quantity=j+1)
+            for i, product in enumerate(products)
+            for j in range(10)
+        ),
+        batch_size=chunk_size
+    )
+    codes = [i*37 % rows for i in range(min(rows, 1000))]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, override_settings(WH_BOM_SNAPSHOT_PATH=os.path.join(directory, 'bom')):
+        store = BOMSnapshotStore()
+        with Timer() as timer:
+            snapshot = store.get()
+        results['full_build_seconds'] = round(timer.seconds, 4)
+        results['file_bytes'] = os.path.getsize(os.path.join(directory, 'bom'))
+
+        mark_changed([products[0].pk, products[-1].pk])
+        with CaptureQueriesContext(connection) as queries, Timer() as timer:
+            store.get()
+        results['incremental_refresh'] = {'seconds': round(timer.seconds, 4), 'queries': len(queries.captured_queries)}
+
+        with Timer() as timer:
+            snapshot = BOMSnapshotStore().get()
+        results['map_seconds'] = round(timer.seconds, 5)
+
+        with Timer() as timer:
+            snapshot.lookup(codes)
+        results['mapped_lookup'] = {'codes': len(codes), 'seconds': round(timer.seconds, 5)}
+        with Timer() as timer:
+            fetch_catalogue(codes)
+        results['database_lookup'] = {'codes': len(codes), 'seconds': round(timer.seconds, 5)}
+    return results
+
+
+@scenario('async_latency')
+def async_latency(rows, chunk_size, **options):
+    """
+    Latency of check-availability and a list endpoint under concurrency, --rows
+    requests per run: sync views over WSGI and ASGI, and the async views.
+    """
+    materials = create_materials(50)
+    products = Product.objects.bulk_create(
+        Product(product_name=f'Product {code}', product_code=code) for code in range(100)
+    )
+    ProductMaterial.objects.bulk_create(
+        ProductMaterial(product=product, material=materials[(i*3+j) % len(materials)], quantity=j+1)
+        for i, product in enumerate(products)
+        for j in range(5)
+    )
+    ingest_warehouse_rows(warehouse_rows(materials, 1000), chunk_size)
+    user, _ = User.objects.get_or_create(username='benchmark', defaults={'role': MANAGER})
+    headers = {'Authorization': f"Bearer {user.token()['access']}"}
+    order = json.dumps({'products': [{'product_code': i*7 % 100, 'quantity': i % 5+1} for i in range(20)]})
+    endpoints = {
+        'check_availability': lambda client, prefix: client.post(
+            f'/wh/{prefix}check-availability/', order, content_type='application/json'
+        ),
+        'product_materials': lambda client, prefix: client.get(
+            f'/wh/{prefix}product-materials/?page_size=50', headers=headers
+        ),
+    }
+    paths = {
+        'wsgi': (drive_wsgi, ''),
+        'asgi_sync_views': (drive_asgi, ''),
+        'asgi_async_views': (drive_asgi, 'async/'),
+    }
+
+    results = {}
+    for endpoint, send in endpoints.items():
+        results[endpoint] = {}
+        for concurrency in (1, 8, 32):
+            runs = {}
+            for path, (drive, prefix) in paths.items():
+                # Warm the BOM and list caches first
+                drive(lambda client: send(client, prefix), concurrency, concurrency)
+                latencies, seconds = drive(lambda client: send(client, prefix), rows, concurrency)
+                runs[path] = {**latency_summary(latencies), 'requests_per_second': throughput(rows, seconds)}
+            results[endpoint][concurrency] = runs
+    return results
+
+
+@scenario('batch_availability')
+def batch_availability(rows, chunk_size, **options):
+    """--rows/10 orders of 10 lines: one batch call in each mode vs one check-availability call per order."""
+    materials = create_materials(200)
+    products = Product.objects.bulk_create(
+        Product(product_name=f'Product {code}', product_code=code) for code in range(500)
+    )
+    ProductMaterial.objects.bulk_create(
+        ProductMaterial(product=product, material=materials[(i*7+j) % len(materials)], quantity=j+1)
+        for i, product in enumerate(products)
+        for j in range(8)
+    )
+    ingest_warehouse_rows(warehouse_rows(materials, 2000), chunk_size)
+    orders = [
+        {'order_id': str(i), 'priority': i % 5, 'products': [
+            {'product_code': (i*13+j*31) % len(products), 'quantity': j % 4+1} for j in range(10)
+        ]}
+        for i in range(max(rows//10, 1))
+    ]
+    client = APIClient()
+
+    results = {}
+    with CaptureQueriesContext(connection) as queries, Timer() as timer:
+        for order in orders:
+            client.post('/wh/check-availability/', {'products': order['products'], 'rollup': True}, format='json')
+    results['per_order_calls'] = {'seconds': round(timer.seconds, 4), 'queries': len(queries.captured_queries)}
+    for mode in ('independent', 'sequential'):
+        with CaptureQueriesContext(connection) as queries, Timer() as timer:
+            response = client.post('/wh/check-availability/batch/', {'orders': orders, 'mode': mode}, format='json')
+        results[mode] = {
+            'orders': len(response.data['data']['orders']),
+            'seconds': round(timer.seconds, 4),
+            'queries': len(queries.captured_queries),
+        }
+    return results
+
+
+@scenario('login')
+def login(rows, chunk_size, **options):
+    """
+    Logins per second on one thread, so per core, for each hasher setting,
+    --rows/1000 logins each (at least 5); plus the queries of a login and a refresh.
+    """
+    hashers = {f'pbkdf2_{iterations}': {
+        'PASSWORD_HASHERS': ['users.hashers.PBKDF2PasswordHasher'], 'USERS_PBKDF2_ITERATIONS': iterations
+    } for iterations in dict.fromkeys([settings.USERS_PBKDF2_ITERATIONS, 600000, 260000])}
+    if find_spec('argon2'):
+        hashers['argon2'] = {'PASSWORD_HASHERS': ['users.hashers.Argon2PasswordHasher']}
+    logins = max(rows//1000, 5)
+    credentials = {'username': 'benchmark-login', 'password': 'benchmark-password'}
+    client = APIClient()
+
+    results = {}
+    for name, hasher_settings in hashers.items():
+        with override_settings(**hasher_settings):
+            User.objects.filter(username=credentials['username']).delete()
+            User.objects.create_user(**credentials)
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = client.post('/users/login/', credentials)
+            first_login_queries = len(queries.captured_queries)
+            with Timer() as timer:
+                for _ in range(logins):
+                    client.post('/users/login/', credentials)
+            with CaptureQueriesContext(connection) as queries:
+                client.post('/users/login-refresh/', {'refresh': response.data['refresh']})
+        results[name] = {
+            'logins_per_second': throughput(logins, timer.seconds),
+            'ms_per_login': round(timer.seconds/logins*1000, 2),
+            'first_login_queries': first_login_queries,
+            'refresh_queries': len(queries.captured_queries),
+        }
+    return results
+
+
+@scenario('api')
+def api(rows, chunk_size, seed=0, **options):
+    """
+    The main wh endpoints driven one request at a time through the test
+    client, against a generate_catalogue catalogue of --rows/10 products:
+    throughput, latency percentiles and queries per request of each. List
+    endpoints run with and without the list cache.
+    """
+    catalogue = generate_catalogue(
+        products=max(rows//10, 20), materials=max(rows//50, 20), fan_out=5, batches_per_material=3,
+        components=1, seed=seed, chunk_size=chunk_size
+    )
+    rng = random.Random(seed)
+    codes = range(catalogue['first_code'], catalogue['last_code']+1)
+    material_ids = list(Material.objects.values_list('pk', flat=True))
+    requests = max(rows//100, 20)
+    bulk_rows = 100
+    user, _ = User.objects.get_or_create(username='benchmark', defaults={'role': MANAGER})
+    headers = {'Authorization': f"Bearer {user.token()['access']}"}
+
+    def orders(rollup):
+        bodies = itertools.cycle([
+            json.dumps({
+                'products': [{'product_code': rng.choice(codes), 'quantity': rng.randint(1, 5)} for _ in range(10)],
+                'rollup': rollup
+            })
+            for _ in range(requests)
+        ])
+        return lambda client, url: client.post(url, next(bodies), content_type='application/json')
+
+    def get(client, url):
+        return client.get(url, headers=headers)
+
+    batches = itertools.cycle([
+        json.dumps([
+            {'material_id': rng.choice(material_ids), 'remainder': float(rng.randint(1, 500)), 'price': '9.99'}
+            for _ in range(bulk_rows)
+        ])
+        for _ in range(requests)
+    ])
+
+    def bulk_create(client, url):
+        return client.post(url, next(batches), content_type='application/json', headers=headers)
+
+    endpoints = {
+        'check_availability': ('/wh/check-availability/', orders(False), True),
+        'check_availability_rollup': ('/wh/check-availability/', orders(True), True),
+        'material_batch_tracking': ('/wh/material-batch-tracking/', orders(False), True),
+        'products': ('/wh/products/?page_size=100', get, False),
+        'product_materials': ('/wh/product-materials/?page_size=100', get, False),
+        'warehouses': ('/wh/warehouses/?page_size=100', get, False),
+        'products_cached': ('/wh/products/?page_size=100', get, True),
+        'product_materials_cached': ('/wh/product-materials/?page_size=100', get, True),
+        'warehouses_cached': ('/wh/warehouses/?page_size=100', get, True),
+        'warehouse_bulk_create': (f'/wh/warehouse/bulk-create/?chunk_size={chunk_size}', bulk_create, True),
+    }
+
+    results = {'catalogue': catalogue}
+    for name, (url, send, list_cache) in endpoints.items():
+        # A timeout of 0 caches nothing
+        with override_settings(**({} if list_cache else {'WH_LIST_CACHE_TIMEOUT': 0})):
+            # Warm the BOM and list caches first
+            drive_wsgi(lambda client: send(client, url), 1, 1)
+            metrics.clear()
+            latencies, seconds = drive_wsgi(lambda client: send(client, url), requests, 1)
+        routes = metrics.routes.values()
+        queries = sum(stats.queries for stats in routes)
+        db_seconds = sum(stats.db_seconds for stats in routes)
+        results[name] = {
+            **latency_summary(latencies),
+            'requests_per_second': throughput(requests, seconds),
+            'queries_per_request': round(queries/requests, 2),
+            'db_ms_per_request': round(db_seconds/requests*1000, 3),
+            'statuses': sorted({status for stats in routes for status in stats.statuses}),
+        }
+    bulk = results['warehouse_bulk_create']
+    bulk['rows_per_second'] = round(bulk['requests_per_second']*bulk_rows, 1)
+    return results
@@ -0,0 +1,138 @@
+from .models import ProductMaterial, ProductComponent
+
+
+class BOMCycleError(Exception):
+
+    def __init__(self, product_ids):
+        super().__init__(f'Bill of materials contains a cycle: {product_ids}')
+        self.product_ids = product_ids
+
+
+def load_components(product_ids, components):
+    """
+    Add ``{product_id: [(component_id, quantity), ...]}`` to ``components`` for
+    ``product_ids`` and every sub-assembly below them, one query per BOM level.
+    Products already in ``components`` are not loaded again.
+    """
+    frontier = set(product_ids)-components.keys()
+    while frontier:
+        for product_id in frontier:
+            components[product_id] = []
+        rows = ProductComponent.objects.filter(product_id__in=frontier)\
+            .order_by('pk')\
+            .values_list('product_id', 'component_id', 'quantity')
+        for product_id, component_id, quantity in rows:
+            components[product_id].append((component_id, quantity))
+        frontier = {
+            component_id
+            for product_id in frontier
+            for component_id, _ in components[product_id]
+        }-components.keys()
+    return components
+
+
+async def aload_components(product_ids, components):
+    """Async ``load_components``."""
+    frontier = set(product_ids)-components.keys()
+    while frontier:
+        for product_id in frontier:
+            components[product_id] = []
+        rows = ProductComponent.objects.filter(product_id__in=frontier)\
+            .order_by('pk')\
+            .values_list('product_id', 'component_id', 'quantity')
+        async for product_id, component_id, quantity in rows:
+            components[product_id].append((component_id, quantity))
+        frontier = {
+            component_id
+            for product_id in frontier
+            for component_id, _ in components[product_id]
+        }-components.keys()
+    return components
+
+
+def load_materials(product_ids):
+    """Return the direct ``{product_id: [(material_id, material_name, quantity), ...]}`` in one query."""
+    materials = {}
+    product_materials = ProductMaterial.objects.filter(product_id__in=product_ids)\
+        .order_by('pk')\
+        .values_list('product_id', 'material_id', 'material__material_name', 'quantity')
+    for product_id, material_id, material_name, quantity in product_materials:
+        materials.setdefault(product_id, []).append((material_id, material_name, quantity))
+    return materials
+
+
+async def aload_materials(product_ids):
+    """Async ``load_materials``."""
+    materials = {}
+    product_materials = ProductMaterial.objects.filter(product_id__in=product_ids)\
+        .order_by('pk')\
+        .values_list('product_id', 'material_id', 'material__material_name', 'quantity')
+    async for product_id, material_id, material_name, quantity in product_materials:
+        materials.setdefault(product_id, []).append((material_id, material_name, quantity))
+    return materials
+
+
+def explode(product_ids, components, materials):
+    """
+    Flatten the BOMs of ``product_ids`` into ``{product_id: bom}``, where
+    ``bom`` is a tuple of ``(material_id, material_name, quantity)`` per unit
+    of the product: its own materials followed by those of its sub-assemblies
+    scaled by their quantities.
+
+    Products are expanded in post-order of an iterative depth-first walk, so
+    every sub-assembly is flattened once, before any product using it, and its
+    vector is reused wherever it appears. Reaching a product that is still
+    being expanded means the BOM has a cycle.
+    """
+    flattened = {}
+    for root_id in product_ids:
+        path = []
+        on_path = set()
+        stack = [(root_id, False)]
+        while stack:
+            product_id, expanded = stack.pop()
+            if expanded:
+                vector = {}
+                names = {}
+                for material_id, material_name, quantity in materials.get(product_id, ()):
+                    vector[material_id] = vector.get(material_id, 0)+quantity
+                    names[material_id] = material_name
+                for component_id, component_quantity in components.get(product_id, ()):
+                    for material_id, material_name, quantity in flattened[component_id]:
+                        vector[material_id] = vector.get(material_id, 0)+component_quantity*quantity
+                        names[material_id] = material_name
+                flattened[product_id] = tuple(
+                    (material_id, names[material_id], quantity) for material_id, quantity in vector.items()
+                )
+                on_path.discard(path.pop())
+                continue
+            if product_id in flattened:
+                continue
+            if product_id in on_path:
+                raise BOMCycleError(path[path.index(product_id):]+[product_id])
+            path.append(product_id)
+            on_path.add(product_id)
+            stack.append((product_id, True))
+            for component_id, _ in reversed(components.get(product_id, ())):
+                if component_id not in flattened:
+                    stack.append((component_id, False))
+    return {product_id: flattened[product_id] for product_id in product_ids}
+
+
+def ancestor_ids(product_ids):
+    """Return ``product_ids`` and every product using them as a sub-assembly, one query per level."""
+    found = set(product_ids)
+    frontier = set(found)
+    while frontier:
+        frontier = set(
+            ProductComponent.objects.filter(component_id__in=frontier).values_list('product_id', flat=True)
+        )-found
+        found |= frontier
+    return found
+
+
+def creates_cycle(product_id, component_id):
+    """Whether using ``component_id`` as a sub-assembly of ``product_id`` closes a cycle."""
+    if product_id == component_id:
+        return True
+    return product_id in load_components([component_id], {})
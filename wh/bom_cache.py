@@ -0,0 +1,137 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from django.conf import settings
+
+from .bom_snapshot import changed_since, current_version
+
+
+class BOMCache:
+    """
+    In-process LRU cache of ``product_code -> (product_name, bom)`` where
+    ``bom`` is the flattened tuple of ``(material_id, material_name, quantity)``,
+    sub-assemblies included.
+
+    Every invalidation bumps ``version``. Loaders read the version before they
+    hit the database and pass it back to ``set_many``; results loaded under an
+    older version are dropped, so a load racing an invalidation never caches
+    stale data.
+
+    Changes made by other processes are picked up from the shared BOM version
+    of ``bom_snapshot`` before every lookup. That only works when the cache
+    is shared (``CACHE_SHARED``), so entries also expire after ``ttl``
+    seconds, which bounds how stale they get otherwise.
+    """
+
+    def __init__(self, max_size, ttl=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._codes_by_product = {}
+        self._shared_version = None
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """
+        Drop the products changed since the shared BOM version last seen here,
+        or everything when the change log no longer covers them.
+        """
+        shared_version = current_version()
+        previous = self._shared_version
+        if shared_version == previous:
+            return
+        changed = None if previous is None else changed_since(previous, shared_version)
+        with self._lock:
+            if self._shared_version != previous:
+                # Another thread caught up first
+                return
+            if previous is not None:
+                if changed is None:
+                    self._clear()
+                else:
+                    self._invalidate_products(changed)
+            self._shared_version = shared_version
+
+    def get_many(self, product_codes):
+        """Return ``({product_code: (product_name, bom)}, missing product codes)``."""
+        self.sync()
+        found = {}
+        missing = set()
+        now = monotonic()
+        with self._lock:
+            for product_code in product_codes:
+                entry = self._entries.get(product_code)
+                if entry is not None and entry[3] is not None and entry[3] <= now:
+                    del self._entries[product_code]
+                    self._codes_by_product.pop(entry[0], None)
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    missing.add(product_code)
+                    continue
+                self._entries.move_to_end(product_code)
+                found[product_code] = entry[1:3]
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def set_many(self, entries, version):
+        """Store ``{product_code: (product_id, product_name, bom)}`` loaded under ``version``."""
+        expires = monotonic()+self.ttl if self.ttl else None
+        with self._lock:
+            if version != self.version:
+                return
+            for product_code, entry in entries.items():
+                self._entries[product_code] = (*entry, expires)
+                self._entries.move_to_end(product_code)
+                self._codes_by_product[entry[0]] = product_code
+            while len(self._entries) > self.max_size:
+                _, (product_id, *_) = self._entries.popitem(last=False)
+                self._codes_by_product.pop(product_id, None)
+                self.evictions += 1
+
+    def _invalidate_products(self, product_ids):
+        self.version += 1
+        for product_id in product_ids:
+            product_code = self._codes_by_product.pop(product_id, None)
+            if product_code is not None and self._entries.pop(product_code, None) is not None:
+                self.invalidations += 1
+
+    def _clear(self):
+        self.version += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._codes_by_product.clear()
+
+    def invalidate_products(self, product_ids):
+        with self._lock:
+            self._invalidate_products(product_ids)
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits+self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits/lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+bom_cache = BOMCache(settings.WH_BOM_CACHE_SIZE, settings.WH_BOM_CACHE_TTL)
@@ -0,0 +1,398 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import CharField
+from django.db.models.functions import Cast
+
+from .bom import explode
+from .models import Product, ProductMaterial, ProductComponent
+
+
+VERSION_KEY = 'wh:bom-snapshot:version'
+ALL_PRODUCTS = 'all'
+# Further behind than this, a full rebuild is cheaper than replaying changes
+MAX_REPLAYED_CHANGES = 1000
+
+MAGIC = b'WHBOM001'
+# magic, version, products, entries, materials, product name bytes, material name bytes
+HEADER = struct.Struct('<8s6q')
+
+
+def changes_key(version):
+    return f'wh:bom-snapshot:changes:{version}'
+
+
+class BOMSnapshot:
+    """
+    Flattened BOMs of every product in CSR form: the entries of row ``r`` are
+    ``entry_materials[indptr[r]:indptr[r+1]]`` (indexes into the material
+    table) and the matching ``entry_quantities``. Products are found by code
+    through ``sorted_codes``/``sorted_rows``, a binary-searchable index.
+
+    Every section is a flat sequence of int64, float64 or bytes, held either
+    in ``array`` objects or as zero-copy views of a memory-mapped file that
+    every worker process shares through the page cache.
+    """
+
+    def __init__(self, version, row_codes, sorted_codes, sorted_rows, indptr, entry_materials,
+                 entry_quantities, material_ids, product_name_offsets, material_name_offsets,
+                 product_ids, product_names, material_names, mapping=None):
+        self.version = version
+        self.row_codes = row_codes
+        self.sorted_codes = sorted_codes
+        self.sorted_rows = sorted_rows
+        self.indptr = indptr
+        self.entry_materials = entry_materials
+        self.entry_quantities = entry_quantities
+        self.material_ids = material_ids
+        self.product_name_offsets = product_name_offsets
+        self.material_name_offsets = material_name_offsets
+        self.product_ids = product_ids
+        self.product_names = product_names
+        self.material_names = material_names
+        self.mapping = mapping
+        self._material_names = {}
+
+    # int64 and float64 sections first, so every view of the file is aligned
+    NUMERIC_SECTIONS = (
+        ('row_codes', 'q'), ('sorted_codes', 'q'), ('sorted_rows', 'q'), ('indptr', 'q'),
+        ('entry_materials', 'q'), ('entry_quantities', 'd'), ('material_ids', 'q'),
+        ('product_name_offsets', 'q'), ('material_name_offsets', 'q'),
+    )
+    BYTES_SECTIONS = ('product_ids', 'product_names', 'material_names')
+
+    def __len__(self):
+        return len(self.row_codes)
+
+    @property
+    def entry_count(self):
+        return len(self.entry_materials)
+
+    def row(self, product_code):
+        i = bisect_left(self.sorted_codes, product_code)
+        if i < len(self.sorted_codes) and self.sorted_codes[i] == product_code:
+            return self.sorted_rows[i]
+        return None
+
+    def product_id(self, row):
+        return uuid.UUID(bytes=bytes(self.product_ids[row*16:(row+1)*16]))
+
+    def product_name(self, row):
+        return bytes(self.product_names[self.product_name_offsets[row]:self.product_name_offsets[row+1]]).decode()
+
+    def material_name(self, index):
+        name = self._material_names.get(index)
+        if name is None:
+            name = self._material_names[index] = bytes(
+                self.material_names[self.material_name_offsets[index]:self.material_name_offsets[index+1]]
+            ).decode()
+        return name
+
+    def bom(self, row):
+        start, end = self.indptr[row], self.indptr[row+1]
+        material_ids = self.material_ids
+        return tuple(
+            (material_ids[index], self.material_name(index), quantity)
+            for index, quantity in zip(self.entry_materials[start:end], self.entry_quantities[start:end])
+        )
+
+    def lookup(self, product_codes):
+        """Return ``{product_code: (product_name, bom)}`` like ``load_catalogue``."""
+        catalogue = {}
+        for product_code in set(product_codes):
+            row = self.row(product_code)
+            if row is not None:
+                catalogue[product_code] = (self.product_name(row), self.bom(row))
+        return catalogue
+
+    def write(self, path):
+        """Write the snapshot to ``path`` atomically, so readers never map a partial file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.bom-snapshot-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(HEADER.pack(
+                    MAGIC, self.version, len(self), self.entry_count, len(self.material_ids),
+                    len(self.product_names), len(self.material_names)
+                ))
+                for name, _ in self.NUMERIC_SECTIONS:
+                    file.write(memoryview(getattr(self, name)).cast('B'))
+                for name in self.BYTES_SECTIONS:
+                    file.write(getattr(self, name))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def open(cls, path):
+        """Map a snapshot file read-only; return ``None`` if there is no valid one."""
+        try:
+            with open(path, 'rb') as file:
+                mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(mapping) < HEADER.size:
+            return None
+        magic, version, products, entries, materials, product_name_bytes, material_name_bytes = \
+            HEADER.unpack_from(mapping)
+        if magic != MAGIC:
+            return None
+        lengths = {
+            'row_codes': products, 'sorted_codes': products, 'sorted_rows': products,
+            'indptr': products+1, 'entry_materials': entries, 'entry_quantities': entries,
+            'material_ids': materials, 'product_name_offsets': products+1,
+            'material_name_offsets': materials+1, 'product_ids': 16*products,
+            'product_names': product_name_bytes, 'material_names': material_name_bytes,
+        }
+        view = memoryview(mapping)
+        offset = HEADER.size
+        sections = {}
+        for name, typecode in cls.NUMERIC_SECTIONS:
+            size = 8*lengths[name]
+            sections[name] = view[offset:offset+size].cast(typecode)
+            offset += size
+        for name in cls.BYTES_SECTIONS:
+            sections[name] = view[offset:offset+lengths[name]]
+            offset += lengths[name]
+        return cls(version, mapping=mapping, **sections)
+
+
+class SnapshotBuilder:
+    """
+    Assembles a new ``BOMSnapshot``. Rows of a previous snapshot are copied
+    section by section without decoding them; the material table of that
+    snapshot is kept as a prefix, so copied material indexes stay valid.
+    """
+
+    def __init__(self, base=None):
+        self.material_ids = array('q', base.material_ids if base is not None else ())
+        self.material_name_offsets = array('q', base.material_name_offsets if base is not None else (0,))
+        self.material_names = bytearray(base.material_names if base is not None else b'')
+        self.material_index = {material_id: index for index, material_id in enumerate(self.material_ids)}
+        self.row_codes = array('q')
+        self.indptr = array('q', (0,))
+        self.entry_materials = array('q')
+        self.entry_quantities = array('d')
+        self.product_name_offsets = array('q', (0,))
+        self.product_ids = bytearray()
+        self.product_names = bytearray()
+
+    def material(self, material_id, material_name):
+        index = self.material_index.get(material_id)
+        if index is None:
+            index = self.material_index[material_id] = len(self.material_ids)
+            self.material_ids.append(material_id)
+            self.material_names += material_name.encode()
+            self.material_name_offsets.append(len(self.material_names))
+        return index
+
+    def add(self, product_id, product_code, product_name, bom):
+        self.row_codes.append(product_code)
+        for material_id, material_name, quantity in bom:
+            self.entry_materials.append(self.material(material_id, material_name))
+            self.entry_quantities.append(quantity)
+        self.indptr.append(len(self.entry_materials))
+        self.product_ids += product_id.bytes
+        self.product_names += product_name.encode()
+        self.product_name_offsets.append(len(self.product_names))
+
+    def copy(self, snapshot, start, stop):
+        """Append rows ``start:stop`` of ``snapshot``, whose material table this builder extends."""
+        if start >= stop:
+            return
+        entry_start, entry_end = snapshot.indptr[start], snapshot.indptr[stop]
+        name_start, name_end = snapshot.product_name_offsets[start], snapshot.product_name_offsets[stop]
+        entry_shift = len(self.entry_materials)-entry_start
+        name_shift = len(self.product_names)-name_start
+        self.row_codes.extend(snapshot.row_codes[start:stop])
+        self.entry_materials.extend(snapshot.entry_materials[entry_start:entry_end])
+        self.entry_quantities.extend(snapshot.entry_quantities[entry_start:entry_end])
+        self.indptr.extend(end+entry_shift for end in snapshot.indptr[start+1:stop+1])
+        self.product_ids += snapshot.product_ids[start*16:stop*16]
+        self.product_names += snapshot.product_names[name_start:name_end]
+        self.product_name_offsets.extend(end+name_shift for end in snapshot.product_name_offsets[start+1:stop+1])
+
+    def build(self, version):
+        index = sorted(range(len(self.row_codes)), key=self.row_codes.__getitem__)
+        return BOMSnapshot(
+            version,
+            row_codes=self.row_codes,
+            sorted_codes=array('q', (self.row_codes[row] for row in index)),
+            sorted_rows=array('q', index),
+            indptr=self.indptr,
+            entry_materials=self.entry_materials,
+            entry_quantities=self.entry_quantities,
+            material_ids=self.material_ids,
+            product_name_offsets=self.product_name_offsets,
+            material_name_offsets=self.material_name_offsets,
+            product_ids=bytes(self.product_ids),
+            product_names=bytes(self.product_names),
+            material_names=bytes(self.material_names),
+        )
+
+
+def fetch_all_boms():
+    """
+    Every product as ``{product_id: (product_code, product_name, bom)}`` from
+    three whole-table queries. Ids are read as text, which skips converting
+    each BOM row's product id to a ``UUID``; only the products' own are.
+    """
+    text = CharField()
+    headers = {
+        product_id: (product_code, product_name)
+        for product_id, product_code, product_name
+        in Product.objects.values_list(Cast('id', text), 'product_code', 'product_name')
+    }
+    components = {product_id: [] for product_id in headers}
+    for product_id, component_id, quantity in ProductComponent.objects.order_by('pk')\
+            .values_list(Cast('product_id', text), Cast('component_id', text), 'quantity'):
+        components[product_id].append((component_id, quantity))
+    materials = {}
+    for product_id, material_id, material_name, quantity in ProductMaterial.objects.order_by('pk')\
+            .values_list(Cast('product_id', text), 'material_id', 'material__material_name', 'quantity'):
+        materials.setdefault(product_id, []).append((material_id, material_name, quantity))
+    boms = explode(headers, components, materials)
+    return {
+        uuid.UUID(product_id): (product_code, product_name, boms[product_id])
+        for product_id, (product_code, product_name) in headers.items()
+    }
+
+
+def current_version():
+    """The shared snapshot version; a missing counter is seeded like the list cache generations."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def record_changes(product_ids):
+    """Bump the snapshot version and log which products changed, ``None`` meaning all of them."""
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(VERSION_KEY, version, timeout=None)
+    changes = ALL_PRODUCTS if product_ids is None else [str(product_id) for product_id in product_ids]
+    cache.set(changes_key(version), changes)
+
+
+def mark_changed(product_ids=None):
+    """Record changed products now and once more after commit, like the BOM cache invalidation."""
+    product_ids = None if product_ids is None else list(product_ids)
+    record_changes(product_ids)
+    transaction.on_commit(lambda: record_changes(product_ids))
+
+
+def changed_since(version, target_version):
+    """Product ids changed between two versions, or ``None`` when only a full rebuild will do."""
+    if not 0 < target_version-version <= MAX_REPLAYED_CHANGES:
+        return None
+    keys = [changes_key(v) for v in range(version+1, target_version+1)]
+    logged = cache.get_many(keys)
+    product_ids = set()
+    for key in keys:
+        changes = logged.get(key)
+        if changes is None or changes == ALL_PRODUCTS:
+            return None
+        product_ids.update(uuid.UUID(product_id) for product_id in changes)
+    return product_ids
+
+
+class BOMSnapshotStore:
+    """
+    The process-wide snapshot. It is rebuilt lazily on the first lookup after
+    the shared version moved, from the product changes logged in the cache,
+    or in full when the log is incomplete. With ``WH_BOM_SNAPSHOT_PATH`` set,
+    snapshots are published to that file and workers map a file that is
+    already up to date instead of rebuilding.
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self.full_rebuilds = 0
+        self.incremental_rebuilds = 0
+        self.mapped = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        version = current_version()
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self._lock:
+            snapshot = self.snapshot
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            path = settings.WH_BOM_SNAPSHOT_PATH
+            published = BOMSnapshot.open(path) if path else None
+            if published is not None and published.version == version:
+                self.mapped += 1
+                self.snapshot = published
+                return published
+            # Start from whichever is newer: our own copy or the published file
+            if published is not None and (snapshot is None or published.version > snapshot.version):
+                snapshot = published
+            self.snapshot = self.rebuild(snapshot, version)
+            if path:
+                self.snapshot.write(path)
+            return self.snapshot
+
+    def rebuild(self, snapshot, version):
+        # Imported here: availability imports this module to serve lookups
+        from .availability import fetch_products
+
+        product_ids = None if snapshot is None else changed_since(snapshot.version, version)
+        if product_ids is None:
+            builder = SnapshotBuilder()
+            for product_id, (product_code, product_name, bom) in fetch_all_boms().items():
+                builder.add(product_id, product_code, product_name, bom)
+            self.full_rebuilds += 1
+            return builder.build(version)
+
+        builder = SnapshotBuilder(snapshot)
+        changed_ids = {product_id.bytes for product_id in product_ids}
+        start = 0
+        for row in range(len(snapshot)):
+            if bytes(snapshot.product_ids[row*16:(row+1)*16]) in changed_ids:
+                builder.copy(snapshot, start, row)
+                start = row+1
+        builder.copy(snapshot, start, len(snapshot))
+        changed = fetch_products(Product.objects.filter(id__in=product_ids)) if product_ids else {}
+        for product_id, (product_code, product_name, bom) in changed.items():
+            builder.add(product_id, product_code, product_name, bom)
+        self.incremental_rebuilds += 1
+        return builder.build(version)
+
+    def clear(self):
+        with self._lock:
+            self.snapshot = None
+
+    def stats(self):
+        snapshot = self.snapshot
+        return {
+            'enabled': settings.WH_BOM_SNAPSHOT,
+            'version': None if snapshot is None else snapshot.version,
+            'products': None if snapshot is None else len(snapshot),
+            'entries': None if snapshot is None else snapshot.entry_count,
+            'materials': None if snapshot is None else len(snapshot.material_ids),
+            'mapped_file': snapshot is not None and snapshot.mapping is not None,
+            'full_rebuilds': self.full_rebuilds,
+            'incremental_rebuilds': self.incremental_rebuilds,
+            'mapped': self.mapped,
+        }
+
+
+bom_snapshot = BOMSnapshotStore()
@@ -0,0 +1,151 @@
+from math import floor
+
+from .availability import load_catalogue, load_stock, bom_material_ids, accumulate_requirements
+
+
+INDEPENDENT = 'independent'
+KIT = 'kit'
+PRIORITY = 'priority'
+
+# Absorbs float error in stock/quantity ratios that land on a whole number
+EPSILON = 1e-9
+
+
+def whole_units(available_quantity, quantity_per_unit):
+    return floor(max(available_quantity, 0)/quantity_per_unit + EPSILON)
+
+
+def buildable_units(bom, stock):
+    """
+    Return ``(max whole units, bottleneck material ids)`` that ``stock`` allows
+    for ``bom`` (``(material_id, material_name, quantity)`` per unit). The
+    maximum is ``None`` when nothing in the BOM limits it.
+    """
+    max_units = None
+    bottlenecks = []
+    for material_id, _, quantity in bom:
+        if quantity <= 0:
+            continue
+        units = whole_units(stock.get(material_id, 0), quantity)
+        if max_units is None or units < max_units:
+            max_units = units
+            bottlenecks = [material_id]
+        elif units == max_units:
+            bottlenecks.append(material_id)
+    return max_units, bottlenecks
+
+
+def describe_bottlenecks(material_ids, bom, stock):
+    per_unit = {material_id: (material_name, quantity) for material_id, material_name, quantity in bom}
+    return [
+        {
+            'material_id': material_id,
+            'material_name': per_unit[material_id][0],
+            'required_per_unit': per_unit[material_id][1],
+            'available_quantity': stock.get(material_id, 0),
+        }
+        for material_id in material_ids
+    ]
+
+
+def load_order(items):
+    catalogue = load_catalogue(item['product_code'] for item in items)
+    stock = load_stock(bom_material_ids(catalogue))
+    unmatched_codes = [item['product_code'] for item in items if item['product_code'] not in catalogue]
+    return catalogue, stock, unmatched_codes
+
+
+def max_buildable(items):
+    """The most whole units of each product the current stock allows on its own."""
+    catalogue, stock, unmatched_codes = load_order(items)
+    products = []
+    for item in items:
+        entry = catalogue.get(item['product_code'])
+        if entry is None:
+            continue
+        product_name, bom = entry
+        max_units, bottlenecks = buildable_units(bom, stock)
+        products.append({
+            'product_code': item['product_code'],
+            'product_name': product_name,
+            'max_quantity': max_units,
+            'bottlenecks': describe_bottlenecks(bottlenecks, bom, stock),
+        })
+    return {
+        'mode': INDEPENDENT,
+        'products': products,
+        'unmatched_product_codes': unmatched_codes
+    }
+
+
+def max_buildable_kits(items):
+    """
+    The most whole kits buildable at once, where a kit holds ``quantity`` units
+    of every product line (one by default). All lines compete for the same
+    stock.
+    """
+    items = [{**item, 'quantity': item.get('quantity') or 1} for item in items]
+    catalogue, stock, unmatched_codes = load_order(items)
+    requirements, _ = accumulate_requirements(items, catalogue)
+    kit_bom = [(material_id, material_name, quantity) for material_id, (material_name, quantity) in requirements.items()]
+    kits, bottlenecks = buildable_units(kit_bom, stock)
+    return {
+        'mode': KIT,
+        'kits': kits,
+        'products': [
+            {
+                'product_code': item['product_code'],
+                'product_name': catalogue[item['product_code']][0],
+                'ratio': item['quantity'],
+                'quantity': None if kits is None else kits*item['quantity'],
+            }
+            for item in items
+            if item['product_code'] in catalogue
+        ],
+        'bottlenecks': describe_bottlenecks(bottlenecks, kit_bom, stock),
+        'unmatched_product_codes': unmatched_codes
+    }
+
+
+def max_buildable_by_priority(items):
+    """
+    Greedy allocation in order of the lines: each product gets as many whole
+    units as the stock left by the lines before it allows, up to its
+    ``quantity`` when one is given.
+    """
+    catalogue, stock, unmatched_codes = load_order(items)
+    remaining = dict(stock)
+    products = []
+    for item in items:
+        entry = catalogue.get(item['product_code'])
+        if entry is None:
+            continue
+        product_name, bom = entry
+        max_units, bottlenecks = buildable_units(bom, remaining)
+        requested_quantity = item.get('quantity')
+        units = max_units
+        if requested_quantity is not None and (units is None or requested_quantity < units):
+            units = requested_quantity
+            bottlenecks = []
+        products.append({
+            'product_code': item['product_code'],
+            'product_name': product_name,
+            'requested_quantity': requested_quantity,
+            'max_quantity': units,
+            'bottlenecks': describe_bottlenecks(bottlenecks, bom, remaining),
+        })
+        if units is not None:
+            for material_id, _, quantity in bom:
+                remaining[material_id] = remaining.get(material_id, 0) - units*quantity
+    return {
+        'mode': PRIORITY,
+        'products': products,
+        'unmatched_product_codes': unmatched_codes
+    }
+
+
+SOLVERS = {
+    INDEPENDENT: max_buildable,
+    KIT: max_buildable_kits,
+    PRIORITY: max_buildable_by_priority,
+}
@@ -0,0 +1,239 @@
+from collections.abc import Iterator
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from rest_framework import serializers
+
+from .caching import invalidate_lists
+from .ledger import record_movements, batch_movements
+from .models import Material, Product, ProductMaterial, Warehouse
+from .parsers import MalformedRow
+from .signals import invalidate_bom_products
+from .stock_summary import summary_deltas, apply_summary_deltas
+
+
+MISSING_MATERIAL_MESSAGE = 'Invalid pk "{pk_value}" - object does not exist.'
+MISSING_PRODUCT_MESSAGE = 'Product not found.'
+DUPLICATE_ROW_MESSAGE = 'Duplicate product-material pair in this import.'
+EXISTING_PAIR_MESSAGE = 'This product-material combination already exists.'
+
+
+def is_row_stream(data):
+    """Whether a parsed body holds rows: a JSON list, or the iterator of a streaming parser."""
+    return isinstance(data, (list, Iterator))
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class RowValidator:
+    """
+    Validates plain dict rows with DRF fields that are built once and reused,
+    instead of instantiating a serializer per row.
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def validate(self, row):
+        if isinstance(row, MalformedRow):
+            return None, {'non_field_errors': [row.message]}
+        if not isinstance(row, dict):
+            return None, {'non_field_errors': ['Expected an object.']}
+        values = {}
+        errors = {}
+        for name, field in self.fields.items():
+            try:
+                values[name] = field.run_validation(row.get(name, serializers.empty))
+            except serializers.SkipField:
+                continue
+            except serializers.ValidationError as exc:
+                errors[name] = exc.detail
+        return values, errors
+
+
+def warehouse_row_validator():
+    return RowValidator({
+        'material_id': serializers.IntegerField(),
+        'remainder': serializers.FloatField(),
+        'price': serializers.DecimalField(max_digits=12, decimal_places=2),
+    })
+
+
+def ingest_warehouse_rows(rows, chunk_size):
+    """
+    Create ``Warehouse`` batches from an iterable of dict rows.
+
+    Rows are consumed ``chunk_size`` at a time: the unseen material ids of a
+    chunk are checked with one ``id__in`` query and its valid rows are written
+    with one ``bulk_create``. Invalid rows are reported by their 1-based
+    position and skipped; the rest of the load still goes through.
+    """
+    validator = warehouse_row_validator()
+    known_materials = set()
+    missing_materials = set()
+    created = 0
+    errors = []
+    total = 0
+
+    with transaction.atomic():
+        for chunk in chunked(rows, chunk_size):
+            validated = []
+            for row in chunk:
+                total += 1
+                values, row_errors = validator.validate(row)
+                if row_errors:
+                    errors.append({'row': total, 'errors': row_errors})
+                else:
+                    validated.append((total, values))
+
+            unseen = {
+                values['material_id'] for _, values in validated
+            } - known_materials - missing_materials
+            if unseen:
+                found = set(Material.objects.filter(id__in=unseen).values_list('id', flat=True))
+                known_materials |= found
+                missing_materials |= unseen - found
+
+            batches = []
+            for row_number, values in validated:
+                if values['material_id'] in missing_materials:
+                    errors.append({'row': row_number, 'errors': {
+                        'material_id': [MISSING_MATERIAL_MESSAGE.format(pk_value=values['material_id'])]
+                    }})
+                    continue
+                batches.append(Warehouse(**values))
+            Warehouse.objects.bulk_create(batches, batch_size=chunk_size)
+            # bulk_create does not send post_save, journal the receipts and summarize them here
+            record_movements([
+                movement for batch in batches
+                for movement in batch_movements(None, batch.stock_state(), batch.pk)
+            ])
+            deltas = summary_deltas()
+            for batch in batches:
+                deltas[batch.material_id].add_batch(batch.remainder, batch.price)
+            apply_summary_deltas(deltas)
+            created += len(batches)
+        if created:
+            invalidate_lists(Warehouse)
+
+    errors.sort(key=lambda error: error['row'])
+    return {
+        'rows': total,
+        'created': created,
+        'errors': errors
+    }
+
+
+def bom_row_validator():
+    return RowValidator({
+        'product_id': serializers.UUIDField(required=False),
+        'product_code': serializers.IntegerField(required=False),
+        'material_id': serializers.IntegerField(),
+        'quantity': serializers.FloatField(),
+    })
+
+
+def import_bom_rows(rows, chunk_size, upsert=False):
+    """
+    Create ``ProductMaterial`` rows from dict rows keyed by ``product_id`` or
+    ``product_code`` plus ``material_id`` and ``quantity``.
+
+    Products and materials are resolved with one query each and the pairs that
+    already exist are found with one more. New pairs are written with
+    ``bulk_create``; existing pairs are either reported as errors or, with
+    ``upsert``, get their quantity replaced through ``bulk_update``. The unique
+    constraint on (product, material) makes a concurrent import of the same
+    pair fail with ``IntegrityError`` instead of duplicating it.
+    """
+    validator = bom_row_validator()
+    errors = []
+    validated = []
+    total = 0
+    for row in rows:
+        total += 1
+        row_number = total
+        values, row_errors = validator.validate(row)
+        if not row_errors and 'product_id' not in values and 'product_code' not in values:
+            row_errors = {'product_id': ['Either product_id or product_code is required.']}
+        if row_errors:
+            errors.append({'row': row_number, 'errors': row_errors})
+        else:
+            validated.append((row_number, values))
+
+    product_ids = {values['product_id'] for _, values in validated if 'product_id' in values}
+    product_codes = {values['product_code'] for _, values in validated if 'product_id' not in values}
+    products_by_id = {}
+    products_by_code = {}
+    if validated:
+        products = Product.objects.filter(Q(id__in=product_ids) | Q(product_code__in=product_codes))\
+            .values_list('id', 'product_code')
+        for product_id, product_code in products:
+            products_by_id[product_id] = product_id
+            products_by_code[product_code] = product_id
+    material_ids = set(Material.objects.filter(
+        id__in={values['material_id'] for _, values in validated}
+    ).values_list('id', flat=True)) if validated else set()
+
+    pairs = {}
+    for row_number, values in validated:
+        if 'product_id' in values:
+            product_id = products_by_id.get(values['product_id'])
+        else:
+            product_id = products_by_code.get(values['product_code'])
+        if product_id is None:
+            errors.append({'row': row_number, 'errors': {'product_id': [MISSING_PRODUCT_MESSAGE]}})
+        elif values['material_id'] not in material_ids:
+            errors.append({'row': row_number, 'errors': {
+                'material_id': [MISSING_MATERIAL_MESSAGE.format(pk_value=values['material_id'])]
+            }})
+        elif (product_id, values['material_id']) in pairs:
+            errors.append({'row': row_number, 'errors': {'non_field_errors': [DUPLICATE_ROW_MESSAGE]}})
+        else:
+            pairs[(product_id, values['material_id'])] = (row_number, values['quantity'])
+
+    existing = {}
+    if pairs:
+        candidates = ProductMaterial.objects.filter(
+            product_id__in={product_id for product_id, _ in pairs},
+            material_id__in={material_id for _, material_id in pairs},
+        ).values_list('id', 'product_id', 'material_id')
+        existing = {
+            (product_id, material_id): pk
+            for pk, product_id, material_id in candidates
+            if (product_id, material_id) in pairs
+        }
+
+    new_rows = []
+    updated_rows = []
+    for pair, (row_number, quantity) in pairs.items():
+        pk = existing.get(pair)
+        if pk is None:
+            new_rows.append(ProductMaterial(product_id=pair[0], material_id=pair[1], quantity=quantity))
+        elif upsert:
+            updated_rows.append(ProductMaterial(pk=pk, product_id=pair[0], material_id=pair[1], quantity=quantity))
+        else:
+            errors.append({'row': row_number, 'errors': {'non_field_errors': [EXISTING_PAIR_MESSAGE]}})
+
+    with transaction.atomic():
+        ProductMaterial.objects.bulk_create(new_rows, batch_size=chunk_size)
+        if updated_rows:
+            ProductMaterial.objects.bulk_update(updated_rows, ['quantity'], batch_size=chunk_size)
+        # bulk_create and bulk_update do not send model signals
+        invalidate_bom_products({product_id for product_id, _ in pairs})
+        invalidate_lists(ProductMaterial)
+
+    errors.sort(key=lambda error: error['row'])
+    return {
+        'rows': total,
+        'created': len(new_rows),
+        'updated': len(updated_rows),
+        'errors': errors
+    }
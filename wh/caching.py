@@ -0,0 +1,81 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+
+def generation_key(model):
+    return f'wh:generation:{model._meta.label_lower}'
+
+
+def get_generations(models):
+    """
+    Return the current generation of every model. A missing counter (never
+    set, or evicted) is seeded with the current time, so it can never fall
+    back to a value that older cache entries were stored under.
+    """
+    keys = [generation_key(model) for model in models]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, time.time_ns(), timeout=None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+async def aget_generations(models):
+    """Async ``get_generations``."""
+    keys = [generation_key(model) for model in models]
+    generations = await cache.aget_many(keys)
+    for key in keys:
+        if key not in generations:
+            await cache.aadd(key, time.time_ns(), timeout=None)
+            generations[key] = await cache.aget(key)
+    return [generations[key] for key in keys]
+
+
+def bump_generations(models):
+    for model in models:
+        key = generation_key(model)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+def invalidate_lists(*models):
+    """Invalidate cached list responses of ``models`` now and once more after commit."""
+    bump_generations(models)
+    transaction.on_commit(lambda: bump_generations(models))
+
+
+def list_cache_key(view, request, generations):
+    params = urlencode(sorted(request.query_params.lists()), doseq=True)
+    digest = hashlib.md5(params.encode(), usedforsecurity=False).hexdigest()
+    return f"wh:list:{view.__class__.__name__}:{'.'.join(map(str, generations))}:{digest}"
+
+
+class CachedListMixin:
+    """
+    Caches the serialized response of ``list()`` in the shared cache. The key
+    covers the view, every query parameter (pagination and filters) and the
+    generation counters of ``cache_models``, which model signals bump on
+    every write, so stale entries are never read again and simply expire.
+    """
+    cache_models = ()
+
+    def list_cache_key(self, request):
+        return list_cache_key(self, request, get_generations(self.cache_models))
+
+    def list(self, request, *args, **kwargs):
+        key = self.list_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = super().list(request, *args, **kwargs)
+        cache.set(key, response.data, settings.WH_LIST_CACHE_TIMEOUT)
+        return response
@@ -0,0 +1,55 @@
+import csv
+import json
+from itertools import islice
+
+from .fast_serializers import decimal_string
+
+
+WAREHOUSE_EXPORT_COLUMNS = ['id', 'material_id', 'material_name', 'remainder', 'price']
+
+
+class Echo:
+    """File-like object whose ``write`` hands the value back, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def warehouse_export_rows(queryset, chunk_size):
+    """
+    Yield lists of ``(id, material_id, material_name, remainder, price)`` rows,
+    ``chunk_size`` at a time, from a server-side iterator so the ledger is
+    never loaded into memory as a whole.
+    """
+    rows = queryset.order_by('id')\
+        .values_list('id', 'material_id', 'material__material_name', 'remainder', 'price')\
+        .iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def warehouse_ndjson(queryset, chunk_size):
+    for chunk in warehouse_export_rows(queryset, chunk_size):
+        yield ''.join(
+            json.dumps(dict(zip(WAREHOUSE_EXPORT_COLUMNS, row[:4]), price=decimal_string(row[4])))+'\n'
+            for row in chunk
+        )
+
+
+def warehouse_csv(queryset, chunk_size):
+    writer = csv.writer(Echo())
+    yield writer.writerow(WAREHOUSE_EXPORT_COLUMNS)
+    for chunk in warehouse_export_rows(queryset, chunk_size):
+        yield ''.join(
+            writer.writerow(row[:4]+(decimal_string(row[4]),))
+            for row in chunk
+        )
+
+
+WAREHOUSE_EXPORT_FORMATS = {
+    'ndjson': (warehouse_ndjson, 'application/x-ndjson'),
+    'csv': (warehouse_csv, 'text/csv'),
+}
@@ -0,0 +1,139 @@
+from rest_framework.response import Response
+
+from .metrics import timed_serialization
+
+
+def decimal_string(value):
+    # DecimalField(coerce_to_string=True) output; values are already quantized by the database
+    return None if value is None else format(value, 'f')
+
+
+class ValuesSerializer:
+    """
+    Read-only serializer for hot list endpoints. Builds plain dicts straight
+    from ``.values()`` rows, skipping the field machinery of ``ModelSerializer``,
+    and renders to the same JSON as the matching serializer in
+    ``serializers.py``, which stays in charge of the write path.
+    """
+    fields = ()
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values(*cls.fields)
+
+    @classmethod
+    def to_representation(cls, row):
+        # Subclasses reshape rows whose values do not render as they are
+        return {field: row[field] for field in cls.fields}
+
+    @classmethod
+    @timed_serialization
+    def many(cls, rows):
+        to_representation = cls.to_representation
+        return [to_representation(row) for row in rows]
+
+
+class ProductReadSerializer(ValuesSerializer):
+    fields = ('id', 'product_name', 'product_code')
+
+    @classmethod
+    def to_representation(cls, row):
+        return {
+            'id': str(row['id']),
+            'product_name': row['product_name'],
+            'product_code': row['product_code'],
+        }
+
+
+class MaterialReadSerializer(ValuesSerializer):
+    fields = ('id', 'material_name')
+
+
+class ProductMaterialReadSerializer(ValuesSerializer):
+    fields = (
+        'id', 'quantity', 'product_id', 'material_id',
+        'product__product_name', 'product__product_code', 'material__material_name',
+    )
+
+    @classmethod
+    def to_representation(cls, row):
+        product_id = str(row['product_id'])
+        return {
+            # ProductMaterialSerializer renders its integer id through a UUIDField
+            'id': str(row['id']),
+            'product_id': product_id,
+            'material_id': row['material_id'],
+            'product': {
+                'id': product_id,
+                'product_name': row['product__product_name'],
+                'product_code': row['product__product_code'],
+            },
+            'material': {
+                'id': row['material_id'],
+                'material_name': row['material__material_name'],
+            },
+            'quantity': row['quantity'],
+        }
+
+
+class ProductComponentReadSerializer(ValuesSerializer):
+    fields = (
+        'id', 'quantity', 'product_id', 'component_id',
+        'product__product_name', 'product__product_code',
+        'component__product_name', 'component__product_code',
+    )
+
+    @classmethod
+    def to_representation(cls, row):
+        product_id = str(row['product_id'])
+        component_id = str(row['component_id'])
+        return {
+            'id': row['id'],
+            'product_id': product_id,
+            'component_id': component_id,
+            'product': {
+                'id': product_id,
+                'product_name': row['product__product_name'],
+                'product_code': row['product__product_code'],
+            },
+            'component': {
+                'id': component_id,
+                'product_name': row['component__product_name'],
+                'product_code': row['component__product_code'],
+            },
+            'quantity': row['quantity'],
+        }
+
+
+class WarehouseReadSerializer(ValuesSerializer):
+    fields = ('id', 'material_id', 'material__material_name', 'remainder', 'price')
+
+    @classmethod
+    def to_representation(cls, row):
+        return {
+            'id': row['id'],
+            'material_id': row['material_id'],
+            'material': {
+                'id': row['material_id'],
+                'material_name': row['material__material_name'],
+            },
+            'remainder': row['remainder'],
+            'price': decimal_string(row['price']),
+        }
+
+
+class FastListMixin:
+    """
+    Serves ``list()`` through ``read_serializer_class`` from a ``.values()``
+    queryset. Pagination works unchanged since the cursor paginator accepts
+    dict rows.
+    """
+    read_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.read_serializer_class
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.many(page))
+        return Response(serializer.many(queryset))
@@ -0,0 +1,97 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, F, Sum, When
+
+from .models import StockMovement, MaterialBalance, RECEIPT, ADJUSTMENT
+
+
+# Keeps the CASE expressions of one UPDATE well below SQLite's expression depth limit
+DELTA_UPDATE_SIZE = 200
+
+
+def apply_deltas(model, deltas, create=True, expressions=None):
+    """
+    Add ``{material_id: {field: delta}}`` to the per-material rows of
+    ``model`` with one UPDATE per chunk of materials. Missing rows are created
+    first unless ``create`` is false, which deletions use since the material
+    may be going away too. ``expressions(material_ids)`` gives the updates of
+    fields that do not simply add up, for a chunk.
+    """
+    deltas = [(material_id, fields) for material_id, fields in deltas.items() if any(fields.values())]
+    if not deltas:
+        return
+    if create:
+        model.objects.bulk_create([model(material_id=material_id) for material_id, _ in deltas], ignore_conflicts=True)
+    for start in range(0, len(deltas), DELTA_UPDATE_SIZE):
+        chunk = deltas[start:start+DELTA_UPDATE_SIZE]
+        material_ids = [material_id for material_id, _ in chunk]
+        updates = {
+            field: Case(*(
+                When(material_id=material_id, then=F(field)+fields.get(field, 0)) for material_id, fields in chunk
+            ), default=F(field))
+            for field in {field for _, fields in chunk for field in fields}
+        }
+        if expressions is not None:
+            updates.update(expressions(material_ids))
+        model.objects.filter(material_id__in=material_ids).update(**updates)
+
+
+def record_movements(movements):
+    """
+    Append ``StockMovement`` rows to the journal with one ``bulk_create`` and
+    move the affected material balances by the same amounts, in one
+    transaction.
+    """
+    if not movements:
+        return
+    deltas = defaultdict(float)
+    for movement in movements:
+        deltas[movement.material_id] += movement.quantity
+    with transaction.atomic(savepoint=False):
+        StockMovement.objects.bulk_create(movements)
+        apply_deltas(MaterialBalance, {material_id: {'quantity': delta} for material_id, delta in deltas.items()})
+
+
+def batch_movements(before, after, batch_id):
+    """
+    Journal entries that turn the stock state ``before`` of a batch into
+    ``after``, either of which is ``None`` for a batch that does not exist.
+    """
+    if after is None:
+        return [StockMovement(material_id=before['material_id'], batch_id=batch_id, kind=ADJUSTMENT, quantity=-before['remainder'])]
+    if before is None:
+        return [StockMovement(material_id=after['material_id'], batch_id=batch_id, kind=RECEIPT, quantity=after['remainder'])]
+    if before['material_id'] != after['material_id']:
+        return [
+            StockMovement(material_id=before['material_id'], batch_id=batch_id, kind=ADJUSTMENT, quantity=-before['remainder']),
+            StockMovement(material_id=after['material_id'], batch_id=batch_id, kind=ADJUSTMENT, quantity=after['remainder']),
+        ]
+    if before['remainder'] != after['remainder']:
+        return [StockMovement(
+            material_id=after['material_id'], batch_id=batch_id, kind=ADJUSTMENT,
+            quantity=after['remainder']-before['remainder']
+        )]
+    return []
+
+
+def journal_balances():
+    """``{material_id: sum of movements}`` straight from the journal."""
+    return dict(
+        StockMovement.objects.values('material_id')
+        .annotate(total=Sum('quantity'))
+        .order_by()
+        .values_list('material_id', 'total')
+    )
+
+
+def rebuild_balances():
+    """Replace every ``MaterialBalance`` with the total of its journal."""
+    with transaction.atomic():
+        balances = journal_balances()
+        MaterialBalance.objects.all().delete()
+        MaterialBalance.objects.bulk_create(
+            (MaterialBalance(material_id=material_id, quantity=quantity) for material_id, quantity in balances.items()),
+            batch_size=1000
+        )
+    return balances
@@ -0,0 +1,99 @@
+import json
+import subprocess
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from wh.benchmarks import SCENARIOS
+from wh.bom_cache import bom_cache
+from wh.bom_snapshot import bom_snapshot
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_cold():
+    """
+    Empty the database and the in-process caches, so every scenario starts
+    from the same state whatever ran before it. Scenarios commit, and their
+    requests run on other connections, so rolling them back is not an option.
+    """
+    call_command('flush', interactive=False, verbosity=0)
+    bom_cache.clear()
+    bom_snapshot.clear()
+
+
+def scenario_cache(name):
+    """
+    A cache of the scenario's own in place of the configured one: the test
+    database is thrown away, but a shared cache serves the deployment.
+    """
+    return {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'benchmark-{name}'}}
+
+
+def numbers(result, prefix=''):
+    """The numeric leaves of a result, keyed by their dotted path."""
+    if isinstance(result, dict):
+        for key, value in result.items():
+            yield from numbers(value, f'{prefix}{key}.')
+    elif isinstance(result, (int, float)) and not isinstance(result, bool):
+        yield prefix[:-1], result
+
+
+class Command(BaseCommand):
+    help = 'Run wh benchmark scenarios against a throwaway test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+        parser.add_argument('--rows', type=int, default=10000, help='Number of rows the scenarios work with.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Chunk size for bulk writes.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data.')
+        parser.add_argument('--output', help='Write the results, with the commit and options, to this JSON file.')
+        parser.add_argument('--compare', help='Print the change of every number from the results in this JSON file.')
+
+    def handle(self, *args, **options):
+        names = options.pop('scenarios') or list(SCENARIOS)
+        output = options.pop('output')
+        compare = options.pop('compare')
+        unknown = [name for name in names if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(unknown)}")
+
+        results = {}
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for name in names:
+                start_cold()
+                with override_settings(CACHES=scenario_cache(name)):
+                    result = results[name] = SCENARIOS[name](**options)
+                self.stdout.write(f'{name}: {json.dumps(result, indent=2)}')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        run = {
+            'commit': current_commit(),
+            'options': {key: options[key] for key in ('rows', 'chunk_size', 'seed')},
+            'results': results,
+        }
+        if output:
+            with open(output, 'w', encoding='utf-8') as file:
+                json.dump(run, file, indent=2)
+        if compare:
+            with open(compare, encoding='utf-8') as file:
+                baseline = json.load(file)
+            before = dict(numbers(baseline['results']))
+            self.stdout.write(f"Compared with {baseline.get('commit') or compare}:")
+            for key, value in numbers(results):
+                if before.get(key):
+                    self.stdout.write(f'{key}: {before[key]} -> {value} ({(value-before[key])/before[key]:+.1%})')
@@ -0,0 +1,33 @@
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from wh.synthetic import generate_catalogue
+
+
+class Command(BaseCommand):
+    help = 'Bulk-insert a synthetic catalogue of products, materials, BOMs and warehouse batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--materials', type=int, default=200)
+        parser.add_argument('--fan-out', type=int, default=5, help='Materials in the BOM of each product.')
+        parser.add_argument('--components', type=int, default=0,
+                            help='Sub-assemblies of each product, chosen among the products before it.')
+        parser.add_argument('--batches-per-material', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0, help='The same seed generates the same catalogue.')
+        parser.add_argument('--chunk-size', type=int, default=settings.WH_BULK_CHUNK_SIZE)
+
+    def handle(self, *args, products, materials, fan_out, components, batches_per_material, seed, chunk_size, **options):
+        start = perf_counter()
+        result = generate_catalogue(
+            products, materials, fan_out, batches_per_material,
+            components=components, seed=seed, chunk_size=chunk_size
+        )
+        self.stdout.write(
+            f"Created {result['products']} products (codes {result['first_code']}-{result['last_code']}), "
+            f"{result['materials']} materials, {result['product_materials']} product materials, "
+            f"{result['product_components']} product components and {result['batches']} warehouse batches "
+            f"in {perf_counter()-start:.2f}s"
+        )
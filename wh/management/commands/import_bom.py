@@ -0,0 +1,43 @@
+import csv
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from wh.bulk import import_bom_rows, is_row_stream
+
+
+def ndjson_rows(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+class Command(BaseCommand):
+    help = 'Import product materials (BOM rows) from a CSV, NDJSON or JSON file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File with product_id or product_code, material_id and quantity columns.')
+        parser.add_argument('--upsert', action='store_true', help='Replace the quantity of pairs that already exist.')
+        parser.add_argument('--chunk-size', type=int, default=settings.WH_BULK_CHUNK_SIZE)
+
+    def handle(self, *args, path, upsert, chunk_size, **options):
+        with open(path, encoding='utf-8', newline='') as file:
+            if path.endswith('.csv'):
+                rows = csv.DictReader(file)
+            elif path.endswith('.ndjson') or path.endswith('.jsonl'):
+                rows = ndjson_rows(file)
+            elif path.endswith('.json'):
+                rows = json.load(file)
+                if not is_row_stream(rows):
+                    raise CommandError('Expected a JSON array of rows')
+            else:
+                raise CommandError('Expected a .csv, .ndjson, .jsonl or .json file')
+            result = import_bom_rows(rows, chunk_size, upsert=upsert)
+
+        for error in result['errors']:
+            self.stderr.write(f"row {error['row']}: {json.dumps(error['errors'])}")
+        self.stdout.write(
+            f"{result['created']} created, {result['updated']} updated, "
+            f"{len(result['errors'])} rejected of {result['rows']} rows"
+        )
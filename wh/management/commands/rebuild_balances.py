@@ -0,0 +1,46 @@
+from math import isclose
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from wh.ledger import journal_balances, rebuild_balances
+from wh.models import MaterialBalance, Warehouse
+
+
+def mismatches(expected, actual):
+    return sorted(
+        (material_id, expected.get(material_id, 0), actual.get(material_id, 0))
+        for material_id in set(expected) | set(actual)
+        if not isclose(expected.get(material_id, 0), actual.get(material_id, 0), abs_tol=1e-6)
+    )
+
+
+class Command(BaseCommand):
+    help = 'Rebuild material balances from the stock movement journal, or verify them with --verify.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Only compare balances, journal and warehouse batches; change nothing.')
+
+    def handle(self, *args, verify, **options):
+        if not verify:
+            balances = rebuild_balances()
+            self.stdout.write(f'Rebuilt {len(balances)} material balances from the journal')
+            return
+
+        journal = journal_balances()
+        balances = dict(MaterialBalance.objects.values_list('material_id', 'quantity'))
+        batches = dict(
+            Warehouse.objects.values('material_id').annotate(total=Sum('remainder'))
+            .order_by().values_list('material_id', 'total')
+        )
+        problems = 0
+        for label, actual in [('balance', balances), ('warehouse', batches)]:
+            for material_id, expected_quantity, actual_quantity in mismatches(journal, actual):
+                problems += 1
+                self.stderr.write(
+                    f'material {material_id}: journal {expected_quantity} != {label} {actual_quantity}'
+                )
+        if problems:
+            raise CommandError(f'{problems} mismatches found')
+        self.stdout.write(f'{len(journal)} material balances match the journal and warehouse batches')
@@ -0,0 +1,46 @@
+from math import isclose
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wh.models import MaterialStockSummary
+from wh.stock_summary import computed_summaries, rebuild_summaries
+
+
+SUMMARY_FIELDS = ('batch_count', 'stock_value', 'min_price', 'max_price')
+
+
+def differs(expected, actual):
+    if isinstance(expected, float) or isinstance(actual, float):
+        return not isclose(expected or 0, actual or 0, rel_tol=1e-9, abs_tol=1e-6)
+    return expected != actual
+
+
+class Command(BaseCommand):
+    help = 'Rebuild material stock summaries from the warehouse batches, or verify them with --verify.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help='Only compare the stored summaries with freshly computed ones; change nothing.')
+
+    def handle(self, *args, verify, **options):
+        if not verify:
+            summaries = rebuild_summaries()
+            self.stdout.write(f'Rebuilt {len(summaries)} material stock summaries')
+            return
+
+        expected = {summary.material_id: summary for summary in computed_summaries()}
+        stored = {summary.material_id: summary for summary in MaterialStockSummary.objects.all()}
+        empty = MaterialStockSummary()
+        problems = 0
+        for material_id in sorted(set(expected) | set(stored)):
+            for field in SUMMARY_FIELDS:
+                expected_value = getattr(expected.get(material_id, empty), field)
+                actual_value = getattr(stored.get(material_id, empty), field)
+                if differs(expected_value, actual_value):
+                    problems += 1
+                    self.stderr.write(
+                        f'material {material_id}: {field} is {actual_value}, batches give {expected_value}'
+                    )
+        if problems:
+            raise CommandError(f'{problems} mismatches found')
+        self.stdout.write(f'{len(expected)} material stock summaries match the warehouse batches')
@@ -0,0 +1,354 @@
+import logging
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework.serializers import BaseSerializer, ListSerializer, Serializer
+
+
+logger = logging.getLogger(__name__)
+
+# Bounds of the exported histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUANTILES = (0.5, 0.9, 0.95, 0.99, 0.999)
+
+
+class LogLinearHistogram:
+    """
+    HDR-style histogram: values are counted in units of ``resolution``, with
+    buckets doubling in width every power of two, each split into
+    ``sub_buckets`` linear ones. Memory grows with the log of the range, and
+    quantiles are within ``1/sub_buckets`` of the recorded values.
+    """
+
+    def __init__(self, resolution=1e-5, sub_buckets=16):
+        self.resolution = resolution
+        self.sub_buckets = sub_buckets
+        self.counts = {}
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def bucket(self, value):
+        """Lowest value and width of the bucket of ``value``, in units."""
+        units = int(value/self.resolution)
+        shift = max(0, units.bit_length()-self.sub_buckets.bit_length())
+        return units >> shift << shift, 1 << shift
+
+    def record(self, value):
+        bucket = self.bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0)+1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """The highest value equivalent to the ``q`` quantile, as HDR histograms report it."""
+        if not self.count:
+            return 0
+        rank = max(1, round(q*self.count))
+        seen = 0
+        for (lowest, width), count in sorted(self.counts.items()):
+            seen += count
+            if seen >= rank:
+                return min((lowest+width)*self.resolution, self.max)
+        return self.max
+
+
+class RouteStats:
+
+    def __init__(self):
+        self.latency = LogLinearHistogram()
+        self.buckets = [0]*len(LATENCY_BUCKETS)
+        self.statuses = {}
+        self.queries = 0
+        self.db_seconds = 0
+        self.serializer_seconds = 0
+        self.render_seconds = 0
+
+    def record(self, sample):
+        self.latency.record(sample.seconds)
+        position = bisect_left(LATENCY_BUCKETS, sample.seconds)
+        if position < len(self.buckets):
+            self.buckets[position] += 1
+        self.statuses[sample.status] = self.statuses.get(sample.status, 0)+1
+        self.queries += sample.queries
+        self.db_seconds += sample.db_seconds
+        self.serializer_seconds += sample.serializer_seconds
+        self.render_seconds += sample.render_seconds
+
+
+def label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**values):
+    return '{'+','.join(f'{name}="{label_value(value)}"' for name, value in values.items())+'}'
+
+
+class MetricsRegistry:
+    """
+    Request metrics of this process by method and URL route. Every worker
+    process keeps its own, so each is scraped as its own target.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routes = {}
+
+    def record(self, sample):
+        with self._lock:
+            stats = self.routes.get((sample.method, sample.route))
+            if stats is None:
+                stats = self.routes[(sample.method, sample.route)] = RouteStats()
+            stats.record(sample)
+
+    def clear(self):
+        with self._lock:
+            self.routes = {}
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            routes = sorted(self.routes.items())
+            lines = [
+                '# HELP wh_requests_total Requests by route and status code.',
+                '# TYPE wh_requests_total counter',
+            ]
+            for (method, route), stats in routes:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'wh_requests_total{labels(method=method, route=route, status=status)} {count}')
+
+            lines += [
+                '# HELP wh_request_duration_seconds Wall time of requests by route.',
+                '# TYPE wh_request_duration_seconds histogram',
+            ]
+            for (method, route), stats in routes:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(f'wh_request_duration_seconds_bucket{labels(method=method, route=route, le=bound)} {cumulative}')
+                lines += [
+                    f'wh_request_duration_seconds_bucket{labels(method=method, route=route, le="+Inf")} {stats.latency.count}',
+                    f'wh_request_duration_seconds_sum{labels(method=method, route=route)} {stats.latency.sum}',
+                    f'wh_request_duration_seconds_count{labels(method=method, route=route)} {stats.latency.count}',
+                ]
+
+            lines += [
+                '# HELP wh_request_latency_seconds Quantiles of the wall time of requests by route.',
+                '# TYPE wh_request_latency_seconds summary',
+            ]
+            for (method, route), stats in routes:
+                for quantile in QUANTILES:
+                    lines.append(
+                        f'wh_request_latency_seconds{labels(method=method, route=route, quantile=quantile)} '
+                        f'{stats.latency.quantile(quantile)}'
+                    )
+                lines += [
+                    f'wh_request_latency_seconds_sum{labels(method=method, route=route)} {stats.latency.sum}',
+                    f'wh_request_latency_seconds_count{labels(method=method, route=route)} {stats.latency.count}',
+                ]
+
+            for name, attribute, description in [
+                ('wh_request_db_queries_total', 'queries', 'Database queries run by requests by route.'),
+                ('wh_request_db_seconds_total', 'db_seconds', 'Time requests spent in database queries by route.'),
+                ('wh_request_serializer_seconds_total', 'serializer_seconds',
+                 'Time spent validating and representing data in serializers, with the queries they run, by route.'),
+                ('wh_request_render_seconds_total', 'render_seconds', 'Time spent rendering response bodies by route.'),
+            ]:
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} counter']
+                for (method, route), stats in routes:
+                    lines.append(f'{name}{labels(method=method, route=route)} {getattr(stats, attribute)}')
+        return '\n'.join(lines)+'\n'
+
+
+metrics = MetricsRegistry()
+
+
+class RequestSample:
+    """What one request spent, filled in by ``RequestMetricsMiddleware``."""
+
+    def __init__(self, request):
+        self.method = request.method
+        self.path = request.path
+        self.route = None
+        self.status = None
+        self.seconds = 0
+        self.queries = 0
+        self.db_seconds = 0
+        self.serializer_seconds = 0
+        self.serializing = False
+        self.render_seconds = 0
+        self.render_started = None
+
+    def rendered(self, response):
+        self.render_seconds += perf_counter()-self.render_started
+
+
+# Copied into the threads that run the sync code of async requests
+current_sample = ContextVar('current_sample', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    sample = current_sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.db_seconds += perf_counter()-start
+        sample.queries += 1
+
+
+def timed_serialization(func):
+    """
+    Add the time spent in ``func`` to the serializer time of the current
+    request. Serializers nest, so only the outermost call counts.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        sample = current_sample.get()
+        if sample is None or sample.serializing:
+            return func(*args, **kwargs)
+        sample.serializing = True
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sample.serializer_seconds += perf_counter()-start
+            sample.serializing = False
+    wrapper.timed = True
+    return wrapper
+
+
+def install_serializer_timers():
+    """
+    Time ``is_valid()`` and ``.data`` of every DRF serializer, those of the
+    libraries included, into the sample of the current request.
+    """
+    for serializer_class in (BaseSerializer, Serializer, ListSerializer):
+        for name in ('is_valid', 'data'):
+            attribute = serializer_class.__dict__.get(name)
+            if attribute is None or getattr(getattr(attribute, 'fget', attribute), 'timed', False):
+                continue
+            if isinstance(attribute, property):
+                setattr(serializer_class, name, property(timed_serialization(attribute.fget)))
+            else:
+                setattr(serializer_class, name, timed_serialization(attribute))
+
+
+def install_query_recorder(connection):
+    """
+    Count the queries of ``connection`` into the sample of the current request.
+    Installed on every connection as it opens rather than per request: the
+    async ORM runs its queries on the connection of another thread.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def measured(content, sample):
+    """Iterate ``content`` with ``sample`` current while each chunk is produced."""
+    iterator = iter(content)
+    while True:
+        token = current_sample.set(sample)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            current_sample.reset(token)
+        yield chunk
+
+
+async def ameasured(content, sample):
+    """Async ``measured``."""
+    iterator = aiter(content)
+    while True:
+        token = current_sample.set(sample)
+        try:
+            chunk = await anext(iterator)
+        except StopAsyncIteration:
+            return
+        finally:
+            current_sample.reset(token)
+        yield chunk
+
+
+class RequestMetricsMiddleware:
+    """
+    Records wall time, database queries and time, serializer time and
+    response rendering time of every request into ``metrics`` under its URL route, and logs the
+    requests slower than ``WH_SLOW_REQUEST_SECONDS``. Streamed responses are
+    measured until their body is sent. Async-capable, so it does not add a
+    thread switch to the async views under ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install_serializer_timers()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        sample = request.metrics_sample = RequestSample(request)
+        token = current_sample.set(sample)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_sample.reset(token)
+        self.finish(request, response, sample, start)
+        return response
+
+    async def __acall__(self, request):
+        sample = request.metrics_sample = RequestSample(request)
+        token = current_sample.set(sample)
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_sample.reset(token)
+        self.finish(request, response, sample, start)
+        return response
+
+    def finish(self, request, response, sample, start):
+        if not response.streaming:
+            self.record(request, response, sample, perf_counter()-start)
+            return
+        # The body is produced after the view returned: keep counting its
+        # queries, and record the request once the server closes the response
+        if response.is_async:
+            response.streaming_content = ameasured(response.streaming_content, sample)
+        else:
+            response.streaming_content = measured(response.streaming_content, sample)
+        response._resource_closers.append(lambda: self.record(request, response, sample, perf_counter()-start))
+
+    def process_template_response(self, request, response):
+        # Called right before DRF responses render
+        sample = request.metrics_sample
+        sample.render_started = perf_counter()
+        response.add_post_render_callback(sample.rendered)
+        return response
+
+    def record(self, request, response, sample, seconds):
+        resolver_match = request.resolver_match
+        sample.route = f'/{resolver_match.route}' if resolver_match is not None else 'unmatched'
+        sample.status = response.status_code
+        sample.seconds = seconds
+        metrics.record(sample)
+        if seconds >= settings.WH_SLOW_REQUEST_SECONDS > 0:
+            logger.warning(
+                'Slow request: %s %s (%s) %s in %.3fs, %d queries in %.3fs, serializers %.3fs, rendered in %.3fs',
+                sample.method, sample.path, sample.route, sample.status, seconds,
+                sample.queries, sample.db_seconds, sample.serializer_seconds, sample.render_seconds
+            )
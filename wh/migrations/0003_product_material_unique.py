@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wh', '0002_alter_product_product_code'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='productmaterial',
+            constraint=models.UniqueConstraint(fields=('product', 'material'), name='unique_product_material'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:11
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wh', '0003_product_material_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reservation',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('reserved', 'reserved'), ('committed', 'committed'), ('released', 'released')], default='reserved', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReservationLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.FloatField()),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='wh.warehouse')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='wh.material')),
+                ('reservation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='wh.reservation')),
+            ],
+        ),
+    ]
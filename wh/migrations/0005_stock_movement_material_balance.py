@@ -0,0 +1,51 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_journal(apps, schema_editor):
+    # Record every existing batch as an opening receipt and derive the balances from it
+    Warehouse = apps.get_model('wh', 'Warehouse')
+    StockMovement = apps.get_model('wh', 'StockMovement')
+    MaterialBalance = apps.get_model('wh', 'MaterialBalance')
+    balances = {}
+    movements = []
+    for batch_id, material_id, remainder in Warehouse.objects.values_list('id', 'material_id', 'remainder').iterator():
+        movements.append(StockMovement(material_id=material_id, batch_id=batch_id, kind='receipt', quantity=remainder))
+        balances[material_id] = balances.get(material_id, 0)+remainder
+    StockMovement.objects.bulk_create(movements, batch_size=1000)
+    MaterialBalance.objects.bulk_create(
+        (MaterialBalance(material_id=material_id, quantity=quantity) for material_id, quantity in balances.items()),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wh', '0004_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialBalance',
+            fields=[
+                ('material', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='balance', serialize=False, to='wh.material')),
+                ('quantity', models.FloatField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('receipt', 'receipt'), ('issue', 'issue'), ('adjustment', 'adjustment')], max_length=20)),
+                ('quantity', models.FloatField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='wh.warehouse')),
+                ('material', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='wh.material')),
+                ('reservation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='wh.reservation')),
+            ],
+        ),
+        migrations.RunPython(open_journal, migrations.RunPython.noop),
+    ]
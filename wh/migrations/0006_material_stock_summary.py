@@ -0,0 +1,41 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def summarize_stock(apps, schema_editor):
+    # Summaries of the batches that exist before the signal handlers start maintaining them
+    Warehouse = apps.get_model('wh', 'Warehouse')
+    MaterialStockSummary = apps.get_model('wh', 'MaterialStockSummary')
+    summaries = {}
+    for material_id, remainder, price in Warehouse.objects.values_list('material_id', 'remainder', 'price').iterator():
+        summary = summaries.setdefault(material_id, MaterialStockSummary(material_id=material_id))
+        summary.total_remainder += remainder
+        summary.batch_count += 1
+        summary.stock_value += remainder*float(price)
+        summary.min_price = price if summary.min_price is None else min(summary.min_price, price)
+        summary.max_price = price if summary.max_price is None else max(summary.max_price, price)
+    MaterialStockSummary.objects.bulk_create(summaries.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wh', '0005_stock_movement_material_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterialStockSummary',
+            fields=[
+                ('material', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_summary', serialize=False, to='wh.material')),
+                ('total_remainder', models.FloatField(default=0)),
+                ('batch_count', models.IntegerField(default=0)),
+                ('stock_value', models.FloatField(default=0)),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=12, null=True)),
+            ],
+        ),
+        migrations.RunPython(summarize_stock, migrations.RunPython.noop),
+    ]
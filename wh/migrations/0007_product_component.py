@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-18 20:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wh', '0006_material_stock_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductComponent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.FloatField()),
+                ('component', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='used_in', to='wh.product')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='components', to='wh.product')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('product', 'component'), name='unique_product_component'), models.CheckConstraint(condition=models.Q(('product', models.F('component')), _negated=True), name='product_component_not_self')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-18 21:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wh', '0007_product_component'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='materialstocksummary',
+            name='total_remainder',
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 import uuid
 
 class Product(models.Model):
@@ -21,13 +21,131 @@ class ProductMaterial(models.Model):
     material = models.ForeignKey(Material, on_delete=models.CASCADE)
     quantity = models.FloatField()
     
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'material'], name='unique_product_material'),
+        ]
+    
     def __str__(self) -> str:
         return f"{self.pk}) {self.quantity} pcs {self.material}(s) for make {self.product}"
+
+
+class ProductComponent(models.Model):
+    """A product used as a sub-assembly of another product."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='components')
+    component = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='used_in')
+    quantity = models.FloatField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'component'], name='unique_product_component'),
+            models.CheckConstraint(condition=~models.Q(product=models.F('component')), name='product_component_not_self'),
+        ]
+    
+    def __str__(self) -> str:
+        return f"{self.pk}) {self.quantity} pcs {self.component}(s) for make {self.product}"
     
 class Warehouse(models.Model):
     material = models.ForeignKey(Material, on_delete=models.CASCADE)
     remainder = models.FloatField()
     price = models.DecimalField(max_digits=12, decimal_places=2)
     
+    STOCK_FIELDS = {'material_id', 'remainder', 'price'}
+    
+    # The receivers journaling and summarizing stock changes must commit or
+    # roll back with the row, and Django only wraps saves of child models
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+    
+    def delete(self, using=None, keep_parents=False):
+        with transaction.atomic(using=using):
+            return super().delete(using=using, keep_parents=keep_parents)
+    
+    def stock_state(self):
+        return {
+            'material_id': self.material_id,
+            'remainder': self.remainder,
+            'price': self.price,
+        }
+    
     def __str__(self) -> str:
         return f"{self.material}-{self.remainder}"
+
+
+RESERVED, COMMITTED, RELEASED = "reserved", "committed", "released"
+
+class Reservation(models.Model):
+    STATUS = (
+        (RESERVED, RESERVED),
+        (COMMITTED, COMMITTED),
+        (RELEASED, RELEASED),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=20, choices=STATUS, default=RESERVED)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self) -> str:
+        return f"{self.pk} ({self.status})"
+
+
+class ReservationLine(models.Model):
+    reservation = models.ForeignKey(Reservation, on_delete=models.CASCADE, related_name='lines')
+    batch = models.ForeignKey(Warehouse, on_delete=models.PROTECT)
+    material = models.ForeignKey(Material, on_delete=models.CASCADE)
+    quantity = models.FloatField()
+    
+    def __str__(self) -> str:
+        return f"{self.quantity} {self.material} from batch {self.batch_id}"
+
+
+RECEIPT, ISSUE, ADJUSTMENT = "receipt", "issue", "adjustment"
+
+class StockMovement(models.Model):
+    KIND = (
+        (RECEIPT, RECEIPT),
+        (ISSUE, ISSUE),
+        (ADJUSTMENT, ADJUSTMENT),
+    )
+    material = models.ForeignKey(Material, on_delete=models.CASCADE)
+    batch = models.ForeignKey(Warehouse, on_delete=models.SET_NULL, null=True, blank=True)
+    reservation = models.ForeignKey(Reservation, on_delete=models.SET_NULL, null=True, blank=True)
+    kind = models.CharField(max_length=20, choices=KIND)
+    # Signed: receipts and returns are positive, issues negative
+    quantity = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self) -> str:
+        return f"{self.kind} {self.quantity} {self.material}"
+
+
+class MaterialBalance(models.Model):
+    material = models.OneToOneField(Material, on_delete=models.CASCADE, primary_key=True, related_name='balance')
+    quantity = models.FloatField(default=0)
+    
+    def __str__(self) -> str:
+        return f"{self.material}: {self.quantity}"
+
+
+class MaterialStockSummary(models.Model):
+    material = models.OneToOneField(Material, on_delete=models.CASCADE, primary_key=True, related_name='stock_summary')
+    batch_count = models.IntegerField(default=0)
+    # Sum of remainder*price over all batches, for the weighted average price
+    stock_value = models.FloatField(default=0)
+    min_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True)
+    
+    @property
+    def total_remainder(self):
+        # Kept once, as the material's ledger balance
+        balance = getattr(self.material, 'balance', None)
+        return balance.quantity if balance is not None else 0.0
+
+    @property
+    def weighted_average_price(self):
+        if not self.total_remainder:
+            return None
+        return self.stock_value/self.total_remainder
+    
+    def __str__(self) -> str:
+        return f"{self.material}: {self.total_remainder} in {self.batch_count} batches"
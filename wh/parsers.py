@@ -0,0 +1,50 @@
+import csv
+import json
+
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+
+
+def decoded_lines(stream, encoding):
+    for line in stream:
+        yield line.decode(encoding)
+
+
+class MalformedRow:
+    """Takes the place of a line that does not parse, so it is reported like any invalid row."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parses newline-delimited JSON. Rows are yielded lazily while the body is
+    read, so large uploads are never held in memory as a whole. A line that
+    is not JSON becomes a ``MalformedRow`` instead of failing the rest.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        return self.rows(stream, encoding) if stream is not None else iter(())
+
+    def rows(self, stream, encoding):
+        for line_number, line in enumerate(decoded_lines(stream, encoding), start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield MalformedRow(f'NDJSON parse error on line {line_number} - {exc}')
+
+
+class CSVParser(BaseParser):
+    """Parses CSV with a header row, yielding one dict per data row."""
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if stream is None:
+            return iter(())
+        return csv.DictReader(decoded_lines(stream, encoding))
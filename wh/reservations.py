@@ -0,0 +1,181 @@
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, When
+
+from .availability import load_catalogue, accumulate_requirements
+from .caching import invalidate_lists
+from .ledger import record_movements
+from .stock_summary import summary_deltas, apply_summary_deltas
+from .models import Warehouse, Reservation, ReservationLine, StockMovement, RESERVED, COMMITTED, RELEASED,\
+    ISSUE, ADJUSTMENT
+
+
+# Keeps the OR-ed conditions of one UPDATE well below SQLite's expression depth limit
+UPDATE_BATCH_SIZE = 200
+
+
+class UnknownProducts(Exception):
+
+    def __init__(self, product_codes):
+        super().__init__(f'Unmatched product codes: {product_codes}')
+        self.product_codes = product_codes
+
+
+class InsufficientStock(Exception):
+
+    def __init__(self, shortages):
+        super().__init__('Not enough stock')
+        self.shortages = shortages
+
+
+class StockConflict(Exception):
+    """A batch changed between reading and updating it; the reservation is retried."""
+
+
+class ReservationStateError(Exception):
+    pass
+
+
+def locked_batches(material_ids):
+    """
+    Batches with stock left for ``material_ids`` in FIFO order. Rows are
+    locked with SELECT ... FOR UPDATE where the backend supports it; elsewhere
+    the conditional update in ``take_stock`` guards against concurrent writers.
+    """
+    queryset = Warehouse.objects.filter(material_id__in=material_ids, remainder__gt=0).order_by('id')
+    if connection.features.has_select_for_update:
+        queryset = queryset.select_for_update()
+    return queryset.values_list('id', 'material_id', 'remainder', 'price')
+
+
+def plan_allocation(requirements, batches):
+    """Spread each requirement FIFO over ``batches``; return ``{(batch_id, material_id): quantity}``."""
+    needed = {material_id: required for material_id, (_, required) in requirements.items()}
+    available = dict.fromkeys(requirements, 0)
+    takes = {}
+    for batch_id, material_id, remainder, _ in batches:
+        available[material_id] += remainder
+        if needed[material_id] > 0:
+            taken_quantity = min(needed[material_id], remainder)
+            takes[(batch_id, material_id)] = taken_quantity
+            needed[material_id] -= taken_quantity
+
+    shortages = [
+        {
+            'material_id': material_id,
+            'material_name': requirements[material_id][0],
+            'required_quantity': requirements[material_id][1],
+            'available_quantity': available[material_id],
+            'shortage': missing_quantity,
+        }
+        for material_id, missing_quantity in needed.items()
+        if missing_quantity > 0
+    ]
+    if shortages:
+        raise InsufficientStock(shortages)
+    return takes
+
+
+def take_stock(takes):
+    """
+    Subtract every take from its batch with one UPDATE per ``UPDATE_BATCH_SIZE``
+    batches. Each batch only matches while ``remainder >= quantity``, so a
+    short row count means another writer got there first.
+    """
+    items = [(batch_id, quantity) for (batch_id, _), quantity in takes.items()]
+    for start in range(0, len(items), UPDATE_BATCH_SIZE):
+        chunk = items[start:start+UPDATE_BATCH_SIZE]
+        updated = Warehouse.objects.filter(reduce(or_, (
+            Q(pk=batch_id, remainder__gte=quantity) for batch_id, quantity in chunk
+        ))).update(remainder=Case(*(
+            When(pk=batch_id, then=F('remainder')-quantity) for batch_id, quantity in chunk
+        ), default=F('remainder')))
+        if updated != len(chunk):
+            raise StockConflict()
+
+
+def return_stock(lines):
+    items = [(batch_id, quantity) for batch_id, _, quantity, _ in lines]
+    for start in range(0, len(items), UPDATE_BATCH_SIZE):
+        chunk = items[start:start+UPDATE_BATCH_SIZE]
+        Warehouse.objects.filter(pk__in=[batch_id for batch_id, _ in chunk]).update(remainder=Case(*(
+            When(pk=batch_id, then=F('remainder')+quantity) for batch_id, quantity in chunk
+        ), default=F('remainder')))
+
+
+def summarize_stock_changes(changes):
+    """Move the stock summaries by ``(material_id, quantity, price)`` changes to batch remainders."""
+    deltas = summary_deltas()
+    for material_id, quantity, price in changes:
+        deltas[material_id].add_stock(quantity, price)
+    # The batches exist, so do their materials' summaries
+    apply_summary_deltas(deltas, create=False)
+
+
+def reserve(items):
+    """
+    Allocate the materials of an order FIFO across batches and hold them by
+    decrementing ``Warehouse.remainder``. Either the whole order is reserved
+    or nothing is.
+    """
+    catalogue = load_catalogue(item['product_code'] for item in items)
+    requirements, unmatched_codes = accumulate_requirements(items, catalogue)
+    if unmatched_codes:
+        raise UnknownProducts(unmatched_codes)
+
+    for _ in range(settings.WH_RESERVATION_RETRIES):
+        try:
+            with transaction.atomic():
+                batches = list(locked_batches(requirements.keys()))
+                takes = plan_allocation(requirements, batches)
+                take_stock(takes)
+                prices = {batch_id: price for batch_id, _, _, price in batches}
+                summarize_stock_changes(
+                    (material_id, -quantity, prices[batch_id]) for (batch_id, material_id), quantity in takes.items()
+                )
+                reservation = Reservation.objects.create()
+                ReservationLine.objects.bulk_create(
+                    ReservationLine(reservation=reservation, batch_id=batch_id, material_id=material_id, quantity=quantity)
+                    for (batch_id, material_id), quantity in takes.items()
+                )
+                record_movements([
+                    StockMovement(material_id=material_id, batch_id=batch_id, reservation=reservation, kind=ISSUE, quantity=-quantity)
+                    for (batch_id, material_id), quantity in takes.items()
+                ])
+        except StockConflict:
+            continue
+        invalidate_lists(Warehouse)
+        return reservation, takes
+    raise StockConflict()
+
+
+def set_status(reservation_id, status):
+    """Move a reserved reservation to ``status``; fail if it is no longer reserved."""
+    updated = Reservation.objects.filter(pk=reservation_id, status=RESERVED).update(status=status)
+    if not updated:
+        if Reservation.objects.filter(pk=reservation_id).exists():
+            raise ReservationStateError('Reservation is not in reserved state.')
+        raise Reservation.DoesNotExist()
+
+
+def commit(reservation_id):
+    """Turn a reservation into a consumption; the stock was already taken when reserving."""
+    set_status(reservation_id, COMMITTED)
+
+
+def release(reservation_id):
+    """Give the reserved quantities back to their batches."""
+    with transaction.atomic():
+        set_status(reservation_id, RELEASED)
+        lines = list(ReservationLine.objects.filter(reservation_id=reservation_id)
+                     .values_list('batch_id', 'material_id', 'quantity', 'batch__price'))
+        return_stock(lines)
+        summarize_stock_changes((material_id, quantity, price) for _, material_id, quantity, price in lines)
+        record_movements([
+            StockMovement(material_id=material_id, batch_id=batch_id, reservation_id=reservation_id, kind=ADJUSTMENT, quantity=quantity)
+            for batch_id, material_id, quantity, _ in lines
+        ])
+    invalidate_lists(Warehouse)
@@ -1,6 +1,21 @@
 from rest_framework import serializers
-from .models import Product, ProductMaterial, Material, Warehouse
+from .models import Product, ProductMaterial, ProductComponent, Material, Warehouse, Reservation, ReservationLine
 from rest_framework.exceptions import ValidationError, NotFound
+from .availability import check_availability, check_availability_rollup, \
+    track_material_batches, track_material_batches_rollup
+from .bom import BOMCycleError, creates_cycle
+from .buildable import SOLVERS, INDEPENDENT
+from . import batch_availability
+
+
+CYCLIC_BOM_MESSAGE = 'Bill of materials contains a cycle.'
+
+
+def cyclic_bom_error(exc):
+    return ValidationError({
+        'message':CYCLIC_BOM_MESSAGE,
+        'product_ids':[str(product_id) for product_id in exc.product_ids]
+    })
 
 class ProductSerializer(serializers.ModelSerializer):
     id = serializers.UUIDField(required=False, read_only=True)
@@ -56,6 +71,36 @@ class ProductMaterialSerializer(serializers.ModelSerializer):
             quantity=quantity
         )
         return product_material
+
+
+class ProductComponentSerializer(serializers.ModelSerializer):
+    product = ProductSerializer(read_only=True)
+    component = ProductSerializer(read_only=True)
+    product_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), source='product')
+    component_id = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), source='component')
+    quantity = serializers.FloatField(min_value=0)
+    
+    class Meta:
+        model = ProductComponent
+        fields = ['id', 'product_id', 'component_id', 'product', 'component', 'quantity']
+        # Checked in validate() so the message matches ProductMaterialSerializer
+        validators = []
+        
+    def validate(self, attrs):
+        product = attrs.get('product', getattr(self.instance, 'product', None))
+        component = attrs.get('component', getattr(self.instance, 'component', None))
+        duplicates = ProductComponent.objects.filter(product=product, component=component)
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise ValidationError({
+                'message': 'This product-component combination already exists.'
+            })
+        if creates_cycle(product.pk, component.pk):
+            raise ValidationError({
+                'message': CYCLIC_BOM_MESSAGE
+            })
+        return super().validate(attrs)
         
     
 class WarehouseSerializer(serializers.ModelSerializer):
@@ -68,149 +113,135 @@ class WarehouseSerializer(serializers.ModelSerializer):
         
     def validate(self, attrs):
         material = attrs.get('material')
-        print(material)
         if not material:
             raise ValidationError("Material not found")
         return super().validate(attrs)
     
 
+class BulkCreateParamsSerializer(serializers.Serializer):
+    chunk_size = serializers.IntegerField(required=False, min_value=1, max_value=10000)
+
+
+class BOMImportParamsSerializer(BulkCreateParamsSerializer):
+    upsert = serializers.BooleanField(required=False, default=False)
+
+
+class WarehouseExportParamsSerializer(serializers.Serializer):
+    output = serializers.ChoiceField(choices=['ndjson', 'csv'], required=False, default='ndjson')
+    material = serializers.IntegerField(required=False)
+    in_stock = serializers.BooleanField(required=False, default=False)
+
+
 class ProductItemSerializer(serializers.Serializer):
     product_code = serializers.IntegerField()
     quantity = serializers.IntegerField()
 
 
-class CheckAvailabilitySerializer(serializers.Serializer):
+class ProductOrderSerializer(serializers.Serializer):
     products = serializers.ListField(child=ProductItemSerializer())
+    rollup = serializers.BooleanField(required=False, default=False)
     
     def validate(self, attrs):
         if type(attrs.get('products'))!=list:
             raise ValidationError({
                 'message':'Data should be list of products'
             })
+        return attrs
+
+
+class CheckAvailabilitySerializer(ProductOrderSerializer):
     
-        data = self.check_availability(attrs['products'])
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        try:
+            if attrs.get('rollup'):
+                return self.check_rollup(attrs['products'])
+            data = self.check_availability(attrs['products'])
+        except BOMCycleError as exc:
+            raise cyclic_bom_error(exc)
         return data
     
     def check_availability(self, data):
-        required_materials = []
-        
-        for item in data:
-            if Product.objects.filter(product_code=item['product_code']).exists():
-                product = Product.objects.get(product_code=item['product_code'])
-            else:
-                unmatched_product_code = item.get('product_code')
-                required_materials.append({
-                    'input_code': unmatched_product_code,
-                    'message': 'Unmatched product code.'
-                })
-                continue
-            
-            if ProductMaterial.objects.filter(product=product).exists():
-                product_materials = ProductMaterial.objects.filter(product=product)
-                materials = []
-                
-                for product_material in product_materials:
-                    warehouse_entries = Warehouse.objects.filter(material=product_material.material)
-                    
-                    total_available_quantity = sum(entry.remainder for entry in warehouse_entries)
-
-                    required_quantity = product_material.quantity*item['quantity']
-                    if total_available_quantity >= required_quantity:
-                        status = 'Enough'
-                        shortage = 0
-                    else:
-                        status = 'Not enough'
-                        shortage = required_quantity - total_available_quantity
-                    
-                    materials.append({
-                        'material_name': product_material.material.material_name,
-                        'required_quantity': required_quantity,
-                        'available_quantity': total_available_quantity,
-                        'status': status,
-                        'shortage': shortage if shortage > 0 else None
-                    })
-            
-           
-            required_materials.append({
-                'product_name': product.product_name,
-                'materials': materials
-            })
-        
-        return required_materials
+        return check_availability(data)
+    
+    def check_rollup(self, data):
+        return check_availability_rollup(data)
 
         
-class MaterialBatchTrackingSerializer(serializers.Serializer):
-    products = serializers.ListField(child=ProductItemSerializer())
+class MaterialBatchTrackingSerializer(ProductOrderSerializer):
     
     def validate(self, attrs):
-        if type(attrs.get('products'))!=list:
-            raise ValidationError({
-                'message':'Data should be list of products'
-            })
-    
-        data = self.check_availability(attrs['products'])
+        attrs = super().validate(attrs)
+        try:
+            if attrs.get('rollup'):
+                return self.check_rollup(attrs['products'])
+            data = self.check_availability(attrs['products'])
+        except BOMCycleError as exc:
+            raise cyclic_bom_error(exc)
         return data
     
     def check_availability(self, data):
-        required_materials = []
-        warehouse_materials = Warehouse.objects.all()
-        warehouse_materials_count = {}
-        for warehouse_item in warehouse_materials:
-            if warehouse_materials_count.get(warehouse_item.material.material_name) is not None:
-                warehouse_materials_count[warehouse_item.material.material_name]+= warehouse_item.remainder
-            else:
-                warehouse_materials_count[warehouse_item.material.material_name] = warehouse_item.remainder
-        
-        
-        for item in data:
-            if Product.objects.filter(product_code=item['product_code']).exists():
-                product = Product.objects.get(product_code=item['product_code'])
-            else:
-                unmatched_product_code = item.get('product_code')
-                required_materials.append({
-                    'input_code': unmatched_product_code,
-                    'message': 'Unmatched product code.'
-                })
-                continue
-            
-            if ProductMaterial.objects.filter(product=product).exists():
-                product_materials = ProductMaterial.objects.filter(product=product)
-                materials = []
-                for product_material in product_materials:
-                    total_required_quantity = product_material.quantity*item['quantity']
-                    
-                    warehouse_entries = Warehouse.objects.filter(material=product_material.material)
-                    
-                    wh_material = []
-                    wh_entire_sum=total_required_quantity
-                    for wh_entire in warehouse_entries:
-                        reminder = wh_entire.remainder
-                        if total_required_quantity<= warehouse_materials_count[wh_entire.material.material_name]:
-                            wh_material.append({   
-                                                    'available_quantity':warehouse_materials_count[wh_entire.material.material_name],
-                                                })
-                        
-                            warehouse_materials_count[wh_entire.material.material_name]-=total_required_quantity
-                            break
-                        else:
-                            missing_quantity = total_required_quantity-warehouse_materials_count[wh_entire.material.material_name]
-                            wh_material.append({   
-                                                    'available_quantity':warehouse_materials_count[wh_entire.material.material_name],
-                                                    'missing_quantity':missing_quantity
-                                                })
-
-                            warehouse_materials_count[wh_entire.material.material_name]-=warehouse_materials_count[wh_entire.material.material_name]
-                            break
-                    materials.append({
-                        'material_name':product_material.material.material_name,
-                        'material_batches': wh_material,
-                        'required_quantity':total_required_quantity,
-                    })
-                    
-            required_materials.append({
-                'product_name': product.product_name,
-                'materials': materials
-            })
-        
-        return required_materials
+        return track_material_batches(data)
+    
+    def check_rollup(self, data):
+        return track_material_batches_rollup(data)
+
+
+class BuildableItemSerializer(serializers.Serializer):
+    product_code = serializers.IntegerField()
+    # Units per kit in kit mode, an upper bound in priority mode
+    quantity = serializers.IntegerField(required=False, min_value=1)
+
+
+class MaxBuildableSerializer(serializers.Serializer):
+    products = serializers.ListField(child=BuildableItemSerializer(), allow_empty=False)
+    mode = serializers.ChoiceField(choices=list(SOLVERS), required=False, default=INDEPENDENT)
+    
+    def validate(self, attrs):
+        try:
+            return SOLVERS[attrs['mode']](attrs['products'])
+        except BOMCycleError as exc:
+            raise cyclic_bom_error(exc)
+
+
+class BatchOrderSerializer(serializers.Serializer):
+    order_id = serializers.CharField(required=False, allow_null=True, default=None)
+    # Lower goes first in sequential mode
+    priority = serializers.IntegerField(required=False, default=0)
+    products = serializers.ListField(child=ProductItemSerializer())
+
+
+class BatchAvailabilitySerializer(serializers.Serializer):
+    orders = serializers.ListField(child=BatchOrderSerializer(), allow_empty=False)
+    mode = serializers.ChoiceField(
+        choices=batch_availability.MODES, required=False, default=batch_availability.INDEPENDENT
+    )
+    
+    def validate(self, attrs):
+        try:
+            return batch_availability.check_orders(attrs['orders'], attrs['mode'])
+        except BOMCycleError as exc:
+            raise cyclic_bom_error(exc)
+
+
+class ReservationItemSerializer(ProductItemSerializer):
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class ReservationCreateSerializer(serializers.Serializer):
+    products = serializers.ListField(child=ReservationItemSerializer(), allow_empty=False)
+
+
+class ReservationLineSerializer(serializers.ModelSerializer):
+    
+    class Meta:
+        model = ReservationLine
+        fields = ['batch_id', 'material_id', 'quantity']
+
+
+class ReservationSerializer(serializers.ModelSerializer):
+    lines = ReservationLineSerializer(many=True, read_only=True)
     
+    class Meta:
+        model = Reservation
+        fields = ['id', 'status', 'created_at', 'lines']
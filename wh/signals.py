@@ -0,0 +1,120 @@
+from django.db import connection, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from .bom import ancestor_ids
+from .bom_cache import bom_cache
+from .bom_snapshot import mark_changed
+from .caching import invalidate_lists
+from .ledger import record_movements, batch_movements
+from .metrics import install_query_recorder
+from .stock_summary import update_batch_summary
+from .models import Product, Material, ProductMaterial, ProductComponent, Warehouse
+
+
+def invalidate_bom_products(product_ids):
+    """
+    Drop the cached BOMs of ``product_ids`` and of every product using them
+    as a sub-assembly, now and once more after commit, so nothing another
+    thread loaded before the transaction committed survives.
+    """
+    product_ids = list(ancestor_ids(product_ids))
+    bom_cache.invalidate_products(product_ids)
+    transaction.on_commit(lambda: bom_cache.invalidate_products(product_ids))
+    mark_changed(product_ids)
+
+
+def clear_bom_cache():
+    bom_cache.clear()
+    transaction.on_commit(bom_cache.clear)
+    mark_changed()
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    invalidate_bom_products([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Material)
+def material_changed(sender, instance, created=False, **kwargs):
+    # A new material is not part of any BOM yet
+    if not created:
+        clear_bom_cache()
+
+
+@receiver([post_save, post_delete], sender=ProductMaterial)
+def product_material_changed(sender, instance, created=False, signal=None, **kwargs):
+    if created or signal is post_delete:
+        invalidate_bom_products([instance.product_id])
+    else:
+        # The row may have been moved away from another product
+        clear_bom_cache()
+
+
+@receiver([post_save, post_delete], sender=ProductComponent)
+def product_component_changed(sender, instance, created=False, signal=None, **kwargs):
+    if created or signal is post_delete:
+        invalidate_bom_products([instance.product_id])
+    else:
+        clear_bom_cache()
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Material)
+@receiver([post_save, post_delete], sender=ProductMaterial)
+@receiver([post_save, post_delete], sender=ProductComponent)
+@receiver([post_save, post_delete], sender=Warehouse)
+def model_changed(sender, **kwargs):
+    invalidate_lists(sender)
+
+
+def stored_stock(batch_id):
+    """
+    The stock fields of a batch as stored, locked until the save commits where
+    the backend can: a concurrent edit waits instead of computing its delta
+    from the same value.
+    """
+    queryset = Warehouse.objects.filter(pk=batch_id)
+    if connection.features.has_select_for_update:
+        queryset = queryset.select_for_update()
+    return queryset.values(*Warehouse.STOCK_FIELDS).first()
+
+
+@receiver(pre_save, sender=Warehouse)
+def remember_stored_stock(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        return
+    instance._stored_stock = stored_stock(instance.pk)
+
+
+@receiver(pre_delete, sender=Warehouse)
+def remember_deleted_stock(sender, instance, **kwargs):
+    instance._stored_stock = stored_stock(instance.pk)
+
+
+@receiver(post_save, sender=Warehouse)
+def batch_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    before = None if created else getattr(instance, '_stored_stock', None)
+    after = instance.stock_state()
+    record_movements(batch_movements(before, after, instance.pk))
+    update_batch_summary(before, after)
+    instance._stored_stock = after
+
+
+@receiver(post_delete, sender=Warehouse)
+def batch_deleted(sender, instance, origin=None, **kwargs):
+    before = getattr(instance, '_stored_stock', None) or instance.stock_state()
+    # A material deleted along with its batches takes its journal and balance with it
+    if getattr(origin, 'model', type(origin)) is not Material:
+        # The journal outlives the batch, so the entry is not linked to it
+        record_movements(batch_movements(before, None, None))
+    # The summary row may already be gone when the material is deleted along with its batches
+    update_batch_summary(before, None, create=False)
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    install_query_recorder(connection)
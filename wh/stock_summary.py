@@ -0,0 +1,145 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Max, Min, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .ledger import DELTA_UPDATE_SIZE, apply_deltas
+from .models import MaterialStockSummary, Warehouse
+
+
+class SummaryDelta:
+    """Change to one material's summary: sums are added, prices only widen the bounds."""
+    __slots__ = ('value', 'batches', 'min_price', 'max_price')
+
+    def __init__(self):
+        self.value = 0.0
+        self.batches = 0
+        self.min_price = None
+        self.max_price = None
+
+    def add_stock(self, remainder, price):
+        self.value += remainder*float(price)
+
+    def add_batch(self, remainder, price):
+        self.add_stock(remainder, price)
+        self.batches += 1
+        price = Decimal(price)
+        self.min_price = price if self.min_price is None else min(self.min_price, price)
+        self.max_price = price if self.max_price is None else max(self.max_price, price)
+
+    def remove_batch(self, remainder, price):
+        self.add_stock(-remainder, price)
+        self.batches -= 1
+
+
+def summary_deltas():
+    return defaultdict(SummaryDelta)
+
+
+def widened(field, bound, deltas):
+    cases = [
+        When(material_id=material_id, then=bound(Coalesce(F(field), Value(price)), Value(price)))
+        for material_id, price in ((material_id, getattr(delta, field)) for material_id, delta in deltas)
+        if price is not None
+    ]
+    return Case(*cases, default=F(field)) if cases else F(field)
+
+
+def apply_summary_deltas(deltas, create=True):
+    """
+    Apply ``{material_id: SummaryDelta}`` through ``apply_deltas``. The stock
+    total is not part of it: that is the material's ledger balance.
+    """
+    def price_bounds(material_ids):
+        chunk = [(material_id, deltas[material_id]) for material_id in material_ids]
+        return {'min_price': widened('min_price', Least, chunk), 'max_price': widened('max_price', Greatest, chunk)}
+
+    apply_deltas(
+        MaterialStockSummary,
+        {material_id: {'stock_value': delta.value, 'batch_count': delta.batches} for material_id, delta in deltas.items()},
+        create=create,
+        expressions=price_bounds
+    )
+
+
+def refresh_price_bounds(material_ids):
+    """
+    Recompute min and max price of ``material_ids`` from their batches, for
+    when a batch holding a bound was removed or repriced.
+    """
+    material_ids = list(material_ids)
+    price_field = MaterialStockSummary._meta.get_field('min_price')
+    bounds = {
+        material_id: (min_price, max_price)
+        for material_id, min_price, max_price in Warehouse.objects.filter(material_id__in=material_ids)
+        .values('material_id').annotate(min_price=Min('price'), max_price=Max('price'))
+        .order_by().values_list('material_id', 'min_price', 'max_price')
+    }
+    for start in range(0, len(material_ids), DELTA_UPDATE_SIZE):
+        chunk = material_ids[start:start+DELTA_UPDATE_SIZE]
+        MaterialStockSummary.objects.filter(material_id__in=chunk).update(
+            min_price=Case(*(
+                When(material_id=material_id, then=Value(bounds.get(material_id, (None, None))[0], output_field=price_field))
+                for material_id in chunk
+            ), default=F('min_price')),
+            max_price=Case(*(
+                When(material_id=material_id, then=Value(bounds.get(material_id, (None, None))[1], output_field=price_field))
+                for material_id in chunk
+            ), default=F('max_price')),
+        )
+
+
+def batch_summary_deltas(before, after):
+    """
+    Summary changes that turn the stock state ``before`` of a batch into
+    ``after``, either of which is ``None`` for a batch that does not exist.
+    Also returns the materials whose price bounds need recomputing.
+    """
+    deltas = summary_deltas()
+    stale_bounds = set()
+    if before is not None and after is not None and before['material_id'] == after['material_id']:
+        deltas[after['material_id']].add_stock(after['remainder'], after['price'])
+        deltas[after['material_id']].add_stock(-before['remainder'], before['price'])
+        if Decimal(before['price']) != Decimal(after['price']):
+            stale_bounds.add(after['material_id'])
+        return deltas, stale_bounds
+    if before is not None:
+        deltas[before['material_id']].remove_batch(before['remainder'], before['price'])
+        stale_bounds.add(before['material_id'])
+    if after is not None:
+        deltas[after['material_id']].add_batch(after['remainder'], after['price'])
+    return deltas, stale_bounds
+
+
+def update_batch_summary(before, after, create=True):
+    deltas, stale_bounds = batch_summary_deltas(before, after)
+    with transaction.atomic(savepoint=False):
+        apply_summary_deltas(deltas, create=create)
+        if stale_bounds:
+            refresh_price_bounds(stale_bounds)
+
+
+def computed_summaries():
+    """``MaterialStockSummary`` rows computed from scratch with one aggregate query."""
+    return [
+        MaterialStockSummary(material_id=row['material_id'], **{key: row[key] for key in (
+            'batch_count', 'stock_value', 'min_price', 'max_price'
+        )})
+        for row in Warehouse.objects.values('material_id').annotate(
+            batch_count=Count('id'),
+            stock_value=Sum(F('remainder')*F('price'), output_field=FloatField()),
+            min_price=Min('price'),
+            max_price=Max('price'),
+        ).order_by()
+    ]
+
+
+def rebuild_summaries():
+    """Replace every ``MaterialStockSummary`` with one computed from the warehouse batches."""
+    with transaction.atomic():
+        summaries = computed_summaries()
+        MaterialStockSummary.objects.all().delete()
+        MaterialStockSummary.objects.bulk_create(summaries, batch_size=1000)
+    return summaries
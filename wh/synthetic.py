@@ -0,0 +1,76 @@
+import random
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max
+
+from .bulk import ingest_warehouse_rows
+from .caching import invalidate_lists
+from .models import Material, Product, ProductMaterial, ProductComponent
+from .signals import clear_bom_cache
+
+
+def generate_catalogue(products, materials, fan_out, batches_per_material, components=0, seed=0, chunk_size=1000):
+    """
+    Bulk-insert a synthetic catalogue: ``materials`` materials with
+    ``batches_per_material`` warehouse batches each, and ``products`` products
+    with ``fan_out`` BOM materials each. With ``components``, every product
+    after the first also holds up to that many earlier products as
+    sub-assemblies, so BOMs nest without cycles.
+
+    The same arguments give the same catalogue. Product codes continue after
+    the highest existing one. Returns the counts created and the code range.
+    """
+    rng = random.Random(seed)
+    fan_out = min(fan_out, materials)
+    with transaction.atomic():
+        first_code = (Product.objects.aggregate(code=Max('product_code'))['code'] or 0)+1
+        material_rows = Material.objects.bulk_create(
+            (Material(material_name=f'Synthetic material {i}') for i in range(materials)), batch_size=chunk_size
+        )
+        product_rows = Product.objects.bulk_create(
+            (Product(product_name=f'Synthetic product {code}', product_code=code)
+             for code in range(first_code, first_code+products)),
+            batch_size=chunk_size
+        )
+        product_materials = ProductMaterial.objects.bulk_create(
+            (
+                ProductMaterial(product=product, material=material, quantity=rng.randint(1, 5))
+                for product in product_rows
+                for material in rng.sample(material_rows, fan_out)
+            ),
+            batch_size=chunk_size
+        )
+        product_components = ProductComponent.objects.bulk_create(
+            (
+                ProductComponent(product=product, component=component, quantity=rng.randint(1, 3))
+                for i, product in enumerate(product_rows)
+                for component in rng.sample(product_rows[:i], min(components, i))
+            ),
+            batch_size=chunk_size
+        )
+        batches = ingest_warehouse_rows(
+            (
+                {
+                    'material_id': material.pk,
+                    'remainder': float(rng.randint(1, 500)),
+                    'price': Decimal(rng.randint(100, 10000))/100,
+                }
+                for material in material_rows
+                for _ in range(batches_per_material)
+            ),
+            chunk_size
+        )
+        # bulk_create does not send model signals
+        clear_bom_cache()
+        invalidate_lists(Product, Material, ProductMaterial, ProductComponent)
+
+    return {
+        'products': len(product_rows),
+        'materials': len(material_rows),
+        'product_materials': len(product_materials),
+        'product_components': len(product_components),
+        'batches': batches['created'],
+        'first_code': first_code,
+        'last_code': first_code+products-1,
+    }
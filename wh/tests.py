@@ -1,3 +1,1392 @@
-from django.test import TestCase
+import csv
+import json
+import tempfile
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from io import StringIO
+from time import monotonic, perf_counter
+from unittest import skipIf
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+
+from users.models import User, MANAGER
+from . import vectorized
+from .bom import BOMCycleError, explode
+from .bom_cache import BOMCache, bom_cache
+from .bom_snapshot import BOMSnapshot, BOMSnapshotStore, SnapshotBuilder, bom_snapshot, record_changes
+from .fast_serializers import ProductReadSerializer, MaterialReadSerializer,\
+    ProductMaterialReadSerializer, WarehouseReadSerializer
+from .metrics import LogLinearHistogram, RequestSample, current_sample, metrics
+from .models import Product, Material, ProductMaterial, ProductComponent, Warehouse, Reservation, RESERVED, COMMITTED, RELEASED,\
+    StockMovement, MaterialBalance, MaterialStockSummary, RECEIPT, ISSUE, ADJUSTMENT
+from .reservations import take_stock, StockConflict
+from .renderers import FastJSONRenderer
+from .serializers import ProductSerializer, MaterialSerializer, ProductMaterialSerializer, WarehouseSerializer
+
+
+class WarehouseAPITestCase(APITestCase):
+
+    def setUp(self):
+        # Test transactions are rolled back without signals, so start cold
+        bom_cache.clear()
+        bom_snapshot.clear()
+        cache.clear()
+
+    def create_catalogue(self, products=3, materials_per_product=2):
+        self.materials = [
+            Material.objects.create(material_name=f'Material {i}')
+            for i in range(materials_per_product)
+        ]
+        self.products = []
+        for code in range(1, products+1):
+            product = Product.objects.create(product_name=f'Product {code}', product_code=code)
+            for material in self.materials:
+                ProductMaterial.objects.create(product=product, material=material, quantity=2)
+            self.products.append(product)
+        for material in self.materials:
+            Warehouse.objects.create(material=material, remainder=10, price='1.50')
+            Warehouse.objects.create(material=material, remainder=5, price='2.00')
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        """Fail if the block runs more than ``budget`` queries."""
+        with CaptureQueriesContext(connection) as queries:
+            yield queries
+        executed = len(queries.captured_queries)
+        self.assertLessEqual(executed, budget, '\n'.join(
+            [f'{executed} queries executed, at most {budget} allowed:']+
+            [query['sql'] for query in queries.captured_queries]
+        ))
+
+    def login_manager(self):
+        user = User.objects.create(username='manager', role=MANAGER)
+        self.client.force_authenticate(user)
+        return user
+
+    def order(self, lines):
+        return {'products': [{'product_code': code, 'quantity': quantity} for code, quantity in lines]}
+
+
+class CheckAvailabilityAPITests(WarehouseAPITestCase):
+    url = '/wh/check-availability/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue()
+
+    def test_response_shape(self):
+        response = self.client.post(self.url, self.order([(1, 5), (999, 1)]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data'], [
+            {
+                'product_name': 'Product 1',
+                'materials': [
+                    {
+                        'material_name': material.material_name,
+                        'required_quantity': 10.0,
+                        'available_quantity': 15.0,
+                        'status': 'Enough',
+                        'shortage': None,
+                    }
+                    for material in self.materials
+                ],
+            },
+            {'input_code': 999, 'message': 'Unmatched product code.'},
+        ])
+
+    def test_shortage(self):
+        response = self.client.post(self.url, self.order([(2, 10)]), format='json')
+        material = response.data['data'][0]['materials'][0]
+        self.assertEqual(material['status'], 'Not enough')
+        self.assertEqual(material['shortage'], 5.0)
+
+    def test_product_without_materials(self):
+        Product.objects.create(product_name='Empty', product_code=50)
+        response = self.client.post(self.url, self.order([(50, 1)]), format='json')
+        self.assertEqual(response.data['data'], [{'product_name': 'Empty', 'materials': []}])
+
+    def test_query_count_does_not_grow_with_order_size(self):
+        with self.assertNumQueries(3):
+            self.client.post(self.url, self.order([(1, 1)]), format='json')
+        lines = [(code, quantity) for quantity in range(1, 70) for code in (1, 2, 3)]
+        with self.assertNumQueries(3):
+            response = self.client.post(self.url, self.order(lines), format='json')
+        self.assertEqual(len(response.data['data']), len(lines))
+
+
+class MaterialBatchTrackingAPITests(WarehouseAPITestCase):
+    url = '/wh/material-batch-tracking/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue()
+
+    def test_allocates_batches_fifo(self):
+        response = self.client.post(self.url, self.order([(1, 6)]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        material = response.data['data'][0]['materials'][0]
+        self.assertEqual(material['required_quantity'], 12.0)
+        self.assertEqual(material['available_quantity'], 15.0)
+        self.assertIsNone(material['missing_quantity'])
+        self.assertEqual(
+            [(batch['price'], batch['taken_quantity']) for batch in material['material_batches']],
+            [('1.50', 10.0), ('2.00', 2.0)]
+        )
+
+    def test_consumption_carries_over_between_products(self):
+        response = self.client.post(self.url, self.order([(1, 3), (2, 3), (3, 1)]), format='json')
+        first, second, third = (line['materials'][0] for line in response.data['data'])
+        self.assertEqual([batch['taken_quantity'] for batch in first['material_batches']], [6.0])
+        self.assertEqual([batch['taken_quantity'] for batch in second['material_batches']], [4.0, 2.0])
+        self.assertEqual(third['available_quantity'], 3.0)
+        self.assertEqual(third['missing_quantity'], None)
+        self.assertEqual([batch['available_quantity'] for batch in third['material_batches']], [3.0])
+
+    def test_missing_quantity(self):
+        response = self.client.post(self.url, self.order([(1, 10)]), format='json')
+        material = response.data['data'][0]['materials'][0]
+        self.assertEqual(material['missing_quantity'], 5.0)
+        self.assertEqual(sum(batch['taken_quantity'] for batch in material['material_batches']), 15.0)
+
+    def test_query_count_does_not_grow_with_order_size(self):
+        lines = [(code, 1) for code in (1, 2, 3)]*40
+        with self.assertNumQueries(3):
+            response = self.client.post(self.url, self.order(lines), format='json')
+        self.assertEqual(len(response.data['data']), len(lines))
+
+
+class RollupAPITests(WarehouseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue()
+
+    def rollup_order(self, lines):
+        return dict(self.order(lines), rollup=True)
+
+    def test_check_availability_rollup(self):
+        data = self.rollup_order([(1, 2), (2, 3), (3, 1), (404, 1)])
+        with self.assertNumQueries(3):
+            response = self.client.post('/wh/check-availability/', data, format='json')
+        result = response.data['data']
+        self.assertEqual(result['unmatched_product_codes'], [404])
+        self.assertEqual(len(result['materials']), len(self.materials))
+        material = result['materials'][0]
+        self.assertEqual(material['material_id'], self.materials[0].pk)
+        self.assertEqual(material['required_quantity'], 12.0)
+        self.assertEqual(material['available_quantity'], 15.0)
+        self.assertEqual(material['status'], 'Enough')
+
+    def test_batch_tracking_rollup(self):
+        response = self.client.post('/wh/material-batch-tracking/', self.rollup_order([(1, 5), (2, 4)]), format='json')
+        material = response.data['data']['materials'][0]
+        self.assertEqual(material['required_quantity'], 18.0)
+        self.assertEqual(material['missing_quantity'], 3.0)
+        self.assertEqual([batch['taken_quantity'] for batch in material['material_batches']], [10.0, 5.0])
+
+
+class WarehouseBulkCreateAPITests(WarehouseAPITestCase):
+    url = '/wh/warehouse/bulk-create/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue(products=1)
+        self.login_manager()
+
+    def rows(self, count):
+        return [
+            {'material_id': self.materials[i % 2].pk, 'remainder': i+1, 'price': '3.25'}
+            for i in range(count)
+        ]
+
+    def test_json_array(self):
+        # material lookup, batch insert, three journal and two stock summary statements, in a savepoint
+        with self.assertNumQueries(2+7):
+            response = self.client.post(self.url, self.rows(25), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['data'], {'rows': 25, 'created': 25, 'errors': []})
+        self.assertEqual(Warehouse.objects.count(), 4+25)
+
+    def test_chunks_are_validated_and_inserted_separately(self):
+        # One material lookup (ids are remembered between chunks), then a batch
+        # insert, three journal and two stock summary statements per chunk
+        with self.assertNumQueries(2+1+3*6):
+            response = self.client.post(f'{self.url}?chunk_size=10', self.rows(25), format='json')
+        self.assertEqual(response.data['data']['created'], 25)
+
+    def test_row_errors_do_not_abort_the_load(self):
+        rows = self.rows(3)
+        rows[0]['price'] = 'free'
+        rows[2]['material_id'] = 12345
+        response = self.client.post(self.url, rows, format='json')
+        result = response.data['data']
+        self.assertFalse(response.data['success'])
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([error['row'] for error in result['errors']], [1, 3])
+        self.assertIn('price', result['errors'][0]['errors'])
+        self.assertIn('material_id', result['errors'][1]['errors'])
+
+    def test_ndjson(self):
+        body = '\n'.join(json.dumps(row) for row in self.rows(5))
+        response = self.client.post(self.url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.data['data']['created'], 5)
+
+    def test_malformed_ndjson_lines_are_row_errors(self):
+        rows = [json.dumps(row) for row in self.rows(4)]
+        body = '\n'.join(rows[:2]+['', '{"material_id": 1,']+rows[2:])
+        response = self.client.post(f'{self.url}?chunk_size=2', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['data']['created'], 4)
+        self.assertEqual(response.data['data']['rows'], 5)
+        error = response.data['data']['errors'][0]
+        self.assertEqual(error['row'], 3)
+        self.assertTrue(error['errors']['non_field_errors'][0].startswith('NDJSON parse error on line 4'))
+
+    def test_csv(self):
+        material_id = self.materials[0].pk
+        body = f'material_id,remainder,price\n{material_id},4,1.10\n{material_id},x,1.10\n'
+        response = self.client.post(self.url, body, content_type='text/csv')
+        self.assertEqual(response.data['data']['created'], 1)
+        self.assertEqual(response.data['data']['errors'][0]['row'], 2)
+
+    def test_rejects_bodies_that_are_not_rows(self):
+        for body in [{'material_id': 1}, 5, None, 'rows']:
+            response = self.client.post(self.url, json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_requires_manager(self):
+        self.client.force_authenticate(User.objects.create(username='ordinary'))
+        response = self.client.post(self.url, self.rows(1), format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ProductMaterialBulkCreateAPITests(WarehouseAPITestCase):
+    url = '/wh/product-material/bulk-create/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue(products=2, materials_per_product=1)
+        self.extra = [Material.objects.create(material_name=f'Extra {i}') for i in range(3)]
+        self.login_manager()
+
+    def test_creates_rows_with_constant_queries(self):
+        rows = [
+            {'product_code': product.product_code, 'material_id': material.pk, 'quantity': 1.5}
+            for product in self.products for material in self.extra
+        ]
+        rows[0] = {'product_id': str(self.products[0].pk), 'material_id': self.extra[0].pk, 'quantity': 1.5}
+        # products, materials, existing pairs, then the insert and the lookup of
+        # parent assemblies to invalidate, wrapped in a savepoint
+        with self.assertNumQueries(3+4):
+            response = self.client.post(self.url, rows, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['data'], {'rows': 6, 'created': 6, 'updated': 0, 'errors': []})
+        self.assertEqual(ProductMaterial.objects.count(), 2+6)
+
+    def test_reports_existing_missing_and_duplicate_rows(self):
+        rows = [
+            {'product_code': 1, 'material_id': self.materials[0].pk, 'quantity': 3},
+            {'product_code': 404, 'material_id': self.extra[0].pk, 'quantity': 3},
+            {'product_code': 1, 'material_id': 404, 'quantity': 3},
+            {'product_code': 1, 'material_id': self.extra[0].pk, 'quantity': 3},
+            {'product_code': 1, 'material_id': self.extra[0].pk, 'quantity': 4},
+            {'material_id': self.extra[1].pk, 'quantity': 4},
+        ]
+        response = self.client.post(self.url, rows, format='json')
+        result = response.data['data']
+        self.assertEqual(result['created'], 1)
+        self.assertEqual([error['row'] for error in result['errors']], [1, 2, 3, 5, 6])
+        self.assertEqual(ProductMaterial.objects.get(product__product_code=1, material=self.materials[0]).quantity, 2)
+
+    def test_upsert_updates_quantities(self):
+        rows = [
+            {'product_code': 1, 'material_id': self.materials[0].pk, 'quantity': 7},
+            {'product_code': 2, 'material_id': self.extra[0].pk, 'quantity': 1},
+        ]
+        response = self.client.post(f'{self.url}?upsert=true', rows, format='json')
+        self.assertEqual(response.data['data']['created'], 1)
+        self.assertEqual(response.data['data']['updated'], 1)
+        self.assertEqual(ProductMaterial.objects.get(product__product_code=1, material=self.materials[0]).quantity, 7)
+
+    def test_rejects_bodies_that_are_not_rows(self):
+        for body in [{'product_code': 1}, 5, None, 'rows']:
+            response = self.client.post(self.url, json.dumps(body), content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unique_constraint(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ProductMaterial.objects.create(product=self.products[0], material=self.materials[0], quantity=1)
+
+    def test_import_bom_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('product_code,material_id,quantity\n')
+            file.write(f'1,{self.extra[0].pk},2\n2,{self.extra[1].pk},3\n')
+        out = StringIO()
+        call_command('import_bom', file.name, stdout=out)
+        self.assertIn('2 created, 0 updated, 0 rejected of 2 rows', out.getvalue())
+
+
+class BOMCacheTests(WarehouseAPITestCase):
+    url = '/wh/check-availability/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue()
+
+    def test_repeat_requests_only_query_stock(self):
+        before = bom_cache.stats()
+        self.client.post(self.url, self.order([(1, 1), (2, 1)]), format='json')
+        with self.assertNumQueries(1):
+            self.client.post(self.url, self.order([(1, 1), (2, 1)]), format='json')
+        after = bom_cache.stats()
+        self.assertEqual(after['hits']-before['hits'], 2)
+        self.assertEqual(after['misses']-before['misses'], 2)
+
+    def test_bom_change_invalidates_product(self):
+        self.client.post(self.url, self.order([(1, 1), (2, 1)]), format='json')
+        extra = Material.objects.create(material_name='Extra')
+        ProductMaterial.objects.create(product=self.products[0], material=extra, quantity=1)
+        response = self.client.post(self.url, self.order([(1, 1)]), format='json')
+        self.assertEqual(len(response.data['data'][0]['materials']), 3)
+        self.assertEqual(bom_cache.get_many([2])[1], set())
+
+    def test_material_rename_invalidates_everything(self):
+        self.client.post(self.url, self.order([(1, 1)]), format='json')
+        self.materials[0].material_name = 'Renamed'
+        self.materials[0].save()
+        response = self.client.post(self.url, self.order([(1, 1)]), format='json')
+        self.assertEqual(response.data['data'][0]['materials'][0]['material_name'], 'Renamed')
+
+    def test_product_code_change(self):
+        self.client.post(self.url, self.order([(1, 1)]), format='json')
+        self.products[0].product_code = 100
+        self.products[0].save()
+        response = self.client.post(self.url, self.order([(1, 1)]), format='json')
+        self.assertEqual(response.data['data'][0]['message'], 'Unmatched product code.')
+
+    def test_lru_eviction(self):
+        cache = BOMCache(max_size=2)
+        cache.set_many({1: ('a', 'A', ()), 2: ('b', 'B', ())}, cache.version)
+        cache.get_many([1])
+        cache.set_many({3: ('c', 'C', ())}, cache.version)
+        self.assertEqual(cache.get_many([1, 2, 3])[1], {2})
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_stale_load_is_not_stored(self):
+        cache = BOMCache(max_size=2)
+        version = cache.version
+        cache.invalidate_products(['a'])
+        cache.set_many({1: ('a', 'A', ())}, version)
+        self.assertEqual(cache.get_many([1])[1], {1})
+
+    def test_changes_of_other_processes_invalidate(self):
+        self.client.post(self.url, self.order([(1, 1), (2, 1)]), format='json')
+        # What another worker's BOM edit leaves in the shared cache
+        record_changes([self.products[0].pk])
+        self.assertEqual(bom_cache.get_many([1, 2])[1], {1})
+        record_changes(None)
+        self.assertEqual(bom_cache.get_many([1, 2])[1], {1, 2})
+
+    def test_entries_expire(self):
+        cache = BOMCache(max_size=2, ttl=30)
+        cache.set_many({1: ('a', 'A', ())}, cache.version)
+        self.assertEqual(cache.get_many([1])[1], set())
+        with patch('wh.bom_cache.monotonic', return_value=monotonic()+31):
+            self.assertEqual(cache.get_many([1])[1], {1})
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_stats_endpoint(self):
+        self.login_manager()
+        response = self.client.get('/wh/bom-cache/stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hit_rate', response.data['data'])
+
+
+class ListCacheTests(WarehouseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue()
+        self.login_manager()
+
+    def test_repeat_reads_do_not_touch_the_database(self):
+        for url in ['/wh/products/', '/wh/materials/', '/wh/product-materials/', '/wh/warehouses/']:
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.data, second.data)
+
+    def test_query_params_are_part_of_the_key(self):
+        self.client.get('/wh/products/')
+        with self.assertNumQueries(1):
+            self.client.get('/wh/products/?page_size=2')
+
+    def test_writes_invalidate_dependent_lists(self):
+        self.client.get('/wh/warehouses/')
+        self.client.get('/wh/product-materials/')
+        self.materials[0].material_name = 'Renamed'
+        self.materials[0].save()
+        response = self.client.get('/wh/warehouses/')
+        self.assertEqual(response.data['data']['results'][0]['material']['material_name'], 'Renamed')
+        response = self.client.get('/wh/product-materials/')
+        self.assertEqual(response.data['results'][0]['material']['material_name'], 'Renamed')
+
+    def test_bulk_ingest_invalidates_warehouse_list(self):
+        self.client.get('/wh/warehouses/')
+        rows = [{'material_id': self.materials[0].pk, 'remainder': 1, 'price': '1.00'}]
+        self.client.post('/wh/warehouse/bulk-create/', rows, format='json')
+        response = self.client.get('/wh/warehouses/')
+        self.assertEqual(len(response.data['data']['results']), 5)
+
+
+class KeysetPaginationTests(WarehouseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue(products=7)
+        self.login_manager()
+
+    def walk(self, url):
+        ids = []
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            data = response.data.get('data', response.data)
+            ids.extend(row['id'] for row in data['results'])
+            url = data['next']
+            pages += 1
+        return ids, pages
+
+    def test_walks_every_list_in_stable_order(self):
+        for url, model in [
+            ('/wh/products/?page_size=3', Product),
+            ('/wh/materials/?page_size=1', Material),
+            ('/wh/product-materials/?page_size=4', ProductMaterial),
+            ('/wh/warehouses/?page_size=3', Warehouse),
+        ]:
+            ids, pages = self.walk(url)
+            expected = model.objects.order_by('id').values_list('id', flat=True)
+            self.assertEqual([str(pk) for pk in ids], [str(pk) for pk in expected])
+            self.assertGreater(pages, 1)
+
+    def test_max_page_size(self):
+        with self.settings(WH_MAX_PAGE_SIZE=5):
+            response = self.client.get('/wh/products/?page_size=100000')
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_deep_pages_do_not_use_offset(self):
+        response = self.client.get('/wh/product-materials/?page_size=2')
+        for _ in range(3):
+            response = self.client.get(response.data['next'])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(response.data['next'])
+        self.assertTrue(queries.captured_queries)
+        for query in queries.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'])
+
+
+class ListQueryBudgetTests(WarehouseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue(products=20, materials_per_product=3)
+        self.login_manager()
+
+    def test_nested_lists_use_constant_queries_per_page(self):
+        for url in ['/wh/product-materials/', '/wh/warehouses/', '/wh/products/', '/wh/materials/']:
+            cache.clear()
+            with self.assertMaxQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_detail_views_join_related_rows(self):
+        product_material = ProductMaterial.objects.first()
+        warehouse = Warehouse.objects.first()
+        with self.assertMaxQueries(1):
+            response = self.client.get(f'/wh/product-material/detail-update-delete/{product_material.pk}/')
+        self.assertEqual(response.data['product']['product_code'], product_material.product.product_code)
+        with self.assertMaxQueries(1):
+            response = self.client.get(f'/wh/warehouse/detail-update-delete/{warehouse.pk}/')
+        self.assertEqual(response.data['material']['material_name'], warehouse.material.material_name)
+
+
+class FastSerializerTests(WarehouseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue()
+        Warehouse.objects.create(material=self.materials[0], remainder=0.25, price='1234567890.05')
+
+    def test_output_matches_model_serializers(self):
+        for serializer_class, read_serializer, queryset in [
+            (ProductSerializer, ProductReadSerializer, Product.objects.order_by('id')),
+            (MaterialSerializer, MaterialReadSerializer, Material.objects.order_by('id')),
+            (ProductMaterialSerializer, ProductMaterialReadSerializer, ProductMaterial.objects.order_by('id')),
+            (WarehouseSerializer, WarehouseReadSerializer, Warehouse.objects.order_by('id')),
+        ]:
+            expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+            actual = JSONRenderer().render(read_serializer.many(read_serializer.values(queryset)))
+            self.assertEqual(json.loads(actual), json.loads(expected))
+
+    def test_renderer_matches_json_renderer(self):
+        data = {
+            'price': Decimal('1.50'),
+            'id': self.products[0].pk,
+            'created': timezone.now(),
+            'text': 'line\u2028separator',
+            1: [None, True, 2.5],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class WarehouseExportAPITests(WarehouseAPITestCase):
+    url = '/wh/warehouse/export/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue(products=1)
+        Warehouse.objects.create(material=self.materials[1], remainder=0, price='9.99')
+        self.login_manager()
+
+    def content(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0], {
+            'id': rows[0]['id'],
+            'material_id': self.materials[0].pk,
+            'material_name': self.materials[0].material_name,
+            'remainder': 10.0,
+            'price': '1.50',
+        })
+
+    def test_csv_with_filters(self):
+        with self.settings(WH_EXPORT_CHUNK_SIZE=1):
+            response = self.client.get(f'{self.url}?output=csv&material={self.materials[1].pk}&in_stock=true')
+        rows = list(csv.DictReader(self.content(response).splitlines()))
+        self.assertEqual([row['price'] for row in rows], ['1.50', '2.00'])
+        self.assertEqual({row['material_name'] for row in rows}, {self.materials[1].material_name})
+
+    def test_invalid_output(self):
+        response = self.client.get(f'{self.url}?output=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReservationAPITests(WarehouseAPITestCase):
+    url = '/wh/reservation/create/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue(products=2)
+        self.login_manager()
+
+    def remainders(self):
+        return list(Warehouse.objects.order_by('id').values_list('remainder', flat=True))
+
+    def test_reserve_takes_stock_fifo(self):
+        with self.assertMaxQueries(12):
+            response = self.client.post(self.url, self.order([(1, 3), (2, 3)]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.remainders(), [0.0, 3.0, 0.0, 3.0])
+        reservation = Reservation.objects.get(pk=response.data['data']['id'])
+        self.assertEqual(reservation.status, RESERVED)
+        self.assertEqual(sorted(reservation.lines.values_list('quantity', flat=True)), [2.0, 2.0, 10.0, 10.0])
+
+    def test_shortage_reserves_nothing(self):
+        response = self.client.post(self.url, self.order([(1, 8)]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['shortages'][0]['shortage'], 1.0)
+        self.assertEqual(self.remainders(), [10.0, 5.0, 10.0, 5.0])
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_unknown_product(self):
+        response = self.client.post(self.url, self.order([(404, 1)]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_release_returns_stock(self):
+        reservation_id = self.client.post(self.url, self.order([(1, 6)]), format='json').data['data']['id']
+        response = self.client.post(f'/wh/reservation/{reservation_id}/release/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.remainders(), [10.0, 5.0, 10.0, 5.0])
+        self.assertEqual(Reservation.objects.get(pk=reservation_id).status, RELEASED)
+        response = self.client.post(f'/wh/reservation/{reservation_id}/release/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.remainders(), [10.0, 5.0, 10.0, 5.0])
+
+    def test_commit(self):
+        reservation_id = self.client.post(self.url, self.order([(1, 1)]), format='json').data['data']['id']
+        response = self.client.post(f'/wh/reservation/{reservation_id}/commit/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Reservation.objects.get(pk=reservation_id).status, COMMITTED)
+        self.assertEqual(self.remainders(), [8.0, 5.0, 8.0, 5.0])
+        response = self.client.get(f'/wh/reservation/detail/{reservation_id}/')
+        self.assertEqual(len(response.data['lines']), 2)
+
+    def test_unknown_reservation(self):
+        response = self.client.post('/wh/reservation/00000000-0000-0000-0000-000000000000/commit/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_conditional_update_refuses_oversell(self):
+        batch = Warehouse.objects.order_by('id').first()
+        with self.assertRaises(StockConflict), transaction.atomic():
+            take_stock({(batch.pk, batch.material_id): 11})
+        self.assertEqual(self.remainders()[0], 10.0)
+
+
+class StockJournalTests(WarehouseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue(products=1)
+        self.login_manager()
+
+    def balance(self, material):
+        return MaterialBalance.objects.get(material=material).quantity
+
+    def test_batches_are_journaled_as_receipts(self):
+        self.assertEqual(self.balance(self.materials[0]), 15.0)
+        self.assertEqual(
+            list(StockMovement.objects.filter(material=self.materials[0]).values_list('kind', 'quantity')),
+            [(RECEIPT, 10.0), (RECEIPT, 5.0)]
+        )
+
+    def test_updates_are_journaled_as_adjustments(self):
+        batch = Warehouse.objects.filter(material=self.materials[0]).first()
+        response = self.client.put(f'/wh/warehouse/detail-update-delete/{batch.pk}/', {
+            'material_id': self.materials[1].pk, 'remainder': 4, 'price': '1.50'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.balance(self.materials[0]), 5.0)
+        self.assertEqual(self.balance(self.materials[1]), 19.0)
+        batch = Warehouse.objects.get(pk=batch.pk)
+        batch.remainder = 1
+        batch.save()
+        self.assertEqual(self.balance(self.materials[1]), 16.0)
+        self.assertEqual(StockMovement.objects.filter(kind=ADJUSTMENT).count(), 3)
+
+    def test_reservations_issue_and_return_stock(self):
+        response = self.client.post('/wh/reservation/create/', self.order([(1, 2)]), format='json')
+        self.assertEqual(self.balance(self.materials[0]), 11.0)
+        self.assertEqual(StockMovement.objects.filter(kind=ISSUE).count(), 2)
+        self.client.post(f"/wh/reservation/{response.data['data']['id']}/release/")
+        self.assertEqual(self.balance(self.materials[0]), 15.0)
+
+    def test_availability_reads_balances(self):
+        with self.assertNumQueries(3):
+            response = self.client.post('/wh/check-availability/', self.order([(1, 1)]), format='json')
+        self.assertEqual(response.data['data'][0]['materials'][0]['available_quantity'], 15.0)
+        MaterialBalance.objects.filter(material=self.materials[0]).update(quantity=1)
+        response = self.client.post('/wh/check-availability/', self.order([(1, 1)]), format='json')
+        self.assertEqual(response.data['data'][0]['materials'][0]['available_quantity'], 1.0)
+
+    def test_deleted_batches_are_journaled_as_adjustments(self):
+        batch = Warehouse.objects.filter(material=self.materials[0]).first()
+        response = self.client.delete(f'/wh/warehouse/detail-update-delete/{batch.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.balance(self.materials[0]), 5.0)
+        self.assertEqual(StockMovement.objects.get(kind=ADJUSTMENT).quantity, -10.0)
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+        # Deleting the material takes its batches, journal and balance along
+        self.materials[0].delete()
+        self.assertFalse(StockMovement.objects.filter(material_id=self.materials[0].pk).exists())
+        connection.check_constraints()
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+    def test_reserved_batches_cannot_be_deleted(self):
+        self.client.post('/wh/reservation/create/', self.order([(1, 2)]), format='json')
+        batch = Warehouse.objects.filter(material=self.materials[0]).first()
+        response = self.client.delete(f'/wh/warehouse/detail-update-delete/{batch.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(response.data['success'])
+        self.assertTrue(Warehouse.objects.filter(pk=batch.pk).exists())
+        self.assertEqual(self.balance(self.materials[0]), 11.0)
+
+    def test_rebuild_and_verify(self):
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+        MaterialBalance.objects.filter(material=self.materials[0]).update(quantity=99)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', '--verify', stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_balances', stdout=StringIO())
+        self.assertEqual(self.balance(self.materials[0]), 15.0)
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+
+class StockSummaryTests(WarehouseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue(products=1)
+        self.login_manager()
+
+    def summary(self, material):
+        summary = MaterialStockSummary.objects.select_related('material__balance').get(material=material)
+        return (summary.total_remainder, summary.batch_count, summary.stock_value, summary.min_price, summary.max_price)
+
+    def assertSummariesVerify(self):
+        call_command('rebuild_stock_summaries', '--verify', stdout=StringIO())
+
+    def test_new_batches_are_summarized(self):
+        self.assertEqual(self.summary(self.materials[0]), (15.0, 2, 25.0, Decimal('1.50'), Decimal('2.00')))
+        summary = MaterialStockSummary.objects.get(material=self.materials[0])
+        self.assertAlmostEqual(summary.weighted_average_price, 25/15)
+
+    def test_updates_move_sums_and_refresh_price_bounds(self):
+        batch = Warehouse.objects.filter(material=self.materials[0], price='2.00').get()
+        batch.price = '1.00'
+        batch.remainder = 1
+        batch.save()
+        self.assertEqual(self.summary(self.materials[0]), (11.0, 2, 16.0, Decimal('1.00'), Decimal('1.50')))
+        response = self.client.put(f'/wh/warehouse/detail-update-delete/{batch.pk}/', {
+            'material_id': self.materials[1].pk, 'remainder': 4, 'price': '3.00'
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.summary(self.materials[0]), (10.0, 1, 15.0, Decimal('1.50'), Decimal('1.50')))
+        self.assertEqual(self.summary(self.materials[1]), (19.0, 3, 37.0, Decimal('1.50'), Decimal('3.00')))
+        self.assertSummariesVerify()
+
+    def test_stale_instances_apply_deltas_to_the_stored_stock(self):
+        batch = Warehouse.objects.filter(material=self.materials[0], price='2.00').get()
+        stale = Warehouse.objects.get(pk=batch.pk)
+        batch.remainder = 1
+        batch.save()
+        stale.remainder = 2
+        stale.save()
+        self.assertEqual(self.summary(self.materials[0])[0], 12.0)
+        self.assertSummariesVerify()
+        call_command('rebuild_balances', '--verify', stdout=StringIO())
+
+    def test_failed_receivers_roll_the_batch_back(self):
+        batch = Warehouse.objects.filter(material=self.materials[0], price='2.00').get()
+        batch.remainder = 1
+        with patch('wh.signals.update_batch_summary', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            batch.save()
+        self.assertEqual(Warehouse.objects.get(pk=batch.pk).remainder, 5.0)
+        self.assertFalse(StockMovement.objects.filter(kind=ADJUSTMENT).exists())
+        self.assertSummariesVerify()
+
+    def test_delete_endpoint(self):
+        batch = Warehouse.objects.filter(material=self.materials[0], price='2.00').get()
+        response = self.client.delete(f'/wh/warehouse/detail-update-delete/{batch.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(Warehouse.objects.filter(pk=batch.pk).exists())
+        self.assertEqual(self.summary(self.materials[0])[:2], (10.0, 1))
+        self.assertSummariesVerify()
+
+    def test_deletes_shrink_the_summary(self):
+        for batch in Warehouse.objects.filter(material=self.materials[0]).order_by('id'):
+            batch.delete()
+            self.assertSummariesVerify()
+        self.assertEqual(self.summary(self.materials[0]), (0.0, 0, 0.0, None, None))
+        material_id = self.materials[1].pk
+        self.materials[1].delete()
+        self.assertFalse(MaterialStockSummary.objects.filter(material_id=material_id).exists())
+
+    def test_bulk_ingest_and_reservations_keep_summaries(self):
+        rows = [{'material_id': self.materials[0].pk, 'remainder': 2, 'price': '0.75'}]*3
+        self.client.post('/wh/warehouse/bulk-create/', rows, format='json')
+        self.assertEqual(self.summary(self.materials[0]), (21.0, 5, 29.5, Decimal('0.75'), Decimal('2.00')))
+        response = self.client.post('/wh/reservation/create/', self.order([(1, 6)]), format='json')
+        self.assertEqual(self.summary(self.materials[0])[:2], (9.0, 5))
+        self.assertSummariesVerify()
+        self.client.post(f"/wh/reservation/{response.data['data']['id']}/release/")
+        self.assertEqual(self.summary(self.materials[0])[:2], (21.0, 5))
+        self.assertSummariesVerify()
+
+    def test_rebuild_and_verify(self):
+        MaterialStockSummary.objects.filter(material=self.materials[0]).update(batch_count=7, max_price='9.00')
+        with self.assertRaises(CommandError):
+            call_command('rebuild_stock_summaries', '--verify', stdout=StringIO(), stderr=StringIO())
+        call_command('rebuild_stock_summaries', stdout=StringIO())
+        self.assertEqual(self.summary(self.materials[0]), (15.0, 2, 25.0, Decimal('1.50'), Decimal('2.00')))
+        self.assertSummariesVerify()
+
+
+class MultiLevelBOMTests(WarehouseAPITestCase):
+    url = '/wh/check-availability/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue(products=2)
+        self.login_manager()
+        # Assembly 10 = 1 x Material 0 + 2 x Product 1 + 1 x Product 2,
+        # Product 20 = 3 x Assembly 10 + 1 x Product 1
+        self.assembly = Product.objects.create(product_name='Assembly', product_code=10)
+        ProductMaterial.objects.create(product=self.assembly, material=self.materials[0], quantity=1)
+        ProductComponent.objects.create(product=self.assembly, component=self.products[0], quantity=2)
+        ProductComponent.objects.create(product=self.assembly, component=self.products[1], quantity=1)
+        self.top = Product.objects.create(product_name='Top', product_code=20)
+        ProductComponent.objects.create(product=self.top, component=self.assembly, quantity=3)
+        ProductComponent.objects.create(product=self.top, component=self.products[0], quantity=1)
+
+    def required(self, product_code, quantity=1):
+        response = self.client.post(self.url, self.order([(product_code, quantity)]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [material['required_quantity'] for material in response.data['data'][0]['materials']]
+
+    def test_sub_assemblies_are_flattened(self):
+        self.assertEqual(self.required(10), [7.0, 6.0])
+        self.assertEqual(self.required(20, 2), [46.0, 40.0])
+        self.assertEqual(self.required(1), [2.0, 2.0])
+
+    def test_shared_sub_assemblies_are_expanded_once(self):
+        # Every level uses both products of the next one: 2**40 paths, 80 expansions
+        components = {}
+        materials = {'leaf': [(1, 'Material', 1.0)]}
+        below = ['leaf', 'leaf']
+        for level in range(40):
+            level_ids = [f'{level}a', f'{level}b']
+            for product_id in level_ids:
+                components[product_id] = [(below[0], 1.0), (below[1], 1.0)] if below[0] != below[1] else [('leaf', 2.0)]
+            below = level_ids
+        self.assertEqual(explode(['39a'], components, materials), {'39a': ((1, 'Material', 2.0**40),)})
+
+    def test_cycles_are_rejected_on_create(self):
+        response = self.client.post('/wh/product-component/create/', {
+            'product_id': str(self.products[0].pk), 'component_id': str(self.top.pk), 'quantity': 1
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/wh/product-component/create/', {
+            'product_id': str(self.top.pk), 'component_id': str(self.top.pk), 'quantity': 1
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ProductComponent.objects.count(), 4)
+
+    def test_stored_cycles_are_reported(self):
+        ProductComponent.objects.bulk_create([ProductComponent(product=self.products[1], component=self.top, quantity=1)])
+        # The availability views report serializer errors in the response body
+        response = self.client.post(self.url, self.order([(20, 1)]), format='json')
+        self.assertEqual(response.data['message'], ['Bill of materials contains a cycle.'])
+        self.assertEqual(len(response.data['product_ids']), 4)
+        response = self.client.post('/wh/reservation/create/', self.order([(20, 1)]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with self.assertRaises(BOMCycleError):
+            explode(['a'], {'a': [('b', 1)], 'b': [('a', 1)]}, {})
+
+    def test_sub_assembly_changes_invalidate_parents(self):
+        self.assertEqual(self.required(20), [23.0, 20.0])
+        ProductMaterial.objects.filter(product=self.products[1], material=self.materials[1]).update(quantity=1)
+        ProductMaterial.objects.create(product=self.products[1], material=Material.objects.create(material_name='New'), quantity=1)
+        self.assertEqual(self.required(20), [23.0, 17.0, 3.0])
+        self.client.post('/wh/product-component/create/', {
+            'product_id': str(self.top.pk), 'component_id': str(self.products[1].pk), 'quantity': 1
+        }, format='json')
+        self.assertEqual(self.required(20), [25.0, 18.0, 4.0])
+
+    def test_crud_and_list(self):
+        response = self.client.get('/wh/product-components/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['product']['product_code'], row['component']['product_code'], row['quantity']) for row in response.data['results']],
+            [(10, 1, 2.0), (10, 2, 1.0), (20, 10, 3.0), (20, 1, 1.0)]
+        )
+        component = ProductComponent.objects.get(product=self.top, component=self.assembly)
+        url = f'/wh/product-component/detail-update-delete/{component.pk}/'
+        response = self.client.patch(url, {'quantity': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.required(20), [9.0, 8.0])
+        self.client.delete(url)
+        self.assertEqual(self.required(20), [2.0, 2.0])
+
+
+class MaxBuildableAPITests(WarehouseAPITestCase):
+    url = '/wh/max-buildable/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue()
+
+    def solve(self, lines, mode=None):
+        data = {'products': [
+            {'product_code': code} if quantity is None else {'product_code': code, 'quantity': quantity}
+            for code, quantity in lines
+        ]}
+        if mode:
+            data['mode'] = mode
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['data']
+
+    def test_independent(self):
+        with self.assertNumQueries(3):
+            data = self.solve([(1, None), (2, None), (404, None)])
+        self.assertEqual([product['max_quantity'] for product in data['products']], [7, 7])
+        self.assertEqual(data['unmatched_product_codes'], [404])
+        self.assertEqual(data['products'][0]['bottlenecks'], [
+            {'material_id': material.pk, 'material_name': material.material_name,
+             'required_per_unit': 2.0, 'available_quantity': 15.0}
+            for material in self.materials
+        ])
+
+    def test_answer_is_the_largest_quantity_check_availability_accepts(self):
+        for quantity, status_name in [(7, 'Enough'), (8, 'Not enough')]:
+            response = self.client.post('/wh/check-availability/', self.order([(1, quantity)]), format='json')
+            self.assertEqual(response.data['data'][0]['materials'][0]['status'], status_name)
+
+    def test_kit(self):
+        data = self.solve([(1, None), (2, 2)], mode='kit')
+        self.assertEqual(data['kits'], 2)
+        self.assertEqual([(product['ratio'], product['quantity']) for product in data['products']], [(1, 2), (2, 4)])
+        self.assertEqual(data['bottlenecks'][0]['required_per_unit'], 6.0)
+
+    def test_priority(self):
+        data = self.solve([(1, 5), (2, None), (3, None)], mode='priority')
+        self.assertEqual([product['max_quantity'] for product in data['products']], [5, 2, 0])
+        self.assertEqual(data['products'][0]['bottlenecks'], [])
+        self.assertEqual(data['products'][1]['bottlenecks'][0]['available_quantity'], 5.0)
+
+    def test_product_without_materials_is_unbounded(self):
+        Product.objects.create(product_name='Empty', product_code=50)
+        data = self.solve([(50, None)])
+        self.assertEqual(data['products'][0]['max_quantity'], None)
+
+
+@skipIf(vectorized.np is None, 'numpy is not installed')
+class VectorizedAvailabilityTests(WarehouseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue(products=3, materials_per_product=3)
+        # A material nobody stocks, a product without materials and a sub-assembly
+        ProductMaterial.objects.create(product=self.products[2], material=Material.objects.create(material_name='Unstocked'), quantity=0.1)
+        Product.objects.create(product_name='Empty', product_code=40)
+        ProductComponent.objects.create(product=self.products[1], component=self.products[0], quantity=1.5)
+
+    def check(self, url, data):
+        responses = []
+        for min_lines in (10**9, 1):
+            with override_settings(WH_VECTORIZE_MIN_LINES=min_lines):
+                responses.append(self.client.post(url, data, format='json').content)
+        self.assertEqual(responses[0], responses[1])
+        return json.loads(responses[1])['data']
+
+    def test_output_matches_the_python_path(self):
+        lines = [((i*7) % 5+1 if i % 11 else 404, i % 4+1) for i in range(300)]+[(40, 2)]
+        for rollup in (False, True):
+            data = self.check('/wh/check-availability/', {**self.order(lines), 'rollup': rollup})
+            self.assertTrue(data)
+        data = self.check('/wh/check-availability/', self.order([(3, 1000), (40, 1)]))
+        self.assertEqual(data[0]['materials'][3]['available_quantity'], 0)
+        self.assertEqual(data[0]['materials'][0]['status'], 'Not enough')
+
+    def test_empty_and_unmatched_orders(self):
+        self.assertEqual(self.check('/wh/check-availability/', self.order([(404, 1)])), [
+            {'input_code': 404, 'message': 'Unmatched product code.'}
+        ])
+        self.assertEqual(self.check('/wh/check-availability/', {**self.order([(40, 1)]), 'rollup': True}), {
+            'materials': [], 'unmatched_product_codes': []
+        })
+
+
+@override_settings(WH_BOM_SNAPSHOT=True)
+class BOMSnapshotTests(WarehouseAPITestCase):
+    url = '/wh/check-availability/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue()
+        self.assembly = Product.objects.create(product_name='Assembly', product_code=10)
+        ProductComponent.objects.create(product=self.assembly, component=self.products[0], quantity=3)
+
+    def required(self, lines):
+        response = self.client.post(self.url, self.order(lines), format='json')
+        return [
+            [material['required_quantity'] for material in product['materials']]
+            for product in response.data['data']
+        ]
+
+    def rebuilds(self, store=bom_snapshot):
+        stats = store.stats()
+        return stats['full_rebuilds'], stats['incremental_rebuilds']
+
+    def test_matches_the_database(self):
+        lines = [(1, 2), (10, 1), (2, 1)]
+        data = self.client.post(self.url, self.order(lines+[(404, 1)]), format='json').content
+        with override_settings(WH_BOM_SNAPSHOT=False):
+            self.assertEqual(self.client.post(self.url, self.order(lines+[(404, 1)]), format='json').content, data)
+        self.assertEqual(self.required([(10, 1)]), [[6.0, 6.0]])
+
+    def test_built_once_then_only_stock_is_queried(self):
+        full, incremental = self.rebuilds()
+        # Products, components and materials of the whole catalogue, then stock
+        with self.assertNumQueries(3+1):
+            self.client.post(self.url, self.order([(1, 1)]), format='json')
+        with self.assertNumQueries(1):
+            self.client.post(self.url, self.order([(2, 1), (10, 1)]), format='json')
+        self.assertEqual(self.rebuilds(), (full+1, incremental))
+
+    def test_changes_rebuild_only_changed_products(self):
+        self.required([(1, 1)])
+        full, incremental = self.rebuilds()
+        ProductMaterial.objects.filter(product=self.products[0], material=self.materials[0]).delete()
+        # The changed product and the assembly using it, then stock
+        with self.assertNumQueries(3):
+            self.assertEqual(self.required([(1, 1), (10, 1), (2, 1)]), [[2.0], [6.0], [2.0, 2.0]])
+        self.assertEqual(self.rebuilds(), (full, incremental+1))
+        self.assertEqual(bom_snapshot.stats()['products'], 4)
+
+        Product.objects.filter(pk=self.products[2].pk).delete()
+        Product.objects.create(product_name='New', product_code=3)
+        self.assertEqual(self.required([(3, 1)]), [[]])
+        self.assertEqual(self.rebuilds(), (full, incremental+2))
+
+    def test_material_changes_rebuild_everything(self):
+        self.required([(1, 1)])
+        full, incremental = self.rebuilds()
+        self.materials[0].material_name = 'Renamed'
+        self.materials[0].save()
+        response = self.client.post(self.url, self.order([(1, 1)]), format='json')
+        self.assertEqual(response.data['data'][0]['materials'][0]['material_name'], 'Renamed')
+        self.assertEqual(self.rebuilds(), (full+1, incremental))
+
+    def test_workers_share_a_mapped_file(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(WH_BOM_SNAPSHOT_PATH=f'{directory}/bom.snapshot'):
+            expected = self.required([(1, 1), (10, 2)])
+            worker = BOMSnapshotStore()
+            with self.assertNumQueries(0):
+                snapshot = worker.get()
+            self.assertEqual(worker.stats()['mapped'], 1)
+            self.assertIsNotNone(snapshot.mapping)
+            self.assertEqual(snapshot.lookup([1, 10, 404]), bom_snapshot.get().lookup([1, 10, 404]))
+            self.assertEqual(expected, [[2.0, 2.0], [12.0, 12.0]])
+            # The worker applies later changes to the mapped snapshot incrementally
+            ProductComponent.objects.create(product=self.products[1], component=self.products[2], quantity=1)
+            self.assertEqual(worker.get().lookup([2])[2][1][0][2], 4.0)
+            self.assertEqual(self.rebuilds(worker), (0, 1))
+
+    def test_file_round_trip(self):
+        builder = SnapshotBuilder()
+        products = [(uuid.uuid4(), 7, 'Gear ⚙', ((3, 'Steel', 1.5), (4, 'Oil', 0.25))), (uuid.uuid4(), 2, 'Empty', ())]
+        for product in products:
+            builder.add(*product)
+        snapshot = builder.build(42)
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot.write(f'{directory}/bom.snapshot')
+            mapped = BOMSnapshot.open(f'{directory}/bom.snapshot')
+            self.assertEqual(mapped.version, 42)
+            self.assertEqual(mapped.lookup([7, 2, 5]), {7: ('Gear ⚙', products[0][3]), 2: ('Empty', ())})
+            self.assertEqual([mapped.product_id(row) for row in range(2)], [product[0] for product in products])
+            self.assertIsNone(BOMSnapshot.open(f'{directory}/missing'))
+
+
+class AsyncViewTests(WarehouseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue(products=5)
+        # Product 3 also holds a sub-assembly with a material of its own
+        part = Material.objects.create(material_name='Part')
+        Warehouse.objects.create(material=part, remainder=3, price='4.00')
+        assembly = Product.objects.create(product_name='Assembly', product_code=10)
+        ProductMaterial.objects.create(product=assembly, material=part, quantity=1)
+        ProductComponent.objects.create(product=self.products[2], component=assembly, quantity=2)
+        self.user = self.login_manager()
+        self.headers = {'Authorization': f"Bearer {self.user.token()['access']}"}
+
+    def async_get(self, url, **kwargs):
+        return async_to_sync(self.async_client.get)(url, **kwargs)
+
+    def async_post(self, url, data):
+        return async_to_sync(self.async_client.post)(url, data, content_type='application/json')
+
+    def test_order_endpoints_match_sync_views(self):
+        bodies = [
+            self.order([(1, 5), (3, 2), (999, 1), (1, 1)]),
+            {**self.order([(1, 5), (3, 2), (999, 1)]), 'rollup': True},
+            {'products': [{'product_code': 'x'}]},
+        ]
+        for path in ['check-availability/', 'material-batch-tracking/']:
+            for body in bodies:
+                bom_cache.clear()
+                # Cold, then warm BOM cache
+                cold = self.async_post(f'/wh/async/{path}', body)
+                expected = self.client.post(f'/wh/{path}', body, format='json')
+                warm = self.async_post(f'/wh/async/{path}', body)
+                self.assertEqual(cold.status_code, expected.status_code)
+                self.assertEqual(json.loads(cold.content), json.loads(expected.content))
+                self.assertEqual(json.loads(warm.content), json.loads(expected.content))
+
+    def test_cold_availability_resolves_products_and_stock_together(self):
+        # Products, their materials and the stock of direct materials
+        with self.assertNumQueries(3):
+            response = self.async_post('/wh/async/check-availability/', self.order([(1, 1), (2, 3)]))
+        self.assertEqual(json.loads(response.content)['data'][1]['materials'][0]['available_quantity'], 15.0)
+        bom_cache.clear()
+        # Plus the sub-assembly level and the stock of its material
+        with self.assertNumQueries(5):
+            response = self.async_post('/wh/async/check-availability/', self.order([(3, 1)]))
+        self.assertEqual(json.loads(response.content)['data'][0]['materials'][-1], {
+            'material_name': 'Part',
+            'required_quantity': 2.0,
+            'available_quantity': 3.0,
+            'status': 'Enough',
+            'shortage': None,
+        })
+
+    def test_cyclic_bom(self):
+        ProductComponent.objects.bulk_create([
+            ProductComponent(product=self.products[3], component=self.products[4], quantity=1),
+            ProductComponent(product=self.products[4], component=self.products[3], quantity=1),
+        ])
+        response = self.async_post('/wh/async/check-availability/', self.order([(4, 1)]))
+        expected = self.client.post('/wh/check-availability/', self.order([(4, 1)]), format='json')
+        self.assertEqual(json.loads(response.content), json.loads(expected.content))
+
+    def test_lists_require_authentication(self):
+        response = self.async_get('/wh/async/products/')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+        response = self.async_get('/wh/async/products/', headers={'Authorization': 'Bearer broken'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(json.loads(response.content)['code'], 'token_not_valid')
+
+    def test_lists_match_sync_views(self):
+        for path in ['products/', 'materials/', 'product-materials/', 'product-components/', 'warehouses/']:
+            expected = json.loads(self.client.get(f'/wh/{path}').content)
+            response = self.async_get(f'/wh/async/{path}', headers=self.headers)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(json.loads(response.content), expected)
+
+    def test_pages_walk_both_ways(self):
+        url = '/wh/async/product-materials/?page_size=3'
+        pages = []
+        while url:
+            data = json.loads(self.async_get(url, headers=self.headers).content)
+            pages.append([row['id'] for row in data['results']])
+            url = data['next']
+        self.assertEqual(
+            [int(pk) for page in pages for pk in page],
+            list(ProductMaterial.objects.order_by('id').values_list('id', flat=True))
+        )
+        url = data['previous']
+        for page in reversed(pages[:-1]):
+            data = json.loads(self.async_get(url, headers=self.headers).content)
+            self.assertEqual([row['id'] for row in data['results']], page)
+            url = data['previous']
+        self.assertIsNone(url)
+
+    def test_options_describe_the_endpoint(self):
+        response = async_to_sync(self.async_client.options)('/wh/async/check-availability/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Allow'], 'POST, OPTIONS')
+        self.assertEqual(json.loads(response.content)['parses'], ['application/json'])
+        response = async_to_sync(self.async_client.options)('/wh/async/products/', headers=self.headers)
+        self.assertEqual(response['Allow'], 'GET, HEAD, OPTIONS')
+
+    def test_head_answers_like_get(self):
+        response = async_to_sync(self.async_client.head)('/wh/async/products/', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, b'')
+
+    def test_methods_outside_http_method_names_are_not_allowed(self):
+        response = async_to_sync(self.async_client.get)('/wh/async/check-availability/')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        response = async_to_sync(self.async_client.delete)('/wh/async/products/', headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    @override_settings(CACHE_SHARED=True)
+    def test_list_cache_is_invalidated_by_writes(self):
+        self.async_get('/wh/async/materials/', headers=self.headers)
+        with self.assertNumQueries(0):
+            self.async_get('/wh/async/materials/', headers=self.headers)
+        Material.objects.create(material_name='New')
+        response = self.async_get('/wh/async/materials/', headers=self.headers)
+        self.assertEqual(json.loads(response.content)['results'][-1]['material_name'], 'New')
+
+
+class BatchAvailabilityAPITests(WarehouseAPITestCase):
+    url = '/wh/check-availability/batch/'
+
+    def setUp(self):
+        super().setUp()
+        self.create_catalogue()
+
+    def check(self, orders, mode=None):
+        data = {'orders': [
+            {'order_id': order_id, 'priority': priority, **self.order(lines)}
+            for order_id, priority, lines in orders
+        ]}
+        if mode:
+            data['mode'] = mode
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['data']
+
+    def test_independent_orders_see_the_same_stock(self):
+        data = self.check([('A', 0, [(1, 5)]), ('B', 0, [(2, 7), (404, 1)]), ('C', 0, [(3, 4), (3, 4)])])
+        self.assertEqual(data['mode'], 'independent')
+        self.assertEqual([(order['order_id'], order['available']) for order in data['orders']], [
+            ('A', True), ('B', False), ('C', False)
+        ])
+        self.assertEqual(data['orders'][1]['unmatched_product_codes'], [404])
+        self.assertEqual(data['orders'][2]['materials'][0]['shortage'], 1.0)
+        rollup = self.client.post('/wh/check-availability/', {**self.order([(1, 5)]), 'rollup': True}, format='json')
+        self.assertEqual(data['orders'][0]['materials'], rollup.data['data']['materials'])
+
+    def test_sequential_orders_carry_stock_over_by_priority(self):
+        data = self.check([('A', 2, [(1, 5)]), ('B', 1, [(2, 4)]), ('C', 3, [(3, 1)])], mode='sequential')
+        self.assertEqual([order['available'] for order in data['orders']], [False, True, True])
+        # B took 8 of 15; A could not be covered, so C sees what B left
+        self.assertEqual(data['orders'][0]['materials'][0]['available_quantity'], 7.0)
+        self.assertEqual(data['orders'][2]['materials'][0]['available_quantity'], 7.0)
+
+    def test_query_count_does_not_grow_with_orders(self):
+        with self.assertNumQueries(3):
+            self.check([('A', 0, [(1, 1)])])
+        bom_cache.clear()
+        orders = [(str(i), i % 7, [(i % 3+1, 1), ((i+1) % 3+1, 2)]) for i in range(200)]
+        with self.assertNumQueries(3):
+            data = self.check(orders, mode='sequential')
+        self.assertEqual(len(data['orders']), 200)
+
+    def test_requires_orders(self):
+        response = self.client.post(self.url, {'orders': []}, format='json')
+        self.assertIn('orders', response.data)
+
+
+class RequestMetricsTests(WarehouseAPITestCase):
+
+    def setUp(self):
+        super().setUp()
+        metrics.clear()
+
+    def scrape(self, **kwargs):
+        response = self.client.get('/wh/metrics/', **kwargs)
+        return response, response.content.decode()
+
+    def test_requests_are_recorded_by_route(self):
+        self.create_catalogue()
+        product = self.products[0]
+        user = self.login_manager()
+        self.client.get('/wh/products/')
+        self.client.get('/wh/products/')
+        self.client.get(f'/wh/product/detail-update-delete/{product.id}/')
+        self.client.get('/wh/no-such-endpoint/')
+        async_to_sync(self.async_client.get)(
+            '/wh/async/products/', headers={'Authorization': f"Bearer {user.token()['access']}"}
+        )
+
+        response, text = self.scrape()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('wh_requests_total{method="GET",route="/wh/products/",status="200"} 2', text)
+        self.assertIn('wh_requests_total{method="GET",route="/wh/product/detail-update-delete/<uuid:id>/",status="200"} 1', text)
+        self.assertIn('wh_requests_total{method="GET",route="unmatched",status="404"} 1', text)
+        self.assertIn('wh_requests_total{method="GET",route="/wh/async/products/",status="200"} 1', text)
+        self.assertIn('wh_request_duration_seconds_count{method="GET",route="/wh/products/"} 2', text)
+        self.assertIn('wh_request_duration_seconds_bucket{method="GET",route="/wh/products/",le="+Inf"} 2', text)
+        self.assertIn('wh_request_latency_seconds{method="GET",route="/wh/products/",quantile="0.99"}', text)
+
+        stats = metrics.routes[('GET', '/wh/products/')]
+        # The second request is served from the list cache
+        self.assertGreater(stats.queries, 0)
+        self.assertGreater(stats.db_seconds, 0)
+        self.assertGreater(stats.render_seconds, 0)
+        self.assertGreater(metrics.routes[('GET', '/wh/async/products/')].queries, 0)
+
+    def test_serializer_time_is_recorded(self):
+        self.create_catalogue()
+        self.login_manager()
+        self.client.get('/wh/products/')
+        self.client.post('/wh/check-availability/', self.order([(1, 1)]), format='json')
+        _, text = self.scrape()
+        self.assertIn('wh_request_serializer_seconds_total{method="GET",route="/wh/products/"}', text)
+        self.assertGreater(metrics.routes[('GET', '/wh/products/')].serializer_seconds, 0)
+        self.assertGreater(metrics.routes[('POST', '/wh/check-availability/')].serializer_seconds, 0)
+        # Nested serializers count once
+        sample = RequestSample(RequestFactory().get('/'))
+        token = current_sample.set(sample)
+        start = perf_counter()
+        try:
+            ProductMaterialSerializer(ProductMaterial.objects.all(), many=True).data
+        finally:
+            seconds = perf_counter()-start
+            current_sample.reset(token)
+        self.assertGreater(sample.serializer_seconds, 0)
+        self.assertLessEqual(sample.serializer_seconds, seconds)
+
+    def test_streamed_bodies_are_measured_to_the_end(self):
+        self.create_catalogue()
+        self.login_manager()
+        response = self.client.get('/wh/warehouse/export/')
+        self.assertNotIn(('GET', '/wh/warehouse/export/'), metrics.routes)
+        with CaptureQueriesContext(connection) as queries:
+            b''.join(response.streaming_content)
+        response.close()
+        stats = metrics.routes[('GET', '/wh/warehouse/export/')]
+        self.assertTrue(queries.captured_queries)
+        self.assertEqual(stats.latency.count, 1)
+        self.assertEqual(stats.queries, len(queries.captured_queries))
+
+    def test_histogram_quantiles(self):
+        histogram = LogLinearHistogram()
+        for milliseconds in range(1, 1001):
+            histogram.record(milliseconds/1000)
+        for q in (0.5, 0.9, 0.99):
+            self.assertAlmostEqual(histogram.quantile(q), q, delta=q/histogram.sub_buckets)
+        self.assertEqual(histogram.quantile(1), 1)
+        self.assertLess(len(histogram.counts), 200)
+
+    @override_settings(WH_SLOW_REQUEST_SECONDS=1e-9)
+    def test_slow_requests_are_logged(self):
+        self.login_manager()
+        with self.assertLogs('wh.metrics', 'WARNING') as logs:
+            self.client.get('/wh/products/')
+        self.assertIn('Slow request: GET /wh/products/ (/wh/products/) 200', logs.output[0])
+
+    @override_settings(WH_METRICS_TOKEN='scrape-token')
+    def test_metrics_token(self):
+        self.assertEqual(self.scrape()[0].status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION='Bearer scrape-token')[0].status_code, status.HTTP_200_OK)
+
+
+class GenerateCatalogueTests(WarehouseAPITestCase):
+
+    def generate(self, *args):
+        out = StringIO()
+        call_command(
+            'generate_catalogue', '--products', '20', '--materials', '10', '--fan-out', '3', '--components', '2',
+            '--batches-per-material', '2', *args, stdout=out
+        )
+        return out.getvalue()
+
+    def bom(self, first_code):
+        return sorted(
+            (product_code-first_code, material_name, quantity)
+            for product_code, material_name, quantity in ProductMaterial.objects.filter(
+                product__product_code__gte=first_code, product__product_code__lt=first_code+20
+            ).values_list('product__product_code', 'material__material_name', 'quantity')
+        )
+
+    def test_generates_the_requested_catalogue(self):
+        self.assertIn('Created 20 products (codes 1-20), 10 materials, 60 product materials, 37 product components '
+                      'and 20 warehouse batches', self.generate('--seed', '7'))
+        self.assertEqual(Warehouse.objects.count(), 20)
+        call_command('rebuild_stock_summaries', '--verify', stdout=StringIO())
+
+        response = self.client.post('/wh/check-availability/', self.order([(20, 1)]), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreaterEqual(len(response.data['data'][0]['materials']), 3)
+
+    def test_same_seed_same_catalogue(self):
+        self.generate('--seed', '7')
+        self.assertIn('codes 21-40', self.generate('--seed', '7'))
+        self.assertEqual(self.bom(1), self.bom(21))
+        self.generate('--seed', '8')
+        self.assertNotEqual(self.bom(1), self.bom(41))
@@ -5,7 +5,16 @@ from .views import ProductCreateAPIView, ProductListAPIView, \
             ProductMaterialListAPIView, ProductMaterialCreateAPIView,\
                 ProductMaterialRetrieveUpdateDestroyAPIView, WarehouseCreateAPIView,\
                     WarehouseListAPIView, WaarehouseRetrieveUpdateDestroyAPIView,\
-                        CheckAvailibilityAPIView, MaterialBatchTrackingAPIView
+                        CheckAvailibilityAPIView, MaterialBatchTrackingAPIView,\
+                            WarehouseBulkCreateAPIView, ProductMaterialBulkCreateAPIView,\
+                                BOMCacheStatsAPIView, WarehouseExportAPIView, ReservationCreateAPIView,\
+                                    ReservationRetrieveAPIView, ReservationCommitAPIView, ReservationReleaseAPIView,\
+                                        ProductComponentCreateAPIView, ProductComponentListAPIView,\
+                                            ProductComponentRetrieveUpdateDestroyAPIView, MaxBuildableAPIView,\
+                                                BatchAvailabilityAPIView, MetricsAPIView
+from .async_views import AsyncCheckAvailibilityAPIView, AsyncMaterialBatchTrackingAPIView,\
+    AsyncProductListAPIView, AsyncMaterialListAPIView, AsyncProductMaterialListAPIView,\
+        AsyncProductComponentListAPIView, AsyncWarehouseListAPIView
                 
 
 
@@ -18,10 +27,32 @@ urlpatterns = [
     path('material/detail-update-delete/<int:pk>/', MaterialRetrieveUpdateDestroyAPIView.as_view()),
     path('product-materials/', ProductMaterialListAPIView.as_view()),
     path('product-material/create/', ProductMaterialCreateAPIView.as_view()),
+    path('product-material/bulk-create/', ProductMaterialBulkCreateAPIView.as_view()),
     path('product-material/detail-update-delete/<int:pk>/', ProductMaterialRetrieveUpdateDestroyAPIView.as_view()),
+    path('product-components/', ProductComponentListAPIView.as_view()),
+    path('product-component/create/', ProductComponentCreateAPIView.as_view()),
+    path('product-component/detail-update-delete/<int:pk>/', ProductComponentRetrieveUpdateDestroyAPIView.as_view()),
     path('warehouses/', WarehouseListAPIView.as_view()),
     path('warehouse/create/', WarehouseCreateAPIView.as_view()),
+    path('warehouse/bulk-create/', WarehouseBulkCreateAPIView.as_view()),
+    path('warehouse/export/', WarehouseExportAPIView.as_view()),
     path('warehouse/detail-update-delete/<int:pk>/', WaarehouseRetrieveUpdateDestroyAPIView.as_view()),
     path('check-availability/', CheckAvailibilityAPIView.as_view()),
+    path('check-availability/batch/', BatchAvailabilityAPIView.as_view()),
     path('material-batch-tracking/', MaterialBatchTrackingAPIView.as_view()),
+    path('max-buildable/', MaxBuildableAPIView.as_view()),
+    path('bom-cache/stats/', BOMCacheStatsAPIView.as_view()),
+    path('metrics/', MetricsAPIView.as_view()),
+    path('reservation/create/', ReservationCreateAPIView.as_view()),
+    path('reservation/detail/<uuid:id>/', ReservationRetrieveAPIView.as_view()),
+    path('reservation/<uuid:id>/commit/', ReservationCommitAPIView.as_view()),
+    path('reservation/<uuid:id>/release/', ReservationReleaseAPIView.as_view()),
+    #Async (ASGI) variants
+    path('async/products/', AsyncProductListAPIView.as_view()),
+    path('async/materials/', AsyncMaterialListAPIView.as_view()),
+    path('async/product-materials/', AsyncProductMaterialListAPIView.as_view()),
+    path('async/product-components/', AsyncProductComponentListAPIView.as_view()),
+    path('async/warehouses/', AsyncWarehouseListAPIView.as_view()),
+    path('async/check-availability/', AsyncCheckAvailibilityAPIView.as_view()),
+    path('async/material-batch-tracking/', AsyncMaterialBatchTrackingAPIView.as_view()),
 ]
@@ -0,0 +1,144 @@
+from django.conf import settings
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+
+def use_vectorized(line_count):
+    """Whether an order of ``line_count`` lines should take the NumPy path."""
+    return np is not None and line_count >= settings.WH_VECTORIZE_MIN_LINES
+
+
+class BOMMatrix:
+    """
+    The BOMs of a catalogue as a sparse product x material matrix in CSR form,
+    with material columns numbered in order of first appearance.
+    """
+
+    def __init__(self, catalogue, stock):
+        self.rows = {}
+        material_columns = {}
+        self.material_ids = []
+        self.material_names = []
+        indptr = [0]
+        columns = []
+        quantities = []
+        for product_code, (_, bom) in catalogue.items():
+            self.rows[product_code] = len(self.rows)
+            for material_id, material_name, quantity in bom:
+                column = material_columns.get(material_id)
+                if column is None:
+                    column = material_columns[material_id] = len(self.material_ids)
+                    self.material_ids.append(material_id)
+                    self.material_names.append(material_name)
+                columns.append(column)
+                quantities.append(quantity)
+            indptr.append(len(columns))
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.columns = np.array(columns, dtype=np.int64)
+        self.quantities = np.array(quantities, dtype=np.float64)
+        # Stock as stored, so materials without any keep their integer 0
+        self.stock = [stock.get(material_id, 0) for material_id in self.material_ids]
+        self.stock_vector = np.array(self.stock, dtype=np.float64)
+
+    def expand(self, product_codes, line_quantities):
+        """
+        Scale the rows of ``product_codes`` by ``line_quantities``: returns one
+        ``(column, required quantity)`` entry per line and BOM material, lines
+        in order, plus the end offset of each line.
+        """
+        line_rows = np.array([self.rows[product_code] for product_code in product_codes], dtype=np.int64)
+        counts = self.indptr[line_rows+1]-self.indptr[line_rows]
+        line_ends = np.cumsum(counts)
+        # Positions of each line's BOM entries in the CSR arrays, concatenated
+        entries = np.repeat(self.indptr[line_rows]-(line_ends-counts), counts)+np.arange(line_ends[-1] if len(counts) else 0)
+        required = self.quantities[entries]*np.repeat(np.array(line_quantities, dtype=np.float64), counts)
+        return self.columns[entries], required, line_ends
+
+    def statuses(self, columns, required):
+        available = self.stock_vector[columns]
+        return (available >= required).tolist(), (required-available).tolist()
+
+
+def availability_lines(items, catalogue, stock, unmatched_message):
+    """
+    Vectorized ``check_availability``: the same result from the same inputs.
+    A line's result only depends on its product and quantity, so each distinct
+    pair is computed once and shared by the lines repeating it.
+    """
+    matrix = BOMMatrix(catalogue, stock)
+    pairs = list(dict.fromkeys(
+        (item['product_code'], item['quantity']) for item in items if item['product_code'] in catalogue
+    ))
+    columns, required, line_ends = matrix.expand(
+        [product_code for product_code, _ in pairs], [quantity for _, quantity in pairs]
+    )
+    enough, shortages = matrix.statuses(columns, required)
+    columns = columns.tolist()
+    required = required.tolist()
+    names = matrix.material_names
+    material_stock = matrix.stock
+
+    materials_by_pair = {}
+    start = 0
+    for pair, end in zip(pairs, line_ends.tolist()):
+        materials_by_pair[pair] = [
+            {
+                'material_name': names[columns[i]],
+                'required_quantity': required[i],
+                'available_quantity': material_stock[columns[i]],
+                'status': 'Enough' if enough[i] else 'Not enough',
+                'shortage': None if enough[i] else shortages[i]
+            }
+            for i in range(start, end)
+        ]
+        start = end
+
+    required_materials = []
+    for item in items:
+        entry = catalogue.get(item['product_code'])
+        if entry is None:
+            required_materials.append({
+                'input_code': item['product_code'],
+                'message': unmatched_message
+            })
+            continue
+        required_materials.append({
+            'product_name': entry[0],
+            'materials': materials_by_pair[(item['product_code'], item['quantity'])]
+        })
+    return required_materials
+
+
+def availability_rollup(items, catalogue, stock):
+    """Vectorized ``check_availability_rollup`` materials, in order of first use."""
+    matrix = BOMMatrix(catalogue, stock)
+    lines = [item for item in items if item['product_code'] in catalogue]
+    columns, required, _ = matrix.expand(
+        [item['product_code'] for item in lines], [item['quantity'] for item in lines]
+    )
+    # Sums per material in entry order, like accumulate_requirements
+    required = np.bincount(columns, weights=required, minlength=len(matrix.material_ids))
+    # First use follows the first lines of each product, no need to scan every entry
+    order = list(dict.fromkeys(
+        column
+        for product_code in dict.fromkeys(item['product_code'] for item in lines)
+        for column in matrix.columns[matrix.indptr[matrix.rows[product_code]]:matrix.indptr[matrix.rows[product_code]+1]].tolist()
+    ))
+    order_index = np.array(order, dtype=np.int64)
+    required = required[order_index]
+    enough, shortages = matrix.statuses(order_index, required)
+    required = required.tolist()
+    return [
+        {
+            'material_id': matrix.material_ids[column],
+            'material_name': matrix.material_names[column],
+            'required_quantity': required[i],
+            'available_quantity': matrix.stock[column],
+            'status': 'Enough' if enough[i] else 'Not enough',
+            'shortage': None if enough[i] else shortages[i]
+        }
+        for i, column in enumerate(order)
+    ]
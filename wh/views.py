@@ -1,14 +1,53 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import ProtectedError
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
-from rest_framework.generics import CreateAPIView, ListAPIView, RetrieveUpdateDestroyAPIView
-from rest_framework import permissions
+from django.utils.crypto import constant_time_compare
+from rest_framework.generics import CreateAPIView, ListAPIView, RetrieveAPIView, RetrieveUpdateDestroyAPIView
+from rest_framework import permissions, status
+from rest_framework.exceptions import NotAuthenticated
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from .serializers import ProductSerializer, MaterialSerializer,\
     ProductMaterialSerializer, WarehouseSerializer, CheckAvailabilitySerializer,\
-        MaterialBatchTrackingSerializer
+        MaterialBatchTrackingSerializer, BulkCreateParamsSerializer, BOMImportParamsSerializer,\
+            WarehouseExportParamsSerializer, ReservationCreateSerializer, ReservationSerializer,\
+                ProductComponentSerializer, MaxBuildableSerializer, BatchAvailabilitySerializer, cyclic_bom_error
+from .bom import BOMCycleError
+from .bom_cache import bom_cache
+from .bom_snapshot import bom_snapshot
+from .bulk import ingest_warehouse_rows, import_bom_rows, is_row_stream
+from .caching import CachedListMixin
+from .metrics import metrics
+from .fast_serializers import FastListMixin, ProductReadSerializer, MaterialReadSerializer,\
+    ProductMaterialReadSerializer, ProductComponentReadSerializer, WarehouseReadSerializer
 from .custom_permissions import IsAdminOrReadOnly
-from .models import Product, ProductMaterial, Material, Warehouse
+from .exports import WAREHOUSE_EXPORT_FORMATS
+from .parsers import CSVParser, NDJSONParser
+from .models import Product, ProductMaterial, ProductComponent, Material, Warehouse, Reservation
+from .reservations import reserve, commit, release, UnknownProducts, InsufficientStock,\
+    StockConflict, ReservationStateError
+
+
+# Querysets for the serializers that nest products and materials: join the
+# related rows and load only the columns those serializers render.
+product_material_queryset = ProductMaterial.objects.select_related('product', 'material').only(
+    'id', 'quantity',
+    'product__id', 'product__product_name', 'product__product_code',
+    'material__id', 'material__material_name',
+)
+product_component_queryset = ProductComponent.objects.select_related('product', 'component').only(
+    'id', 'quantity',
+    'product__id', 'product__product_name', 'product__product_code',
+    'component__id', 'component__product_name', 'component__product_code',
+)
+warehouse_queryset = Warehouse.objects.select_related('material').only(
+    'id', 'remainder', 'price',
+    'material__id', 'material__material_name',
+)
 
 class ProductCreateAPIView(CreateAPIView):
     serializer_class = ProductSerializer
@@ -25,7 +64,9 @@ class ProductCreateAPIView(CreateAPIView):
         })
         
 
-class ProductListAPIView(ListAPIView):
+class ProductListAPIView(CachedListMixin, FastListMixin, ListAPIView):
+    read_serializer_class = ProductReadSerializer
+    cache_models = [Product]
     permission_classes = [permissions.IsAuthenticated,]
     serializer_class = ProductSerializer
     queryset = Product.objects.all()
@@ -70,7 +111,9 @@ class MaterialCreateAPIView(CreateAPIView):
         })
         
 
-class MaterialListAPIView(ListAPIView):
+class MaterialListAPIView(CachedListMixin, FastListMixin, ListAPIView):
+    read_serializer_class = MaterialReadSerializer
+    cache_models = [Material]
     permission_classes = [permissions.IsAuthenticated,]
     serializer_class = MaterialSerializer
     queryset = Material.objects.all()
@@ -113,10 +156,42 @@ class ProductMaterialCreateAPIView(CreateAPIView):
         })
         
 
-class ProductMaterialListAPIView(ListAPIView):
+class ProductMaterialBulkCreateAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdminOrReadOnly]
+    parser_classes = [JSONParser, NDJSONParser, CSVParser]
+    
+    def post(self, request, *args, **kwargs):
+        params = BOMImportParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        chunk_size = params.validated_data.get('chunk_size', settings.WH_BULK_CHUNK_SIZE)
+        
+        rows = request.data
+        if not is_row_stream(rows):
+            return Response({
+                'success':False,
+                'message':'Data should be list of product materials'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            result = import_bom_rows(rows, chunk_size, upsert=params.validated_data['upsert'])
+        except IntegrityError:
+            return Response({
+                'success':False,
+                'message':'Product materials were changed by another import, please retry'
+            }, status=status.HTTP_409_CONFLICT)
+        return Response({
+            'success':not result['errors'],
+            'message':f"{result['created']} created, {result['updated']} updated of {result['rows']} product materials",
+            'data':result
+        }, status=status.HTTP_201_CREATED)
+        
+
+class ProductMaterialListAPIView(CachedListMixin, FastListMixin, ListAPIView):
+    read_serializer_class = ProductMaterialReadSerializer
+    cache_models = [ProductMaterial, Product, Material]
     permission_classes = [permissions.IsAuthenticated,]
     serializer_class = ProductMaterialSerializer
-    queryset = ProductMaterial.objects.all()
+    queryset = product_material_queryset
     
     def get(self, request, *args, **kwargs):
         response = super().get(request, *args, **kwargs)
@@ -126,7 +201,7 @@ class ProductMaterialListAPIView(ListAPIView):
 class ProductMaterialRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
     serializer_class = ProductMaterialSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrReadOnly]
-    queryset = ProductMaterial.objects.all()
+    queryset = product_material_queryset
 
     
     def update(self, request, *args, **kwargs):
@@ -143,11 +218,55 @@ class ProductMaterialRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
             'message':'Product Material deleted successfully'
         })
         
+        
+#ProductComponent CRUD
+class ProductComponentCreateAPIView(CreateAPIView):
+    serializer_class = ProductComponentSerializer
+    permission_classes = [permissions.IsAuthenticated, IsAdminOrReadOnly, ]
+    
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        
+        return Response({
+            'success':True,
+            'message':'ProductComponent Created!',
+            'data':response.data
+        })
+        
+
+class ProductComponentListAPIView(CachedListMixin, FastListMixin, ListAPIView):
+    read_serializer_class = ProductComponentReadSerializer
+    cache_models = [ProductComponent, Product]
+    permission_classes = [permissions.IsAuthenticated,]
+    serializer_class = ProductComponentSerializer
+    queryset = product_component_queryset
+    
+
+class ProductComponentRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
+    serializer_class = ProductComponentSerializer
+    permission_classes = [permissions.IsAuthenticated, IsAdminOrReadOnly]
+    queryset = product_component_queryset
+    
+    def update(self, request, *args, **kwargs):
+        response = super().update(request, *args, **kwargs) 
+        return Response({
+            'message':'Product Component updated successfully',
+            'data':response.data
+        })
+        
+    def delete(self, request, *args, **kwargs):
+        super().delete(request, *args, **kwargs)
+        return Response({
+            'success':True,
+            'message':'Product Component deleted successfully'
+        })
+        
 #Warehouse CRUD
 class WarehouseCreateAPIView(CreateAPIView):
     serializer_class = WarehouseSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrReadOnly]
     
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         response = super().create(request, *args, **kwargs)
         return Response({
@@ -156,14 +275,40 @@ class WarehouseCreateAPIView(CreateAPIView):
             'data':response.data
         })
         
+
+class WarehouseBulkCreateAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdminOrReadOnly]
+    parser_classes = [JSONParser, NDJSONParser, CSVParser]
     
-class WarehouseListAPIView(ListAPIView):
+    def post(self, request, *args, **kwargs):
+        params = BulkCreateParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        chunk_size = params.validated_data.get('chunk_size', settings.WH_BULK_CHUNK_SIZE)
+        
+        rows = request.data
+        if not is_row_stream(rows):
+            return Response({
+                'success':False,
+                'message':'Data should be list of warehouse items'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        result = ingest_warehouse_rows(rows, chunk_size)
+        return Response({
+            'success':not result['errors'],
+            'message':f"{result['created']} of {result['rows']} warehouse items created",
+            'data':result
+        }, status=status.HTTP_201_CREATED)
+        
+    
+class WarehouseListAPIView(CachedListMixin, FastListMixin, ListAPIView):
+    read_serializer_class = WarehouseReadSerializer
+    cache_models = [Warehouse, Material]
     serializer_class = WarehouseSerializer
     permission_classes = [permissions.IsAuthenticated,]
-    queryset = Warehouse.objects.all()
+    queryset = warehouse_queryset
     
     def get(self, request, *args, **kwargs):
-        response = super().get(self, request, *args, **kwargs)
+        response = super().get(request, *args, **kwargs)
         return Response({
             'success':True,
             'message':'Warehous loaded successfully!',
@@ -171,11 +316,35 @@ class WarehouseListAPIView(ListAPIView):
         })
         
 
+class WarehouseExportAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated,]
+    
+    def get(self, request, *args, **kwargs):
+        params = WarehouseExportParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        output = params.validated_data['output']
+        
+        queryset = Warehouse.objects.all()
+        if 'material' in params.validated_data:
+            queryset = queryset.filter(material_id=params.validated_data['material'])
+        if params.validated_data['in_stock']:
+            queryset = queryset.filter(remainder__gt=0)
+        
+        generate, content_type = WAREHOUSE_EXPORT_FORMATS[output]
+        response = StreamingHttpResponse(
+            generate(queryset, settings.WH_EXPORT_CHUNK_SIZE),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = f'attachment; filename="warehouse.{output}"'
+        return response
+        
+
 class WaarehouseRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
     serializer_class = WarehouseSerializer
     permission_classes = [permissions.IsAuthenticated, IsAdminOrReadOnly,]
-    queryset = Warehouse.objects.all()
+    queryset = warehouse_queryset
     
+    @transaction.atomic
     def update(self, request, *args, **kwargs):
         response = super().update(request, *args, **kwargs)
         return Response({
@@ -184,7 +353,15 @@ class WaarehouseRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
             'data':response.data
         })
         
+    @transaction.atomic
     def delete(self, request, *args, **kwargs):
+        try:
+            super().delete(request, *args, **kwargs)
+        except ProtectedError:
+            return Response({
+                'success':False,
+                'message':'Warehouse item is held by reservations'
+            }, status=status.HTTP_409_CONFLICT)
         return Response({
             'success':True,
             'message':'Warehouse item deleted successfully!'
@@ -203,6 +380,18 @@ class CheckAvailibilityAPIView(APIView):
         return Response(serializer.errors)
     
 
+class BatchAvailabilityAPIView(APIView):
+    permission_classes = [permissions.AllowAny,]
+    def post(self, request, *args, **kwargs):
+        serializer = BatchAvailabilitySerializer(data=request.data)
+        if serializer.is_valid():
+            validated_data = serializer.validated_data
+            return Response({
+                'data':validated_data
+            })
+        return Response(serializer.errors)
+    
+
 class MaterialBatchTrackingAPIView(APIView):
     permission_classes = [permissions.AllowAny,]
     def post(self, request, *args, **kwargs):
@@ -212,4 +401,124 @@ class MaterialBatchTrackingAPIView(APIView):
             return Response({
                 'data':validated_data
             })
-        return Response(serializer.errors)
\ No newline at end of file
+        return Response(serializer.errors)
+    
+
+class MaxBuildableAPIView(APIView):
+    permission_classes = [permissions.AllowAny,]
+    def post(self, request, *args, **kwargs):
+        serializer = MaxBuildableSerializer(data=request.data)
+        if serializer.is_valid():
+            validated_data = serializer.validated_data
+            return Response({
+                'data':validated_data
+            })
+        return Response(serializer.errors)
+    
+
+class BOMCacheStatsAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated,]
+    
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'data':{**bom_cache.stats(), 'snapshot':bom_snapshot.stats()}
+        })
+        
+
+class MetricsAPIView(APIView):
+    # Scraped by Prometheus, which sends WH_METRICS_TOKEN as a bearer token when set
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny,]
+
+    def get(self, request, *args, **kwargs):
+        token = settings.WH_METRICS_TOKEN
+        if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            raise NotAuthenticated()
+        return HttpResponse(metrics.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    def get_authenticate_header(self, request):
+        return 'Bearer'
+        
+
+#Stock reservations
+class ReservationCreateAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdminOrReadOnly]
+    
+    def post(self, request, *args, **kwargs):
+        serializer = ReservationCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            reservation, takes = reserve(serializer.validated_data['products'])
+        except UnknownProducts as exc:
+            return Response({
+                'success':False,
+                'message':'Unmatched product code.',
+                'input_codes':exc.product_codes
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except BOMCycleError as exc:
+            raise cyclic_bom_error(exc)
+        except InsufficientStock as exc:
+            return Response({
+                'success':False,
+                'message':'Not enough stock',
+                'shortages':exc.shortages
+            }, status=status.HTTP_409_CONFLICT)
+        except StockConflict:
+            return Response({
+                'success':False,
+                'message':'Stock was changed by another order, please retry'
+            }, status=status.HTTP_409_CONFLICT)
+        
+        return Response({
+            'success':True,
+            'message':'Stock reserved!',
+            'data':{
+                'id':reservation.pk,
+                'status':reservation.status,
+                'lines':[
+                    {'batch_id':batch_id, 'material_id':material_id, 'quantity':quantity}
+                    for (batch_id, material_id), quantity in takes.items()
+                ]
+            }
+        }, status=status.HTTP_201_CREATED)
+
+
+class ReservationRetrieveAPIView(RetrieveAPIView):
+    serializer_class = ReservationSerializer
+    permission_classes = [permissions.IsAuthenticated,]
+    queryset = Reservation.objects.prefetch_related('lines')
+    lookup_field = 'id'
+
+
+class ReservationStatusAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated, IsAdminOrReadOnly]
+    action = None
+    message = None
+    
+    def post(self, request, id, *args, **kwargs):
+        try:
+            self.action(id)
+        except Reservation.DoesNotExist:
+            return Response({
+                'success':False,
+                'message':'Reservation not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        except ReservationStateError as exc:
+            return Response({
+                'success':False,
+                'message':str(exc)
+            }, status=status.HTTP_409_CONFLICT)
+        return Response({
+            'success':True,
+            'message':self.message
+        })
+
+
+class ReservationCommitAPIView(ReservationStatusAPIView):
+    action = staticmethod(commit)
+    message = 'Reservation committed!'
+
+
+class ReservationReleaseAPIView(ReservationStatusAPIView):
+    action = staticmethod(release)
+    message = 'Reservation released!'